@@ -0,0 +1,127 @@
+"""
+Cached dashboard summary.
+The summary is recomputed by a background thread on a fixed cadence (its Flux
+queries run concurrently) and readers get the latest snapshot, so the cost of
+`GET /api/v1/dashboard_summary` does not depend on how many dashboards poll it.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+
+class DashboardSummaryCache:
+    """
+    Stale-while-revalidate snapshot of `InfluxDBDataService.compute_dashboard_summary`.
+
+    - age <= ttl: the snapshot is served as is
+    - ttl < age <= max_stale: the snapshot is served and a refresh is triggered
+    - no snapshot or age > max_stale: the caller waits for a refresh
+    Only one refresh runs at a time; concurrent callers share its result.
+    """
+
+    def __init__(self, data_service, ttl: Optional[float] = None,
+                 max_stale: Optional[float] = None, refresh_interval: Optional[float] = None):
+        self.data_service = data_service
+        self.ttl = ttl or float(os.getenv("DASHBOARD_CACHE_TTL", "10"))
+        self.max_stale = max_stale or float(os.getenv("DASHBOARD_CACHE_MAX_STALE", "120"))
+        self.refresh_interval = refresh_interval or float(os.getenv("DASHBOARD_REFRESH_INTERVAL", str(self.ttl)))
+
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._computed_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_done = threading.Condition(self._lock)
+        self._refreshing = False
+
+        # One thread per summary query
+        self._executor = ThreadPoolExecutor(max_workers=6, thread_name_prefix="dashboard-query")
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        self.stats = {"hits": 0, "stale_hits": 0, "blocking_refreshes": 0, "refreshes": 0, "errors": 0}
+
+    def get(self) -> Dict[str, Any]:
+        """Latest summary snapshot (empty dict if it could never be computed)"""
+        self._start_refresher()
+        with self._lock:
+            age = time.monotonic() - self._computed_at
+            snapshot = self._snapshot
+            if snapshot is not None and age <= self.ttl:
+                self.stats["hits"] += 1
+                return snapshot
+            if snapshot is not None and age <= self.max_stale:
+                self.stats["stale_hits"] += 1
+                self._trigger_refresh()
+                return snapshot
+            self.stats["blocking_refreshes"] += 1
+
+        self.refresh()
+        with self._lock:
+            return self._snapshot or {}
+
+    def _trigger_refresh(self):
+        """Refresh in the background unless one is already running (lock held)"""
+        if self._refreshing:
+            return
+        threading.Thread(target=self.refresh, name="dashboard-revalidate", daemon=True).start()
+
+    def refresh(self) -> bool:
+        """Recompute the summary; callers arriving during a refresh wait for it"""
+        with self._lock:
+            if self._refreshing:
+                self._refresh_done.wait(timeout=self.max_stale)
+                return self._snapshot is not None
+            self._refreshing = True
+
+        try:
+            summary = self.data_service.compute_dashboard_summary(self._executor)
+        except Exception as e:
+            print(f"Error refreshing dashboard summary: {e}")
+            summary = None
+
+        with self._lock:
+            self._refreshing = False
+            if summary:
+                summary["generated_at"] = datetime.utcnow().isoformat()
+                self._snapshot = summary
+                self._computed_at = time.monotonic()
+                self.stats["refreshes"] += 1
+            else:
+                self.stats["errors"] += 1
+            self._refresh_done.notify_all()
+        return bool(summary)
+
+    def invalidate(self):
+        """Force the next reader to wait for fresh data"""
+        with self._lock:
+            self._computed_at = 0.0
+            self._snapshot = None
+
+    # Background refresh
+    def _start_refresher(self):
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return
+        with self._refresh_lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            self._stop.clear()
+            self._refresh_thread = threading.Thread(target=self._run, name="dashboard-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+    def close(self):
+        self._stop.set()
+        if self._refresh_thread:
+            self._refresh_thread.join(timeout=1)
+        self._executor.shutdown(wait=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            age = time.monotonic() - self._computed_at if self._snapshot is not None else None
+        return {**self.stats, "snapshot_age_seconds": age, "ttl": self.ttl, "max_stale": self.max_stale}
@@ -0,0 +1,244 @@
+"""
+In-memory device registry backed by the InfluxDB `devices` measurement.
+The registry serves device lookups from memory and coalesces `last_seen`
+updates, which are flushed periodically as one batched write instead of a
+query + write per telemetry message. It is reloaded periodically, and sooner
+when an unknown device reports, so devices created by another process (API vs
+ingest worker) are picked up.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from influxdb_client import Point, WritePrecision
+
+# Latest value of every field of every device
+DEVICES_QUERY = '''
+from(bucket: params.bucket)
+|> range(start: -1y)
+|> filter(fn: (r) => r._measurement == "devices")
+|> last()
+'''
+
+
+class DeviceRegistry:
+    """
+    Device cache keyed by device_id.
+
+    Device CRUD goes through the data service and refreshes the cache entry
+    (write-through); `touch` only records the newest last_seen per device in
+    memory until the next flush.
+    """
+
+    # Minimum delay between two load attempts when InfluxDB is unreachable
+    # or when unknown devices keep reporting
+    RELOAD_BACKOFF = 30.0
+    # Activity of unknown devices kept until the next reload
+    MAX_UNKNOWN = 10_000
+
+    def __init__(self, data_service, flush_interval: Optional[float] = None,
+                 refresh_interval: Optional[float] = None):
+        self.data_service = data_service
+        self.flush_interval = flush_interval or float(os.getenv("DEVICE_LAST_SEEN_FLUSH_INTERVAL", "10"))
+        self.refresh_interval = refresh_interval or float(os.getenv("DEVICE_REGISTRY_REFRESH_INTERVAL", "300"))
+
+        self._devices: Dict[str, Dict[str, Any]] = {}
+        self._pending_last_seen: Dict[str, datetime] = {}
+        self._unknown_last_seen: Dict[str, datetime] = {}
+        self._reload_requested = False
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._last_load_attempt = 0.0
+
+        self._flush_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # Loading
+    def load(self) -> bool:
+        """(Re)load every device from InfluxDB, keeping the latest value of each field"""
+        self._last_load_attempt = time.monotonic()
+        try:
+            result = self.data_service.query_api.query(DEVICES_QUERY, params={"bucket": self.data_service.bucket})
+        except Exception as e:
+            print(f"Error loading device registry: {e}")
+            return False
+
+        devices: Dict[str, Dict[str, Any]] = {}
+        for table in result:
+            for record in table.records:
+                device_id = record.values.get("device_id")
+                if not device_id:
+                    continue
+                device = devices.setdefault(device_id, self._empty_device(device_id))
+                device.update(self._decode_field(record.get_field(), record.get_value()))
+
+        with self._lock:
+            # Keep entries written through the registry before or during the load
+            for device_id, device in self._devices.items():
+                devices.setdefault(device_id, device)
+            # Keep last_seen values that arrived while the query was running
+            for device_id, last_seen in self._pending_last_seen.items():
+                if device_id in devices:
+                    devices[device_id]["last_seen"] = last_seen
+            self._devices = devices
+            self._loaded = True
+            # Devices that reported before they were known: record their activity now
+            unknown, self._unknown_last_seen = self._unknown_last_seen, {}
+            self._reload_requested = False
+            for device_id, last_seen in unknown.items():
+                if device_id in devices:
+                    self._record_last_seen(device_id, last_seen)
+        print(f"Device registry loaded ({len(devices)} devices)")
+        self._start_flusher()
+        return True
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        if not self._last_load_attempt or time.monotonic() - self._last_load_attempt >= self.RELOAD_BACKOFF:
+            self.load()
+
+    def _reload_due(self) -> bool:
+        elapsed = time.monotonic() - self._last_load_attempt
+        if self._reload_requested:
+            return elapsed >= self.RELOAD_BACKOFF
+        return elapsed >= self.refresh_interval
+
+    @staticmethod
+    def _empty_device(device_id: str) -> Dict[str, Any]:
+        return {
+            "device_id": device_id,
+            "name": None,
+            "fw_version": None,
+            "type": None,
+            "location": None,
+            "tags": [],
+            "last_seen": None,
+        }
+
+    @staticmethod
+    def _decode_field(field: str, value: Any) -> Dict[str, Any]:
+        if field == "tags":
+            try:
+                return {"tags": json.loads(value) if value else []}
+            except (TypeError, ValueError):
+                return {"tags": []}
+        if field == "last_seen":
+            try:
+                return {"last_seen": datetime.fromisoformat(value) if value else None}
+            except (TypeError, ValueError):
+                return {"last_seen": None}
+        return {field: value if value != "" else None}
+
+    # Reads
+    def get(self, device_id: str) -> Optional[Dict[str, Any]]:
+        """Cached device, or None if unknown"""
+        self._ensure_loaded()
+        with self._lock:
+            device = self._devices.get(device_id)
+            return dict(device) if device else None
+
+    def list(self) -> List[Dict[str, Any]]:
+        """All cached devices"""
+        self._ensure_loaded()
+        with self._lock:
+            return [dict(device) for device in self._devices.values()]
+
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    # Writes
+    def put(self, device: Dict[str, Any]):
+        """Insert or refresh a device entry after it has been written to InfluxDB"""
+        device_id = device["device_id"]
+        with self._lock:
+            entry = self._devices.get(device_id) or self._empty_device(device_id)
+            entry.update({k: v for k, v in device.items() if v is not None or k not in entry})
+            self._devices[device_id] = entry
+
+    def invalidate(self, device_id: Optional[str] = None):
+        """Drop one device (or the whole cache) so it is reloaded on next access"""
+        with self._lock:
+            if device_id is None:
+                self._loaded = False
+                self._last_load_attempt = 0.0
+            else:
+                self._devices.pop(device_id, None)
+
+    def touch(self, device_id: str, last_seen: datetime) -> bool:
+        """
+        Record activity for a known device; persisted on the next flush.
+
+        Activity of an unknown device is kept and a reload is requested: it is
+        recorded if the device shows up (e.g. created by another process).
+        """
+        self._ensure_loaded()
+        with self._lock:
+            known = self._record_last_seen(device_id, last_seen)
+            if not known:
+                if device_id in self._unknown_last_seen or len(self._unknown_last_seen) < self.MAX_UNKNOWN:
+                    self._unknown_last_seen[device_id] = last_seen
+                self._reload_requested = True
+        self._start_flusher()
+        return known
+
+    def _record_last_seen(self, device_id: str, last_seen: datetime) -> bool:
+        device = self._devices.get(device_id)
+        if device is None:
+            return False
+        try:
+            newer = device.get("last_seen") is None or last_seen > device["last_seen"]
+        except TypeError:
+            # naive vs aware timestamps: trust the incoming one
+            newer = True
+        if newer:
+            device["last_seen"] = last_seen
+            self._pending_last_seen[device_id] = last_seen
+        return True
+
+    def flush(self) -> int:
+        """Write all pending last_seen updates as one batch"""
+        with self._lock:
+            pending, self._pending_last_seen = self._pending_last_seen, {}
+        if not pending or not self.data_service.writer:
+            return 0
+
+        now = datetime.utcnow()
+        points = [
+            Point("devices")
+            .tag("device_id", device_id)
+            .field("last_seen", last_seen.isoformat())
+            .time(now, WritePrecision.NS)
+            for device_id, last_seen in pending.items()
+        ]
+        return self.data_service.writer.enqueue_many(points)
+
+    # Background flushing
+    def _start_flusher(self):
+        if self._flush_thread and self._flush_thread.is_alive():
+            return
+        with self._lock:
+            if self._flush_thread and self._flush_thread.is_alive():
+                return
+            self._stop.clear()
+            self._flush_thread = threading.Thread(target=self._run, name="device-registry-flush", daemon=True)
+            self._flush_thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            if self._reload_due():
+                self.load()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing device last_seen: {e}")
+
+    def close(self):
+        """Stop the flusher and persist what is pending"""
+        self._stop.set()
+        if self._flush_thread:
+            self._flush_thread.join(timeout=self.flush_interval + 1)
+        self.flush()
@@ -0,0 +1,242 @@
+"""
+Streaming exports of telemetry, alerts and Suricata logs.
+Rows are read from InfluxDB with query_stream (pivoted server-side) and
+serialized chunk by chunk, so memory use does not depend on the export size
+and there is no row cap. XLSX files are produced with openpyxl's write-only
+mode into a temporary file that is streamed back and deleted.
+"""
+import csv
+import io
+import itertools
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .flux_query import FluxQuery, parse_duration
+from .flux_records import stream_records
+
+# Rows serialized per yielded chunk (CSV / NDJSON)
+CHUNK_ROWS = 500
+# Bytes per chunk when streaming a finished XLSX file
+FILE_CHUNK_SIZE = 64 * 1024
+
+STREAMING_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+
+def suricata_severity_label(severity: Any) -> str:
+    """Libellé d'une sévérité Suricata (stockée en texte: "1" à "4")"""
+    return {"1": "CRITIQUE", "2": "ÉLEVÉ", "3": "MOYEN"}.get(str(severity), "FAIBLE")
+
+
+@dataclass
+class ExportSpec:
+    """Measurement, columns and default window of one export"""
+    name: str
+    measurement: str
+    window: str
+    # (record key, header) in output order
+    columns: List[Tuple[str, str]]
+    tags: List[str] = field(default_factory=list)
+    time_key: str = "ts"
+    formatters: Dict[str, Callable[[Any], Any]] = field(default_factory=dict)
+    header_color: Optional[str] = None
+
+    @property
+    def fields(self) -> List[str]:
+        return [key for key, _ in self.columns if key != self.time_key and key not in self.tags]
+
+    @property
+    def headers(self) -> List[str]:
+        return [header for _, header in self.columns]
+
+
+EXPORT_SPECS: Dict[str, ExportSpec] = {
+    "telemetry": ExportSpec(
+        name="telemetry",
+        measurement="telemetry",
+        window="24h",
+        columns=[("device_id", "device_id"), ("ts", "ts"), ("temperature", "temperature"),
+                 ("humidity", "humidity"), ("distance", "distance"), ("tx_bytes", "tx_bytes"),
+                 ("rx_bytes", "rx_bytes"), ("connections", "connections")],
+        tags=["device_id"],
+    ),
+    "alerts": ExportSpec(
+        name="alerts",
+        measurement="alerts",
+        window="7d",
+        columns=[("alert_id", "alert_id"), ("device_id", "device_id"), ("ts", "ts"),
+                 ("severity", "severity"), ("score", "score"), ("reason", "reason"),
+                 ("acknowledged", "acknowledged")],
+        # alert_id and severity are listed as fields so both alert schemas (v1: alert_id tag,
+        # severity field; v2: the reverse) pass the field filter and are kept
+        tags=["device_id"],
+    ),
+    "logs": ExportSpec(
+        name="logs",
+        measurement="suricata_alerts",
+        window="24h",
+        columns=[("event_ts", "event_ts"), ("event_type", "event_type"), ("src_ip", "src_ip"),
+                 ("src_port", "src_port"), ("dest_ip", "dest_ip"), ("dest_port", "dest_port"),
+                 ("proto", "proto"), ("signature", "signature"), ("signature_id", "signature_id"),
+                 ("severity", "severity")],
+        time_key="event_ts",
+    ),
+    "suricata_alerts": ExportSpec(
+        name="suricata_alerts",
+        measurement="suricata_alerts",
+        window="24h",
+        columns=[("event_ts", "Timestamp"), ("signature", "Signature"), ("severity", "Severity"),
+                 ("src_ip", "Source IP"), ("src_port", "Source Port"), ("dest_ip", "Destination IP"),
+                 ("dest_port", "Destination Port"), ("proto", "Protocol"), ("action", "Action"),
+                 ("category", "Category")],
+        time_key="event_ts",
+        formatters={"severity": suricata_severity_label},
+        header_color="D32F2F",
+    ),
+}
+
+
+def parse_time_bound(value: Optional[str]):
+    """Export bound from a query parameter: duration ("30d") or ISO datetime"""
+    if value is None:
+        return None
+    try:
+        return parse_duration(value)
+    except ValueError:
+        return datetime.fromisoformat(value)
+
+
+def build_export_query(spec: ExportSpec, bucket: str, start=None, stop=None) -> FluxQuery:
+    """Projection of the export columns, without sort/limit (rows stream in series order)"""
+    query = FluxQuery(bucket, spec.measurement, start=start or spec.window, stop=stop)
+    return query.fields(*spec.fields).keep(*spec.tags, *spec.fields)
+
+
+def iter_export_rows(data_service, spec: ExportSpec, start=None, stop=None) -> Iterator[Dict[str, Any]]:
+    """Export records straight from query_stream"""
+    flux_query, params = build_export_query(spec, data_service.bucket, start, stop).build()
+    return stream_records(data_service.query_api.query_stream(flux_query, params=params), spec.time_key)
+
+
+def prime(rows: Iterator[Any]) -> Iterator[Any]:
+    """
+    Pull the first row now so connection/query errors surface before the
+    response headers are sent, then replay it ahead of the remaining rows.
+    """
+    try:
+        first = next(rows)
+    except StopIteration:
+        return iter(())
+    return itertools.chain([first], rows)
+
+
+def _cells(spec: ExportSpec, record: Dict[str, Any]) -> List[Any]:
+    cells = []
+    for key, _ in spec.columns:
+        value = record.get(key)
+        if key in spec.formatters:
+            value = spec.formatters[key](value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        cells.append(value)
+    return cells
+
+
+def csv_chunks(spec: ExportSpec, rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(spec.headers)
+    for i, record in enumerate(rows, 1):
+        writer.writerow(_cells(spec, record))
+        if i % CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def ndjson_chunks(spec: ExportSpec, rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    keys = [key for key, _ in spec.columns]
+    lines = []
+    for record in rows:
+        lines.append(json.dumps(dict(zip(keys, _cells(spec, record))), default=str))
+        if len(lines) >= CHUNK_ROWS:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def write_xlsx(spec: ExportSpec, rows: Iterable[Dict[str, Any]], path: str):
+    """Write rows to an XLSX file with openpyxl's write-only mode (rows are not kept in memory)"""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=spec.name[:31])
+    # Widths must be set before the first row; they cannot be fitted to content when streaming
+    for index, (key, header) in enumerate(spec.columns, 1):
+        ws.column_dimensions[get_column_letter(index)].width = 40 if key in ("signature", "reason") else max(len(header) + 2, 20)
+
+    header_cells = []
+    for header in spec.headers:
+        cell = WriteOnlyCell(ws, value=header)
+        if spec.header_color:
+            cell.font = Font(bold=True, color="FFFFFF")
+            cell.fill = PatternFill(start_color=spec.header_color, end_color=spec.header_color, fill_type="solid")
+            cell.alignment = Alignment(horizontal="center")
+        else:
+            cell.font = Font(bold=True)
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    for record in rows:
+        ws.append(_cells(spec, record))
+    wb.save(path)
+
+
+def xlsx_chunks(spec: ExportSpec, rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    fd, path = tempfile.mkstemp(prefix="export-", suffix=".xlsx")
+    os.close(fd)
+    try:
+        write_xlsx(spec, rows, path)
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+def stream_export(data_service, kind: str, fmt: str, start: Optional[str] = None,
+                  stop: Optional[str] = None) -> Tuple[Iterator[bytes], str, str]:
+    """
+    Streaming export body.
+
+    Returns:
+        Tuple (chunk iterator, media type, filename)
+
+    Raises:
+        ValueError: unknown format or invalid bounds
+    """
+    spec = EXPORT_SPECS[kind]
+    if fmt not in STREAMING_FORMATS:
+        raise ValueError(f"Format not supported for streaming: {fmt}")
+    media_type, extension = STREAMING_FORMATS[fmt]
+
+    rows = prime(iter_export_rows(data_service, spec, parse_time_bound(start), parse_time_bound(stop)))
+    serializer = {"csv": csv_chunks, "ndjson": ndjson_chunks, "xlsx": xlsx_chunks}[fmt]
+    filename = f"{spec.name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return serializer(spec, rows), media_type, filename
@@ -3,9 +3,28 @@ Module de feature engineering pour transformer les données de télémétrie
 avant la détection d'anomalies par le modèle ML.
 """
 import numpy as np
-from typing import List, Dict, Any, Optional
+import pandas as pd
+from typing import List, Dict, Any, Optional, Mapping, Union
 from datetime import datetime, timedelta
 
+from .streaming_stats import STREAM_FEATURE_COLUMNS
+
+
+# Colonnes numériques d'entrée, dans l'ordre des features
+FEATURE_COLUMNS = ['temperature', 'humidity', 'tx_bytes', 'rx_bytes', 'connections']
+N_FEATURES = 7
+# Modèles entraînés avec les features temporelles glissantes (streaming_stats) :
+# les 7 features de base suivies de STREAM_FEATURE_COLUMNS
+N_STREAM_FEATURES = N_FEATURES + len(STREAM_FEATURE_COLUMNS)
+SUPPORTED_N_FEATURES = (N_FEATURES, N_STREAM_FEATURES)
+
+
+def input_columns(n_features: int = N_FEATURES) -> List[str]:
+    """Colonnes de télémétrie lues pour un modèle à n_features (hors ts)."""
+    if n_features not in SUPPORTED_N_FEATURES:
+        raise ValueError(f"Nombre de features non supporté: {n_features}")
+    return FEATURE_COLUMNS + (STREAM_FEATURE_COLUMNS if n_features == N_STREAM_FEATURES else [])
+
 
 class TelemetryFeatureEngineer:
     """
@@ -14,25 +33,124 @@ class TelemetryFeatureEngineer:
     """
 
     @staticmethod
-    def extract_features(telemetry_records: List[Any]) -> np.ndarray:
+    def extract_features(telemetry_records: List[Any], n_features: int = N_FEATURES) -> np.ndarray:
         """
         Extrait les features d'une liste de records de télémétrie.
         
         Args:
-            telemetry_records: Liste d'objets TelemetryORM
+            telemetry_records: Liste d'objets TelemetryORM (ou tout objet exposant
+                temperature, humidity, tx_bytes, rx_bytes, connections, ts)
             
         Returns:
             Matrice numpy de features (n_samples, n_features)
         """
         if not telemetry_records:
-            return np.array([]).reshape(0, 7)
+            return np.array([]).reshape(0, n_features)
+        
+        # Transposition en colonnes puis calcul vectorisé
+        columns = {
+            name: [getattr(record, name, None) for record in telemetry_records]
+            for name in input_columns(n_features) + ['ts']
+        }
+        return TelemetryFeatureEngineer.extract_features_columnar(columns, n_features=n_features)
+    
+    @staticmethod
+    def extract_features_columnar(columns: Union[Mapping[str, Any], pd.DataFrame],
+                                  out: Optional[np.ndarray] = None,
+                                  n_features: int = N_FEATURES) -> np.ndarray:
+        """
+        Calcule la matrice de features à partir de colonnes de télémétrie, en pur NumPy.
+        
+        Args:
+            columns: Mapping colonne -> tableau (listes, ndarray, Series) ou DataFrame
+                pandas / table Arrow (via to_pandas) avec les colonnes temperature,
+                humidity, tx_bytes, rx_bytes, connections et ts. Les colonnes
+                absentes et les valeurs manquantes (None/NaN) valent 0.
+                Avec n_features=N_STREAM_FEATURES, les colonnes STREAM_FEATURE_COLUMNS
+                sont lues aussi ; une EWMA manquante vaut la valeur courante.
+            out: Buffer float32 (n, n_features) préalloué à remplir (optionnel)
+            n_features: N_FEATURES (7) ou N_STREAM_FEATURES
+            
+        Returns:
+            Matrice float32 (n_samples, n_features) ; les 7 premières sont celles de
+            _compute_single_feature
+        """
+        if hasattr(columns, 'to_pandas') and not isinstance(columns, pd.DataFrame):
+            columns = columns.to_pandas()
+        if n_features not in SUPPORTED_N_FEATURES:
+            raise ValueError(f"Nombre de features non supporté: {n_features}")
+        
+        n = TelemetryFeatureEngineer._column_length(columns)
+        if out is None:
+            out = np.empty((n, n_features), dtype=np.float32)
+        elif out.shape != (n, n_features) or out.dtype != np.float32:
+            raise ValueError(f"out doit être un tableau float32 de forme ({n}, {n_features})")
+        if n == 0:
+            return out
+        
+        def raw(name: str) -> np.ndarray:
+            if name not in columns:
+                return np.full(n, np.nan, dtype=np.float64)
+            values = pd.to_numeric(pd.Series(columns[name], copy=False), errors='coerce')
+            return values.to_numpy(dtype=np.float64, na_value=np.nan)
+        
+        def numeric(name: str) -> np.ndarray:
+            # NaN -> 0 (équivalent du "or 0.0" scalaire)
+            return np.nan_to_num(raw(name), nan=0.0, posinf=0.0, neginf=0.0)
+        
+        out[:, 0] = numeric('temperature')
+        out[:, 1] = numeric('humidity')
+        # log1p vectorisé ; valeurs négatives ramenées à 0 comme dans le chemin scalaire
+        np.log1p(np.maximum(numeric('tx_bytes'), 0.0), out=out[:, 2])
+        np.log1p(np.maximum(numeric('rx_bytes'), 0.0), out=out[:, 3])
+        out[:, 4] = numeric('connections')
+        
+        hour, weekday, valid = TelemetryFeatureEngineer._time_components(columns.get('ts') if 'ts' in columns else None, n)
+        out[:, 5] = np.where(valid, hour / 23.0, 0.0)
+        out[:, 6] = np.where(valid, weekday / 6.0, 0.0)
+        
+        if n_features == N_STREAM_FEATURES:
+            for offset, name in enumerate(STREAM_FEATURE_COLUMNS, start=N_FEATURES):
+                if name.endswith('_ewma'):
+                    ewma = raw(name)
+                    ewma = np.where(np.isnan(ewma), numeric(name[:-len('_ewma')]), ewma)
+                    out[:, offset] = np.nan_to_num(ewma, posinf=0.0, neginf=0.0)
+                else:
+                    out[:, offset] = numeric(name)
+        return out
+    
+    @staticmethod
+    def _column_length(columns: Union[Mapping[str, Any], pd.DataFrame]) -> int:
+        if isinstance(columns, pd.DataFrame):
+            return len(columns)
+        for value in columns.values():
+            return len(value)
+        return 0
+    
+    @staticmethod
+    def _time_components(ts: Any, n: int):
+        """
+        Heure (0-23) et jour de semaine (0=lundi) via datetime64, en UTC.
+        
+        Returns:
+            Tuple (hour, weekday, valid) de tableaux de longueur n
+        """
+        if ts is None:
+            zeros = np.zeros(n)
+            return zeros, zeros, np.zeros(n, dtype=bool)
         
-        features = []
-        for record in telemetry_records:
-            feature_vector = TelemetryFeatureEngineer._compute_single_feature(record)
-            features.append(feature_vector)
+        ts_array = np.asarray(ts)
+        if ts_array.dtype.kind != 'M':
+            # Objets datetime / chaînes ISO (éventuellement avec fuseau) -> UTC naïf
+            parsed = pd.to_datetime(pd.Series(ts, copy=False), utc=True, errors='coerce', format='mixed')
+            ts_array = parsed.dt.tz_localize(None).to_numpy(dtype='datetime64[ns]')
         
-        return np.array(features)
+        valid = ~np.isnat(ts_array)
+        days = ts_array.astype('datetime64[D]')
+        hours = (ts_array.astype('datetime64[h]') - days).astype(np.int64)
+        # 1970-01-01 était un jeudi (weekday 3)
+        weekday = (days.astype(np.int64) + 3) % 7
+        return hours.astype(np.float64), weekday.astype(np.float64), valid
     
     @staticmethod
     def _compute_single_feature(record: Any) -> List[float]:
@@ -0,0 +1,196 @@
+"""
+Small builder for the Flux read queries of the API.
+Every query is emitted in the same order so InfluxDB can push filters down and
+regroup rows itself:
+
+    from |> range |> filter(_measurement) |> filter(tags) |> filter(_field)
+         |> pivot |> filter(pivoted columns) |> keep |> group |> sort |> limit
+
+Values (bucket, measurement, tag values, field names, durations, limit) are
+passed through the Flux `params` API, never interpolated into the query text.
+"""
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+# Durations accepted as strings (e.g. "24h", "7d"); converted to timedelta params
+_DURATION_RE = re.compile(r"^(\d+)(s|m|h|d|w)$")
+_DURATION_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+# Column names are spliced into the query (r.<column>): restrict them to identifiers
+_COLUMN_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_OPERATORS = ("==", "!=", "<", "<=", ">", ">=")
+
+TimeBound = Union[str, timedelta, datetime]
+
+
+def parse_duration(value: str) -> timedelta:
+    """Convert a duration such as "24h" or "7d" to a timedelta"""
+    match = _DURATION_RE.match(value)
+    if not match:
+        raise ValueError(f"Invalid duration: {value}")
+    amount, unit = match.groups()
+    return timedelta(**{_DURATION_UNITS[unit]: int(amount)})
+
+
+def _check_column(name: str) -> str:
+    if not _COLUMN_RE.match(name):
+        raise ValueError(f"Invalid column name: {name}")
+    return name
+
+
+@dataclass
+class FluxQuery:
+    """
+    Read query on one measurement.
+
+    Example:
+        query, params = (FluxQuery(bucket, "telemetry", start="24h")
+                         .tag("device_id", device_id)
+                         .fields("temperature", "humidity")
+                         .newest(20)
+                         .build())
+        query_api.query(query, params=params)
+    """
+    bucket: str
+    measurement: str
+    start: TimeBound = "24h"
+    stop: Optional[TimeBound] = None
+    field_names: List[str] = field(default_factory=list)
+    tag_filters: Dict[str, List[Any]] = field(default_factory=dict)
+    pivot_fields: bool = True
+    predicates: List[Tuple[str, str, Any]] = field(default_factory=list)
+    keep_columns: Optional[List[str]] = None
+    group_columns: Optional[List[str]] = None
+    sort_desc: Optional[bool] = None
+    limit_n: Optional[int] = None
+
+    # Builder methods (each returns self)
+    def fields(self, *names: str) -> "FluxQuery":
+        """Restrict the query to these fields (the filter is always emitted before pivot)"""
+        self.field_names.extend(names)
+        return self
+
+    def tag(self, name: str, value: Union[Any, Sequence[Any], None]) -> "FluxQuery":
+        """Keep rows whose tag equals the value (or one of the values). None is ignored."""
+        if value is None:
+            return self
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        self.tag_filters.setdefault(_check_column(name), []).extend(values)
+        return self
+
+    def where(self, column: str, operator: str, value: Any) -> "FluxQuery":
+        """Filter on a column after pivot (e.g. where("acknowledged", "==", False))"""
+        if operator not in _OPERATORS:
+            raise ValueError(f"Invalid operator: {operator}")
+        self.predicates.append((_check_column(column), operator, value))
+        return self
+
+    def where_in(self, column: str, values: Sequence[Any]) -> "FluxQuery":
+        """Filter on a column after pivot, keeping rows equal to one of the values"""
+        self.predicates.append((_check_column(column), "in", list(values)))
+        return self
+
+    def raw(self) -> "FluxQuery":
+        """Return one row per field instead of pivoting"""
+        self.pivot_fields = False
+        return self
+
+    def keep(self, *columns: str) -> "FluxQuery":
+        """Columns to return besides _time (defaults to the tags filtered on and the fields)"""
+        self.keep_columns = [_check_column(c) for c in columns]
+        return self
+
+    def newest(self, n: Optional[int] = None) -> "FluxQuery":
+        """Newest rows first across all series, at most n"""
+        self.group_columns = []
+        self.sort_desc = True
+        self.limit_n = n
+        return self
+
+    def oldest(self, n: Optional[int] = None) -> "FluxQuery":
+        """Oldest rows first across all series, at most n"""
+        self.group_columns = []
+        self.sort_desc = False
+        self.limit_n = n
+        return self
+
+    # Rendering
+    def build(self) -> Tuple[str, Dict[str, Any]]:
+        """Flux text and its params"""
+        params: Dict[str, Any] = {"bucket": self.bucket, "measurement": self.measurement}
+        lines = ["from(bucket: params.bucket)"]
+
+        params["start"] = self._time_param(self.start)
+        if self.stop is not None:
+            params["stop"] = self._time_param(self.stop)
+            lines.append("|> range(start: params.start, stop: params.stop)")
+        else:
+            lines.append("|> range(start: params.start)")
+        lines.append("|> filter(fn: (r) => r._measurement == params.measurement)")
+
+        for t, (name, values) in enumerate(self.tag_filters.items()):
+            lines.append(self._any_of(f"r.{name}", f"tag{t}_", values, params))
+
+        if self.field_names:
+            lines.append(self._any_of("r._field", "field", self.field_names, params))
+
+        if self.pivot_fields:
+            lines.append('|> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")')
+
+        for p, (column, operator, value) in enumerate(self.predicates):
+            if operator == "in":
+                lines.append(self._any_of(f"r.{column}", f"where{p}_", value, params))
+            else:
+                params[f"where{p}"] = value
+                lines.append(f"|> filter(fn: (r) => r.{column} {operator} params.where{p})")
+
+        keep = self._keep_columns()
+        if keep:
+            lines.append(f"|> keep(columns: {self._string_array(keep)})")
+
+        if self.group_columns is not None:
+            lines.append(f"|> group(columns: {self._string_array(self.group_columns)})")
+        if self.sort_desc is not None:
+            lines.append(f'|> sort(columns: ["_time"], desc: {"true" if self.sort_desc else "false"})')
+        if self.limit_n is not None:
+            params["limit"] = int(self.limit_n)
+            lines.append("|> limit(n: params.limit)")
+
+        return "\n".join(lines), params
+
+    def _keep_columns(self) -> Optional[List[str]]:
+        if not self.pivot_fields:
+            # Unpivoted rows need _field/_value; projection only makes sense after pivot
+            return None
+        if self.keep_columns is not None:
+            columns = self.keep_columns
+        elif self.field_names:
+            columns = list(self.tag_filters) + self.field_names
+        else:
+            return None
+        return ["_time"] + [c for c in dict.fromkeys(columns) if c != "_time"]
+
+    @staticmethod
+    def _time_param(bound: TimeBound) -> Union[timedelta, datetime]:
+        if isinstance(bound, datetime):
+            return bound
+        if isinstance(bound, str):
+            bound = parse_duration(bound)
+        # Relative bounds are in the past
+        return -abs(bound)
+
+    @staticmethod
+    def _any_of(column: str, prefix: str, values: Sequence[Any], params: Dict[str, Any]) -> str:
+        # Equality chain rather than contains() so the filter is pushed down to storage
+        conditions = []
+        for i, value in enumerate(values):
+            params[f"{prefix}{i}"] = value
+            conditions.append(f"{column} == params.{prefix}{i}")
+        return f"|> filter(fn: (r) => {' or '.join(conditions)})"
+
+    @staticmethod
+    def _string_array(columns: Sequence[str]) -> str:
+        return "[" + ", ".join(f'"{_check_column(c)}"' for c in columns) + "]"
@@ -0,0 +1,68 @@
+"""
+Assembly of Flux query results into one dict per logical record.
+InfluxDB returns one row per field; rows that share a series key (tag values)
+and a `_time` belong to the same record. Grouping is done in a single pass over
+the rows, and rows that were already pivoted server-side are passed through.
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# Columns added by Flux that are not tags of the series
+INTERNAL_COLUMNS = frozenset({"result", "table", "_start", "_stop", "_time", "_value", "_field", "_measurement"})
+
+
+def iter_flux_records(result: Iterable[Any]) -> Iterable[Any]:
+    """Rows of a query result (TableList, list of FluxTable or a record stream)"""
+    for item in result or []:
+        if hasattr(item, "records"):
+            yield from item.records
+        else:
+            yield item
+
+
+def assemble_records(result: Iterable[Any], time_key: str = "ts",
+                     include_tags: bool = True) -> List[Dict[str, Any]]:
+    """
+    Group Flux rows into records keyed by (series key, _time), in one pass.
+
+    Args:
+        result: query_api.query(...) result or query_stream(...) iterator
+        time_key: name given to `_time` in the output records
+        include_tags: copy the series tags (device_id, alert_id, ...) into each record
+            (pivoted rows always keep all their columns)
+
+    Returns:
+        Records in order of first appearance, with one entry per field
+    """
+    records: List[Dict[str, Any]] = []
+    index: Dict[Tuple[Any, Any], Dict[str, Any]] = {}
+    for row in iter_flux_records(result):
+        values = row.values
+        columns = {k: v for k, v in values.items() if k not in INTERNAL_COLUMNS}
+        if "_field" not in values:
+            # Already pivoted: one row is one record
+            records.append({time_key: values.get("_time"), **columns})
+            continue
+
+        key = (tuple(sorted(columns.items())), values.get("_time"))
+        record = index.get(key)
+        if record is None:
+            record = {time_key: values.get("_time")}
+            if include_tags:
+                record.update(columns)
+            index[key] = record
+            records.append(record)
+        record[values["_field"]] = values.get("_value")
+    return records
+
+
+def stream_records(result: Iterable[Any], time_key: str = "ts") -> Iterator[Dict[str, Any]]:
+    """
+    Lazily turn pivoted rows (e.g. from query_stream) into records, one per row.
+    Unlike assemble_records nothing is buffered, so memory stays flat.
+    """
+    for row in iter_flux_records(result):
+        values = row.values
+        record = {time_key: values.get("_time")}
+        record.update((k, v) for k, v in values.items() if k not in INTERNAL_COLUMNS)
+        yield record
+
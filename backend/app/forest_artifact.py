@@ -0,0 +1,320 @@
+"""
+Format d'artefact plat et mappable en mémoire pour les modèles IsolationForest.
+
+Les arbres entraînés sont aplatis en tableaux contigus (tous les nœuds de tous
+les arbres) écrits dans un seul fichier versionné :
+
+    MAGIC (8 octets) | taille de l'en-tête (uint32 LE) | en-tête JSON | tableaux alignés sur 64 octets
+
+Chaque processus ouvre le fichier avec np.memmap (lecture seule), si bien que les
+pages sont partagées via le cache du système entre tous les workers uvicorn, sans
+désérialisation pickle au démarrage. Les tableaux sont stockés avec les types
+utilisés par le parcours (index int64), qui indexe donc directement le mapping
+sans copie par processus. L'écriture est atomique (fichier temporaire puis rename).
+"""
+import json
+import os
+import struct
+import tempfile
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+MAGIC = b"SIACIFM\x00"
+FORMAT_VERSION = 2
+ARTIFACT_SUFFIX = ".ifm"
+ALIGNMENT = 64
+
+# Tableaux attendus dans un artefact de format 2 (index dans le type du parcours)
+ARRAY_DTYPES = {
+    "feature": np.int64,      # feature testée par le nœud (0 pour une feuille)
+    "threshold": np.float64,  # seuil : gauche si x <= threshold
+    # Fils entrelacés : children[2 * nœud + aller_à_droite] ; une feuille pointe
+    # sur elle-même pour que le parcours continue sans masque jusqu'à max_depth
+    "children": np.int64,
+    "leaf_value": np.float64,  # profondeur + correction c(n_node_samples) (feuilles)
+    "roots": np.int64,        # index global de la racine de chaque arbre
+}
+
+# Format 1 (left/right séparés, int32) : encore lisible, converti en mémoire
+_V1_ARRAYS = ("feature", "threshold", "left", "right", "leaf_value", "roots")
+
+
+class ArtifactError(ValueError):
+    """Fichier d'artefact invalide ou de version non supportée."""
+
+
+def average_path_length(n_samples: np.ndarray) -> np.ndarray:
+    """
+    Longueur moyenne c(n) d'un chemin non abouti dans un arbre binaire de
+    recherche (même définition que scikit-learn).
+    """
+    n = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros_like(n)
+    result[n == 2] = 1.0
+    mask = n > 2
+    result[mask] = 2.0 * (np.log(n[mask] - 1.0) + np.euler_gamma) - 2.0 * (n[mask] - 1.0) / n[mask]
+    return result
+
+
+def compile_isolation_forest(model) -> Dict[str, Any]:
+    """
+    Aplatis un IsolationForest scikit-learn entraîné.
+
+    Returns:
+        Dict avec 'arrays' (tableaux de ARRAY_DTYPES) et 'forest'
+        (n_estimators, n_features, max_depth, offset, denominator)
+    """
+    n_features = int(model.n_features_in_)
+    # Les arbres ne voient un sous-ensemble permuté des features que si max_features < n_features
+    subsample_features = getattr(model, "_max_features", n_features) != n_features
+
+    features, thresholds, children, leaf_values, roots = [], [], [], [], []
+    base = 0
+    max_depth = 0
+    for estimator, estimator_features in zip(model.estimators_, model.estimators_features_):
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        left = tree.children_left.astype(np.int64)
+        right = tree.children_right.astype(np.int64)
+        is_leaf = left == -1
+
+        # Profondeur de chaque nœud (les fils ont toujours un index supérieur au parent)
+        depth = np.zeros(n_nodes, dtype=np.int64)
+        for node in range(n_nodes):
+            if not is_leaf[node]:
+                depth[left[node]] = depth[node] + 1
+                depth[right[node]] = depth[node] + 1
+        max_depth = max(max_depth, int(depth.max()))
+
+        node_feature = np.where(is_leaf, 0, tree.feature).astype(np.int64)
+        if subsample_features:
+            node_feature = np.asarray(estimator_features)[node_feature]
+
+        nodes = np.arange(n_nodes, dtype=np.int64) + base
+        features.append(np.where(is_leaf, 0, node_feature))
+        thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+        children.append(_interleave(np.where(is_leaf, nodes, left + base), np.where(is_leaf, nodes, right + base)))
+        leaf_values.append(np.where(is_leaf, depth + average_path_length(tree.n_node_samples), 0.0))
+        roots.append(base)
+        base += n_nodes
+
+    n_estimators = len(model.estimators_)
+    arrays = {
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "children": np.concatenate(children),
+        "leaf_value": np.concatenate(leaf_values),
+        "roots": np.asarray(roots),
+    }
+    arrays = {name: np.ascontiguousarray(value, dtype=ARRAY_DTYPES[name]) for name, value in arrays.items()}
+
+    return {
+        "arrays": arrays,
+        "forest": {
+            "n_estimators": n_estimators,
+            "n_features": n_features,
+            "n_nodes": base,
+            "max_depth": max_depth,
+            "offset": float(model.offset_),
+            "denominator": float(n_estimators * average_path_length([model.max_samples_])[0]),
+        },
+    }
+
+
+class ForestArtifact:
+    """
+    Forêt compilée (tableaux éventuellement mappés en mémoire) et ses métadonnées.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], forest: Dict[str, Any],
+                 metadata: Optional[Dict[str, Any]] = None, path: Optional[str] = None):
+        self.arrays = arrays
+        self.forest = forest
+        self.metadata = metadata or {}
+        self.path = path
+
+        # Le parcours indexe directement ces tableaux (mappés en mémoire le cas échéant)
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.children = arrays["children"]
+        self.leaf_value = arrays["leaf_value"]
+        self.roots = arrays["roots"]
+        self.n_features = forest["n_features"]
+        self.offset = forest["offset"]
+
+    @classmethod
+    def from_model(cls, model, metadata: Optional[Dict[str, Any]] = None) -> "ForestArtifact":
+        compiled = compile_isolation_forest(model)
+        return cls(compiled["arrays"], compiled["forest"], metadata)
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(array.nbytes for array in self.arrays.values()))
+
+    # Score
+    # Lignes scorées par passe : borne la matrice (lignes x arbres) des nœuds courants
+    CHUNK_SIZE = 1024
+
+    def score_samples(self, X: np.ndarray) -> np.ndarray:
+        """Équivalent de IsolationForest.score_samples (plus bas = plus anormal)."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"X doit être de forme (n, {self.n_features}), reçu {X.shape}")
+        depths = np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], self.CHUNK_SIZE):
+            stop = start + self.CHUNK_SIZE
+            depths[start:stop] = self._path_lengths(X[start:stop])
+        return -np.power(2.0, -depths / self.forest["denominator"])
+
+    def _path_lengths(self, X: np.ndarray) -> np.ndarray:
+        """
+        Somme des longueurs de chemin sur tous les arbres.
+
+        Le parcours avance d'un niveau à la fois pour toutes les lignes et tous les
+        arbres en même temps : `node` (n x n_estimators) contient le nœud courant de
+        chaque couple (ligne, arbre) ; un nœud arrivé sur une feuille y reste.
+        """
+        n = X.shape[0]
+        node = np.empty((n, len(self.roots)), dtype=np.int64)
+        node[:] = self.roots
+        # Position de chaque ligne dans X aplati (accès X[row, feature[node]])
+        row_offset = (np.arange(n, dtype=np.int64) * X.shape[1])[:, None]
+        flat_X = X.ravel()
+        for _ in range(self.forest["max_depth"]):
+            values = np.take(flat_X, np.take(self.feature, node) + row_offset)
+            go_right = values > np.take(self.threshold, node)
+            node = np.take(self.children, 2 * node + go_right)
+        return np.take(self.leaf_value, node).sum(axis=1)
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        """Score de décision : négatif = anomalie."""
+        return self.score_samples(X) - self.offset
+
+    # Persistance
+    def save(self, path: str):
+        """Écrit l'artefact de façon atomique (temporaire + rename)."""
+        header = {
+            "format_version": FORMAT_VERSION,
+            "forest": self.forest,
+            "metadata": self.metadata,
+            "arrays": {},
+        }
+        # Offsets relatifs au début de la zone de données
+        layout = {}
+        position = 0
+        for name, array in self.arrays.items():
+            position = _align(position)
+            layout[name] = {"dtype": np.dtype(array.dtype).str, "shape": list(array.shape), "offset": position}
+            position += array.nbytes
+        header["arrays"] = layout
+
+        header_bytes = json.dumps(header).encode("utf-8")
+        data_start = _align(len(MAGIC) + 4 + len(header_bytes))
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=ARTIFACT_SUFFIX, dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC)
+                f.write(struct.pack("<I", len(header_bytes)))
+                f.write(header_bytes)
+                for name, array in self.arrays.items():
+                    f.seek(data_start + layout[name]["offset"])
+                    f.write(np.ascontiguousarray(array).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self.path = path
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "ForestArtifact":
+        """Ouvre un artefact ; les tableaux sont mappés en lecture seule si mmap=True."""
+        header, data_start = read_header(path)
+        if header["format_version"] == 1:
+            # Ancien format : tables de parcours reconstruites en mémoire (non partagées)
+            mmap = False
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            shape = tuple(spec["shape"])
+            offset = data_start + spec["offset"]
+            if mmap:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+            else:
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        if header["format_version"] == 1:
+            arrays = _upgrade_v1(arrays)
+        missing = set(ARRAY_DTYPES) - set(arrays)
+        if missing:
+            raise ArtifactError(f"Tableaux manquants dans {path}: {sorted(missing)}")
+        return cls(arrays, header["forest"], header.get("metadata"), path)
+
+
+def verify_parity(model, forest: ForestArtifact, X: np.ndarray, atol: float = 1e-9) -> float:
+    """
+    Compare les scores de la forêt compilée à ceux de scikit-learn sur X.
+
+    Returns:
+        Écart absolu maximal entre les deux decision_function
+
+    Raises:
+        ArtifactError: si l'écart dépasse atol
+    """
+    X = np.asarray(X, dtype=np.float32)
+    if len(X) == 0:
+        return 0.0
+    error = float(np.max(np.abs(forest.decision_function(X) - model.decision_function(X))))
+    if error > atol:
+        raise ArtifactError(f"Forêt compilée divergente de scikit-learn (écart max {error:.3e})")
+    return error
+
+
+def read_header(path: str):
+    """
+    Lit et valide l'en-tête d'un artefact.
+
+    Returns:
+        Tuple (header, data_start)
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ArtifactError(f"{path} n'est pas un artefact de modèle")
+        (header_len,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    if header.get("format_version") not in (1, FORMAT_VERSION):
+        raise ArtifactError(f"Version de format non supportée: {header.get('format_version')}")
+    return header, _align(len(MAGIC) + 4 + header_len)
+
+
+def _interleave(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    children = np.empty(2 * len(left), dtype=np.int64)
+    children[0::2] = left
+    children[1::2] = right
+    return children
+
+
+def _upgrade_v1(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Tableaux de format 1 (left/right, -1 pour une feuille) -> format 2."""
+    missing = set(_V1_ARRAYS) - set(arrays)
+    if missing:
+        raise ArtifactError(f"Tableaux manquants (format 1): {sorted(missing)}")
+    nodes = np.arange(len(arrays["left"]), dtype=np.int64)
+    left = np.where(arrays["left"] == -1, nodes, arrays["left"])
+    right = np.where(arrays["right"] == -1, nodes, arrays["right"])
+    upgraded = {"children": _interleave(left, right)}
+    for name in ("feature", "threshold", "leaf_value", "roots"):
+        upgraded[name] = np.ascontiguousarray(arrays[name], dtype=ARRAY_DTYPES[name])
+    return upgraded
+
+
+def _align(position: int) -> int:
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
@@ -0,0 +1,238 @@
+"""
+In-memory ring buffer of the latest telemetry of each device.
+
+Every point the process ingests (MQTT, HTTP, batch, or events relayed from
+ingest workers) is appended to its device's ring: one float64 column per field
+plus an int64 timestamp column (ns since epoch, UTC). Recent-data reads are
+answered from the rings when they provably hold every point of the requested
+range, and return None otherwise so the caller falls back to InfluxDB:
+
+- points older than the buffer's start were never seen by this process
+- points evicted from a full ring are gone
+
+The buffer only sees the telemetry of its own process: disable it
+(HOT_BUFFER_ENABLED=false) when several API replicas share ingestion.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Columns of a ring; booleans are stored as 0/1, missing values as NaN
+HOT_FIELDS = ("temperature", "humidity", "distance", "tx_bytes", "rx_bytes", "connections", "motion")
+INT_FIELDS = frozenset(("tx_bytes", "rx_bytes", "connections"))
+BOOL_FIELDS = frozenset(("motion",))
+
+_FIELD_INDEX = {name: i for i, name in enumerate(HOT_FIELDS)}
+
+
+def to_ns(ts: datetime) -> int:
+    """ns since epoch; naive datetimes are UTC (datetime.utcnow())"""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp()) * 1_000_000_000 + ts.microsecond * 1000
+
+
+def from_ns(ns: int) -> datetime:
+    return datetime.fromtimestamp(ns // 1_000_000_000, tz=timezone.utc) + timedelta(microseconds=(ns % 1_000_000_000) // 1000)
+
+
+class DeviceRing:
+    """Fixed-capacity telemetry history of one device (oldest points overwritten)"""
+
+    __slots__ = ("ts", "values", "head", "size", "evicted_until")
+
+    def __init__(self, capacity: int):
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full((len(HOT_FIELDS), capacity), np.nan, dtype=np.float64)
+        self.head = 0
+        self.size = 0
+        # Newest timestamp overwritten so far: the ring is complete after it
+        self.evicted_until: Optional[int] = None
+
+    def append(self, ts_ns: int, row: np.ndarray):
+        capacity = self.ts.shape[0]
+        if self.size == capacity:
+            evicted = int(self.ts[self.head])
+            if self.evicted_until is None or evicted > self.evicted_until:
+                self.evicted_until = evicted
+        else:
+            self.size += 1
+        self.ts[self.head] = ts_ns
+        self.values[:, self.head] = row
+        self.head = (self.head + 1) % capacity
+
+    def snapshot(self, since_ns: int, until_ns: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Copies of (timestamps, values) of the points in [since, until)"""
+        ts = self.ts[:self.size] if self.size < self.ts.shape[0] else self.ts
+        values = self.values[:, :self.size] if self.size < self.ts.shape[0] else self.values
+        mask = ts >= since_ns
+        if until_ns is not None:
+            mask &= ts < until_ns
+        return ts[mask], values[:, mask]
+
+
+class HotTelemetryBuffer:
+    """
+    Per-device telemetry rings (HOT_BUFFER_CAPACITY points each).
+
+    record() is called on ingest; recent() and aggregate() return None when
+    the rings cannot answer exactly.
+    """
+
+    def __init__(self, capacity: Optional[int] = None, enabled: Optional[bool] = None):
+        self.capacity = capacity or int(os.getenv("HOT_BUFFER_CAPACITY", "1024"))
+        self.enabled = enabled if enabled is not None else \
+            os.getenv("HOT_BUFFER_ENABLED", "true").lower() == "true"
+        # Points before this instant were never seen by this process
+        self.started_ns = time.time_ns()
+
+        self._rings: Dict[str, DeviceRing] = {}
+        self._lock = threading.Lock()
+        self.stats = {"records": 0, "hits": 0, "misses": 0}
+
+    def record(self, device_id: str, ts: datetime, values: Mapping[str, Any]):
+        """Append one point; fields missing from `values` (or None) are stored as NaN"""
+        if not self.enabled:
+            return
+        row = np.full(len(HOT_FIELDS), np.nan, dtype=np.float64)
+        for name, i in _FIELD_INDEX.items():
+            value = values.get(name)
+            if value is not None:
+                try:
+                    row[i] = float(value)
+                except (TypeError, ValueError):
+                    pass
+        ts_ns = to_ns(ts)
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is None:
+                ring = self._rings[device_id] = DeviceRing(self.capacity)
+            ring.append(ts_ns, row)
+            self.stats["records"] += 1
+
+    def _collect(self, device_id: Optional[str], since_ns: int, until_ns: Optional[int] = None):
+        """(complete since, [(device_id, timestamps, values)]) under the lock"""
+        if device_id is not None:
+            ring = self._rings.get(device_id)
+            rings = [(device_id, ring)] if ring else []
+        else:
+            rings = list(self._rings.items())
+        complete_since = self.started_ns
+        parts = []
+        for name, ring in rings:
+            if ring.evicted_until is not None:
+                complete_since = max(complete_since, ring.evicted_until + 1)
+            ts, values = ring.snapshot(since_ns, until_ns)
+            if ts.size:
+                parts.append((name, ts, values))
+        return complete_since, parts
+
+    def _count(self, hit: bool):
+        with self._lock:
+            self.stats["hits" if hit else "misses"] += 1
+
+    def recent(self, limit: int, since: datetime, device_id: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Newest `limit` points newer than `since` (newest first, all devices
+        unless device_id is given), or None if the rings may miss some of them.
+        """
+        if not self.enabled or limit > self.capacity:
+            return None
+        since_ns = to_ns(since)
+        with self._lock:
+            complete_since, parts = self._collect(device_id, since_ns)
+        total = sum(ts.size for _, ts, _ in parts)
+        # Fewer points than asked: only exact if nothing in the range predates the rings
+        if total < limit and complete_since > since_ns:
+            self._count(False)
+            return None
+        self._count(True)
+        if not parts:
+            return []
+
+        devices = np.concatenate([np.full(ts.size, i, dtype=np.int32) for i, (_, ts, _) in enumerate(parts)])
+        ts = np.concatenate([ts for _, ts, _ in parts])
+        values = np.concatenate([values for _, _, values in parts], axis=1)
+        order = np.argsort(ts, kind="stable")[::-1][:limit]
+
+        points = []
+        for j in order:
+            point = {"device_id": parts[devices[j]][0], "ts": from_ns(int(ts[j]))}
+            for name, i in _FIELD_INDEX.items():
+                value = values[i, j]
+                if np.isnan(value):
+                    point[name] = None
+                elif name in INT_FIELDS:
+                    point[name] = int(value)
+                elif name in BOOL_FIELDS:
+                    point[name] = bool(value)
+                else:
+                    point[name] = float(value)
+            points.append(point)
+        return points
+
+    def aggregate(self, fields: Sequence[str], start: datetime, every: timedelta,
+                  stop: Optional[datetime] = None,
+                  device_id: Optional[str] = None) -> Optional[Dict[Tuple[datetime, Optional[str]], Dict[str, Dict[str, Any]]]]:
+        """
+        count/sum/min/max/mean of `fields` per epoch-aligned `every` window over
+        [start, stop), in the layout of TelemetryRollups.aggregate; None if the
+        rings do not cover `start`.
+        """
+        if not self.enabled:
+            return None
+        start_ns = to_ns(start)
+        stop_ns = to_ns(stop) if stop else None
+        with self._lock:
+            complete_since, parts = self._collect(device_id, start_ns, stop_ns)
+        if complete_since > start_ns:
+            self._count(False)
+            return None
+        self._count(True)
+        if not parts:
+            return {}
+
+        ts = np.concatenate([ts for _, ts, _ in parts])
+        rows = [_FIELD_INDEX[name] for name in fields]
+        values = np.concatenate([values[rows] for _, _, values in parts], axis=1)
+        every_ns = int(every.total_seconds() * 1_000_000_000)
+        windows, inverse = np.unique(ts // every_ns, return_inverse=True)
+
+        result: Dict[Tuple[datetime, Optional[str]], Dict[str, Dict[str, Any]]] = {}
+        keys = [(from_ns(int(w) * every_ns).replace(tzinfo=None), None) for w in windows]
+        for k, name in enumerate(fields):
+            column = values[k]
+            present = ~np.isnan(column)
+            if not present.any():
+                continue
+            index = inverse[present]
+            column = column[present]
+            counts = np.bincount(index, minlength=windows.size)
+            sums = np.bincount(index, weights=column, minlength=windows.size)
+            mins = np.full(windows.size, np.inf)
+            maxs = np.full(windows.size, -np.inf)
+            np.minimum.at(mins, index, column)
+            np.maximum.at(maxs, index, column)
+            for w in np.nonzero(counts)[0]:
+                result.setdefault(keys[w], {})[name] = {
+                    "count": int(counts[w]),
+                    "sum": float(sums[w]),
+                    "min": float(mins[w]),
+                    "max": float(maxs[w]),
+                    "mean": float(sums[w] / counts[w]),
+                }
+        return result
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                "enabled": self.enabled,
+                "capacity": self.capacity,
+                "devices": len(self._rings),
+                "points": sum(ring.size for ring in self._rings.values()),
+            }
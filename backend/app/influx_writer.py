@@ -0,0 +1,367 @@
+"""
+Batching write pipeline for InfluxDB.
+Ingest paths enqueue points into a bounded in-memory queue; a background thread
+drains it and writes line-protocol batches, flushing when a batch is full or when
+the flush interval elapses. Transient failures are retried with exponential backoff.
+
+Batches that still cannot be written, and records arriving while the queue is
+full, go to the on-disk spool (write_spool) and are replayed in order at
+INFLUX_SPOOL_REPLAY_RATE points/s once InfluxDB accepts writes again. The spool
+is opened when the writer starts, so processes that import the service without
+writing never hold a spool slot; the replay thread also drains the slots that
+processes no longer running left behind.
+"""
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from influxdb_client import Point, WritePrecision
+from influxdb_client.rest import ApiException
+
+from .write_spool import WriteSpool, SpoolFull
+
+# HTTP statuses worth retrying (rate limiting, server-side hiccups)
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class BatchingInfluxWriter:
+    """
+    Asynchronous, batching writer in front of a synchronous InfluxDB write API.
+
+    `enqueue` never performs network I/O: it either accepts the record into the
+    queue (or the spool when the queue is full) or rejects it and counts the
+    drop, so callers on hot paths are never blocked behind an InfluxDB round trip.
+    """
+
+    def __init__(self, write_api, bucket: str, org: str,
+                 batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 max_queue_size: Optional[int] = None,
+                 max_retries: Optional[int] = None,
+                 retry_backoff: Optional[float] = None,
+                 max_backoff: Optional[float] = None,
+                 enqueue_timeout: Optional[float] = None,
+                 spool: Optional[WriteSpool] = None,
+                 replay_rate: Optional[float] = None,
+                 on_written: Optional[Callable[[List[str]], Any]] = None):
+        self.write_api = write_api
+        # Called with the lines of every written batch (live or replayed), e.g. TelemetryRollups.note_written
+        self.on_written = on_written
+        self.bucket = bucket
+        self.org = org
+
+        self.batch_size = batch_size or int(os.getenv("INFLUX_WRITE_BATCH_SIZE", "500"))
+        self.flush_interval = flush_interval or float(os.getenv("INFLUX_WRITE_FLUSH_INTERVAL", "1.0"))
+        self.max_queue_size = max_queue_size or int(os.getenv("INFLUX_WRITE_QUEUE_SIZE", "50000"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("INFLUX_WRITE_MAX_RETRIES", "5"))
+        self.retry_backoff = retry_backoff or float(os.getenv("INFLUX_WRITE_RETRY_BACKOFF", "0.5"))
+        self.max_backoff = max_backoff or float(os.getenv("INFLUX_WRITE_MAX_BACKOFF", "30"))
+        self.enqueue_timeout = enqueue_timeout if enqueue_timeout is not None else float(os.getenv("INFLUX_WRITE_ENQUEUE_TIMEOUT", "0"))
+        self.replay_rate = replay_rate or float(os.getenv("INFLUX_SPOOL_REPLAY_RATE", "5000"))
+        self.replay_retry_interval = float(os.getenv("INFLUX_SPOOL_RETRY_INTERVAL", "5"))
+        self.adopt_interval = float(os.getenv("INFLUX_SPOOL_ADOPT_INTERVAL", "60"))
+
+        # Opened by start(): only a writer that actually writes takes a spool slot
+        self.spool = spool
+        self._spool_enabled = spool is not None or os.getenv("INFLUX_SPOOL_ENABLED", "true").lower() == "true"
+        # Slots of processes that are gone, drained before our own spool
+        self._orphans: List[WriteSpool] = []
+
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=self.max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._replay_thread: Optional[threading.Thread] = None
+        self._replay_wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flush_requested = threading.Event()
+
+        # Records accepted but not yet written (or given up on)
+        self._pending = 0
+        self._pending_cond = threading.Condition()
+
+        self._metrics_lock = threading.Lock()
+        self._metrics: Dict[str, Any] = {
+            "enqueued": 0,
+            "dropped": 0,
+            "written": 0,
+            "failed": 0,
+            "spooled": 0,
+            "replayed": 0,
+            "batches": 0,
+            "retries": 0,
+            "last_batch_size": 0,
+            "last_flush_at": None,
+            "last_error": None,
+        }
+
+    # Lifecycle
+    def start(self):
+        """Open the spool and start the background flush and replay threads (idempotent)"""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            if self.spool is None and self._spool_enabled:
+                try:
+                    self.spool = WriteSpool().open()
+                except Exception as e:
+                    # Without a spool, undeliverable batches are counted as failed
+                    print(f"InfluxDB write spool unavailable: {e}")
+                    self._spool_enabled = False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+            self._thread.start()
+            if self.spool and not (self._replay_thread and self._replay_thread.is_alive()):
+                self._replay_thread = threading.Thread(target=self._replay, name="influx-spool-replay", daemon=True)
+                self._replay_thread.start()
+
+    def close(self, timeout: float = 10.0):
+        """Flush what is queued (spooling what cannot be written) and stop the background threads"""
+        self.flush(timeout=timeout)
+        self._stop.set()
+        self._flush_requested.set()
+        self._replay_wake.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        if self._replay_thread:
+            self._replay_thread.join(timeout=timeout)
+        for orphan in self._orphans:
+            orphan.close()
+        self._orphans = []
+        if self.spool:
+            self.spool.close()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every accepted record has been written or given up on"""
+        if self._thread is None:
+            return self._pending == 0
+        self._flush_requested.set()
+        with self._pending_cond:
+            return self._pending_cond.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    # Producer side
+    def enqueue(self, record: Union[Point, str]) -> bool:
+        """Queue a Point (or a line-protocol string) for writing. Returns False if rejected."""
+        line = record.to_line_protocol() if isinstance(record, Point) else record
+        if not line:
+            return False
+
+        if self._thread is None:
+            self.start()
+
+        with self._pending_cond:
+            self._pending += 1
+        try:
+            if self.enqueue_timeout > 0:
+                self._queue.put(line, timeout=self.enqueue_timeout)
+            else:
+                self._queue.put_nowait(line)
+        except queue.Full:
+            self._release(1)
+            # Overflow goes to disk rather than being dropped
+            if self._spool([line]):
+                return True
+            self._incr("dropped")
+            return False
+
+        self._incr("enqueued")
+        return True
+
+    def enqueue_many(self, records: Iterable[Union[Point, str]]) -> int:
+        """Queue several records; returns how many were accepted"""
+        return sum(1 for record in records if self.enqueue(record))
+
+    # Metrics
+    def get_metrics(self) -> Dict[str, Any]:
+        """Snapshot of the pipeline counters and backpressure state"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        depth = self._queue.qsize()
+        metrics.update({
+            "queue_depth": depth,
+            "queue_capacity": self.max_queue_size,
+            "queue_utilization": round(depth / self.max_queue_size, 4) if self.max_queue_size else 0.0,
+            "pending": self._pending,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "running": bool(self._thread and self._thread.is_alive()),
+            "spool": self.spool.get_metrics() if self.spool else None,
+            "adopted_spools": [orphan.get_metrics() for orphan in list(self._orphans)],
+        })
+        return metrics
+
+    def _incr(self, key: str, amount: int = 1):
+        with self._metrics_lock:
+            self._metrics[key] += amount
+
+    def _release(self, count: int):
+        with self._pending_cond:
+            self._pending -= count
+            if self._pending <= 0:
+                self._pending = 0
+                self._pending_cond.notify_all()
+
+    # Consumer side
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._collect_batch()
+            if batch:
+                self._write_batch(batch)
+                self._release(len(batch))
+            elif self._flush_requested.is_set() and self._queue.empty():
+                self._flush_requested.clear()
+
+    def _collect_batch(self) -> List[str]:
+        """Wait for the first record, then gather until the batch is full or the interval elapses"""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if self._flush_requested.is_set() or self._stop.is_set():
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, lines: List[str]) -> bool:
+        """Write one line-protocol batch, retrying transient failures with backoff"""
+        body = "\n".join(lines)
+        attempt = 0
+        while True:
+            try:
+                self.write_api.write(bucket=self.bucket, org=self.org, record=body,
+                                     write_precision=WritePrecision.NS)
+                with self._metrics_lock:
+                    self._metrics["written"] += len(lines)
+                    self._metrics["batches"] += 1
+                    self._metrics["last_batch_size"] = len(lines)
+                    self._metrics["last_flush_at"] = datetime.utcnow().isoformat()
+                self._notify_written(lines)
+                return True
+            except Exception as e:
+                with self._metrics_lock:
+                    self._metrics["last_error"] = str(e)
+                transient = self._is_transient(e)
+                # While a backlog is spooled InfluxDB is known to be down: spool without retrying
+                backlog = self._spool_backlog()
+                retries = 0 if backlog else self.max_retries
+                if not transient or attempt >= retries or self._stop.is_set():
+                    if not (transient and backlog):
+                        print(f"Error writing batch of {len(lines)} points to InfluxDB: {e}")
+                    # Rejected data (bad line protocol, auth) would fail again on replay
+                    if transient and self._spool(lines):
+                        return False
+                    self._incr("failed", len(lines))
+                    return False
+                self._incr("retries")
+                time.sleep(self._backoff_delay(attempt, e))
+                attempt += 1
+
+    def _notify_written(self, lines: List[str]):
+        if not self.on_written:
+            return
+        try:
+            self.on_written(lines)
+        except Exception as e:
+            print(f"InfluxDB write hook failed: {e}")
+
+    # Spool
+    def _spool(self, lines: List[str]) -> bool:
+        """Append lines to the spool as one record; False if there is no room"""
+        if not self.spool:
+            return False
+        try:
+            self.spool.append("\n".join(lines).encode("utf-8"))
+        except (SpoolFull, OSError) as e:
+            print(f"Error spooling {len(lines)} points: {e}")
+            return False
+        self._incr("spooled", len(lines))
+        self._replay_wake.set()
+        return True
+
+    def _spool_backlog(self) -> bool:
+        if any(orphan.depth()["records"] for orphan in list(self._orphans)):
+            return True
+        return bool(self.spool and self.spool.depth()["records"])
+
+    def _replay(self):
+        """Write spooled records back in order, at most replay_rate points/s"""
+        last_adopt = None
+        while not self._stop.is_set():
+            self.spool.sync_if_due()
+            if last_adopt is None or time.monotonic() - last_adopt >= self.adopt_interval:
+                self._orphans.extend(self.spool.adopt_orphans())
+                last_adopt = time.monotonic()
+            # Live traffic first: replay only while the queue is not backed up
+            if self._queue.qsize() >= self.batch_size:
+                self._stop.wait(self.flush_interval)
+                continue
+            # Orphaned slots hold the oldest data: drain them first
+            source = self._orphans[0] if self._orphans else self.spool
+            record = source.peek()
+            if record is None:
+                if source is not self.spool:
+                    source.close()
+                    self._orphans.pop(0)
+                    continue
+                self._replay_wake.wait(self.spool.fsync_interval)
+                self._replay_wake.clear()
+                continue
+
+            points = record.count(b"\n") + 1
+            try:
+                self.write_api.write(bucket=self.bucket, org=self.org, record=record.decode("utf-8"),
+                                     write_precision=WritePrecision.NS)
+            except Exception as e:
+                with self._metrics_lock:
+                    self._metrics["last_error"] = str(e)
+                if self._is_transient(e):
+                    # Still down: try the same record again later
+                    self._stop.wait(self.replay_retry_interval)
+                    continue
+                print(f"Spooled batch of {points} points rejected by InfluxDB: {e}")
+                source.commit()
+                self._incr("failed", points)
+                continue
+
+            source.commit()
+            self._incr("replayed", points)
+            self._notify_written(record.decode("utf-8").split("\n"))
+            self._stop.wait(points / self.replay_rate)
+
+    def _backoff_delay(self, attempt: int, error: Exception) -> float:
+        retry_after = None
+        headers = getattr(error, "headers", None)
+        if headers:
+            try:
+                retry_after = float(headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                retry_after = None
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        delay = self.retry_backoff * (2 ** attempt)
+        return min(delay, self.max_backoff) * random.uniform(0.8, 1.2)
+
+    @staticmethod
+    def _is_transient(error: Exception) -> bool:
+        if isinstance(error, ApiException):
+            return error.status in TRANSIENT_STATUSES
+        # Connection resets, timeouts and DNS failures surface as OSError subclasses
+        # (urllib3 errors included once unwrapped)
+        return isinstance(error, (OSError, TimeoutError)) or "urllib3" in type(error).__module__
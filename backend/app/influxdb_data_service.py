@@ -7,10 +7,20 @@ from influxdb_client.client.write_api import SYNCHRONOUS
 from influxdb_client.client.query_api import QueryApi
 from influxdb_client.client.delete_api import DeleteApi
 import os
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Tuple
 from passlib.context import CryptContext
 import json
+import zlib
+
+from .influx_writer import BatchingInfluxWriter
+from .device_registry import DeviceRegistry
+from .dashboard_cache import DashboardSummaryCache
+from .rollups import TelemetryRollups
+from .hot_buffer import HotTelemetryBuffer
+from .flux_records import assemble_records
+from .flux_query import FluxQuery
 
 # Pydantic models for data validation
 from pydantic import BaseModel
@@ -52,6 +62,7 @@ class AlertData(BaseModel):
     severity: str
     score: float = 0.0
     reason: Optional[str] = None
+    source: Optional[str] = None
     acknowledged: bool = False
     metadata: Optional[Dict[str, Any]] = None
 
@@ -68,6 +79,71 @@ class SuricataLogData(BaseModel):
     severity: Optional[str] = None
     raw: Optional[Dict[str, Any]] = None
 
+# Telemetry fields returned by the read paths
+TELEMETRY_FIELDS = ["temperature", "humidity", "distance", "tx_bytes", "rx_bytes", "connections", "motion"]
+
+# Alert layout in the "alerts" measurement.
+#   v1: tags alert_id, device_id; fields severity, score, reason, acknowledged, metadata
+#       (one series per alert: unbounded cardinality)
+#   v2: tags device_id, severity, source; fields alert_id, score, reason,
+#       acknowledged, metadata, schema_version
+# Both pivot to the same record keys, so readers handle either layout;
+# backend/migrate_alerts.py rewrites v1 history as v2.
+ALERT_SCHEMA_VERSION = 2
+# Values of the v2 "source" tag; anything else is tagged "other"
+ALERT_SOURCES = ("ml", "zscore", "rule", "suricata")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class TelemetryRejected(Exception):
+    """Telemetry point not queued; reason is disconnected, invalid or queue_full"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def alert_source(alert: AlertData) -> str:
+    """Bounded origin of an alert, used as a tag: one of ALERT_SOURCES, other or unknown"""
+    source = alert.source or (alert.metadata or {}).get("source") or (alert.metadata or {}).get("metric")
+    if not source:
+        return "unknown"
+    source = str(source).lower()
+    if source.startswith("ml"):
+        return "ml"
+    return source if source in ALERT_SOURCES else "other"
+
+
+def alert_time_ns(alert: AlertData) -> int:
+    """
+    Timestamp of an alert point, in ns.
+
+    v2 points of one device/severity/source share a series, so two alerts with
+    the same timestamp would overwrite each other. A sub-microsecond offset
+    derived from alert_id keeps them apart. Datetimes only carry microseconds, so
+    the offset is dropped on read and an alert read back and rewritten lands on
+    the same point.
+    """
+    ts = alert.ts if alert.ts.tzinfo else alert.ts.replace(tzinfo=timezone.utc)
+    micros = (ts - _EPOCH) // timedelta(microseconds=1)
+    return micros * 1000 + zlib.crc32(alert.alert_id.encode()) % 1000
+
+
+def alert_point(alert: AlertData) -> Point:
+    """v2 point of an alert"""
+    return Point("alerts") \
+        .tag("device_id", alert.device_id) \
+        .tag("severity", alert.severity) \
+        .tag("source", alert_source(alert)) \
+        .field("alert_id", alert.alert_id) \
+        .field("score", alert.score) \
+        .field("reason", alert.reason or "") \
+        .field("acknowledged", alert.acknowledged) \
+        .field("metadata", json.dumps(alert.metadata or {})) \
+        .field("schema_version", ALERT_SCHEMA_VERSION) \
+        .time(alert_time_ns(alert), WritePrecision.NS)
+
+
 class InfluxDBDataService:
     """
     Unified InfluxDB service replacing PostgreSQL functionality.
@@ -84,6 +160,11 @@ class InfluxDBDataService:
         self.write_api = None
         self.query_api = None
         self.delete_api = None
+        self.writer: Optional[BatchingInfluxWriter] = None
+        self.device_registry = DeviceRegistry(self)
+        self.dashboard_cache = DashboardSummaryCache(self)
+        self.rollups = TelemetryRollups(self)
+        self.hot_buffer = HotTelemetryBuffer()
 
         # Password hashing
         self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -101,6 +182,9 @@ class InfluxDBDataService:
             self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
             self.query_api = self.client.query_api()
             self.delete_api = self.client.delete_api()
+            # High-volume measurements go through the batching pipeline
+            self.writer = BatchingInfluxWriter(self.write_api, self.bucket, self.org,
+                                               on_written=self.rollups.note_written)
             print(f"Connected to InfluxDB at {self.url}")
         except Exception as e:
             print(f"Failed to connect to InfluxDB: {e}")
@@ -110,6 +194,33 @@ class InfluxDBDataService:
         """Check if InfluxDB connection is active"""
         return self.client is not None
 
+    def start_writer(self):
+        """Start the write pipeline now, so spooled writes are replayed without waiting for new ones"""
+        if self.writer:
+            self.writer.start()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait for queued writes to reach InfluxDB"""
+        if not self.writer:
+            return True
+        return self.writer.flush(timeout=timeout)
+
+    def close(self):
+        """Flush pending writes and release the client"""
+        self.dashboard_cache.close()
+        self.rollups.close()
+        self.device_registry.close()
+        if self.writer:
+            self.writer.close()
+        if self.client:
+            self.client.close()
+
+    def get_write_metrics(self) -> Dict[str, Any]:
+        """Backpressure and throughput counters of the write pipeline"""
+        if not self.writer:
+            return {}
+        return self.writer.get_metrics()
+
     # Password utilities
     def hash_password(self, password: str) -> str:
         """Hash a password"""
@@ -146,17 +257,11 @@ class InfluxDBDataService:
         if not self.is_connected():
             return None
 
-        flux_query = f'''
-        from(bucket: "{self.bucket}")
-        |> range(start: -1y)
-        |> filter(fn: (r) => r._measurement == "users")
-        |> filter(fn: (r) => r.username == "{username}")
-        |> sort(columns: ["_time"], desc: true)
-        |> limit(n: 10)
-        '''
+        # Rows come back oldest first per field, so the newest value wins below
+        query = FluxQuery(self.bucket, "users", start="365d").tag("username", username).raw()
 
         try:
-            result = self.query_api.query(flux_query)
+            result = self.query(query)
             if result and len(result) > 0:
                 user_data = {"username": username}
                 for table in result:
@@ -200,16 +305,10 @@ class InfluxDBDataService:
         if not self.is_connected():
             return []
 
-        flux_query = f'''
-        from(bucket: "{self.bucket}")
-        |> range(start: -1y)
-        |> filter(fn: (r) => r._measurement == "users")
-        |> sort(columns: ["_time"], desc: true)
-        |> limit(n: 100)
-        '''
+        query = FluxQuery(self.bucket, "users", start="365d").raw()
 
         try:
-            result = self.query_api.query(flux_query)
+            result = self.query(query)
             users = {}
             user_data = {}
 
@@ -235,11 +334,20 @@ class InfluxDBDataService:
             print(f"Error listing users: {e}")
             return []
 
-    def query_data(self, flux_query: str):
+    def query_data(self, flux_query: str, params: Optional[Dict[str, Any]] = None):
         """Query data using Flux query"""
         if not self.is_connected():
             return None
-        return self.query_api.query(flux_query)
+        return self.query_api.query(flux_query, params=params)
+
+    def query(self, query: FluxQuery):
+        """Run a query built with FluxQuery"""
+        flux_query, params = query.build()
+        return self.query_data(flux_query, params)
+
+    def get_recent_measurements(self, measurement: str, limit: int = 10):
+        """Get the newest rows of a measurement (one pivoted row per timestamp)"""
+        return self.query(FluxQuery(self.bucket, measurement, start="1h").newest(limit))
 
     # Device Management
     def create_device(self, device_data: DeviceData) -> bool:
@@ -261,76 +369,25 @@ class InfluxDBDataService:
                 point = point.field("last_seen", device_data.last_seen.isoformat())
 
             self.write_api.write(bucket=self.bucket, org=self.org, record=point)
+            self.device_registry.put(device_data.model_dump())
             return True
         except Exception as e:
             print(f"Error creating device: {e}")
             return False
 
     def get_device(self, device_id: str) -> Optional[Dict[str, Any]]:
-        """Get device by device_id"""
+        """Get device by device_id (served from the device registry)"""
         if not self.is_connected():
             return None
 
-        flux_query = f'''
-        from(bucket: "{self.bucket}")
-        |> range(start: -1y)
-        |> filter(fn: (r) => r._measurement == "devices")
-        |> filter(fn: (r) => r.device_id == "{device_id}")
-        |> limit(n: 1)
-        '''
-
-        try:
-            result = self.query_api.query(flux_query)
-            if result and len(result) > 0 and len(result[0].records) > 0:
-                record = result[0].records[0]
-                return {
-                    "device_id": record["device_id"],
-                    "name": record["_value"] if record["_field"] == "name" else None,
-                    "fw_version": record["_value"] if record["_field"] == "fw_version" else None,
-                    "type": record["_value"] if record["_field"] == "type" else None,
-                    "location": record["_value"] if record["_field"] == "location" else None,
-                    "tags": json.loads(record["_value"]) if record["_field"] == "tags" else [],
-                }
-            return None
-        except Exception as e:
-            print(f"Error getting device: {e}")
-            return None
+        return self.device_registry.get(device_id)
 
     def list_devices(self) -> List[Dict[str, Any]]:
-        """List all devices"""
+        """List all devices (served from the device registry)"""
         if not self.is_connected():
             return []
 
-        flux_query = f'''
-        from(bucket: "{self.bucket}")
-        |> range(start: -1y)
-        |> filter(fn: (r) => r._measurement == "devices")
-        |> group(columns: ["device_id"])
-        |> limit(n: 100)
-        '''
-
-        try:
-            result = self.query_api.query(flux_query)
-            devices = []
-            device_data = {}
-
-            for table in result:
-                for record in table.records:
-                    device_id = record["device_id"]
-                    if device_id not in device_data:
-                        device_data[device_id] = {"device_id": device_id}
-
-                    field = record["_field"]
-                    value = record["_value"]
-                    if field == "tags":
-                        device_data[device_id][field] = json.loads(value)
-                    else:
-                        device_data[device_id][field] = value
-
-            return list(device_data.values())
-        except Exception as e:
-            print(f"Error listing devices: {e}")
-            return []
+        return self.device_registry.list()
 
     def update_device(self, device_id: str, update_data: Dict[str, Any]) -> bool:
         """Update device information"""
@@ -343,92 +400,136 @@ class InfluxDBDataService:
             if not device:
                 return False
 
+            merged = {
+                "device_id": device_id,
+                "name": update_data.get("name", device.get("name")),
+                "fw_version": update_data.get("fw_version", device.get("fw_version")),
+                "type": update_data.get("type", device.get("type")),
+                "location": update_data.get("location", device.get("location")),
+                "tags": update_data.get("tags", device.get("tags", [])),
+            }
+
             # Create new point with updated data
             point = Point("devices") \
                 .tag("device_id", device_id) \
-                .field("name", update_data.get("name", device.get("name", ""))) \
-                .field("fw_version", update_data.get("fw_version", device.get("fw_version", ""))) \
-                .field("type", update_data.get("type", device.get("type", ""))) \
-                .field("location", update_data.get("location", device.get("location", ""))) \
-                .field("tags", json.dumps(update_data.get("tags", device.get("tags", [])))) \
+                .field("name", merged["name"] or "") \
+                .field("fw_version", merged["fw_version"] or "") \
+                .field("type", merged["type"] or "") \
+                .field("location", merged["location"] or "") \
+                .field("tags", json.dumps(merged["tags"] or [])) \
                 .time(datetime.utcnow(), WritePrecision.NS)
 
             if update_data.get("last_seen"):
                 point = point.field("last_seen", update_data["last_seen"].isoformat())
+                merged["last_seen"] = update_data["last_seen"]
 
             self.write_api.write(bucket=self.bucket, org=self.org, record=point)
+            self.device_registry.put(merged)
             return True
         except Exception as e:
             print(f"Error updating device: {e}")
             return False
 
     def update_device_last_seen(self, device_id: str, last_seen: datetime) -> bool:
-        """Update device last seen timestamp"""
+        """Update device last seen timestamp (coalesced, flushed periodically)"""
         if not self.is_connected():
             return False
 
-        try:
-            # Get existing device data
-            device = self.get_device(device_id)
-            if not device:
-                return False
-
-            # Update with new last_seen
-            update_data = {**device, "last_seen": last_seen}
-            return self.update_device(device_id, update_data)
-        except Exception as e:
-            print(f"Error updating device last seen: {e}")
-            return False
+        return self.device_registry.touch(device_id, last_seen)
 
     # Telemetry Management
     def save_telemetry(self, telemetry: TelemetryData) -> bool:
-        """Save telemetry data"""
-        if not self.is_connected():
+        """Queue telemetry data for the batching writer"""
+        try:
+            self.enqueue_telemetry(telemetry)
+            return True
+        except TelemetryRejected as e:
+            if e.reason == "invalid":
+                print(f"Error saving telemetry: {e}")
             return False
 
-        try:
-            point = Point("telemetry") \
-                .tag("device_id", telemetry.device_id) \
-                .field("temperature", telemetry.temperature or 0.0) \
-                .field("humidity", telemetry.humidity or 0.0) \
-                .field("distance", telemetry.distance or 0.0) \
-                .field("tx_bytes", telemetry.tx_bytes) \
-                .field("rx_bytes", telemetry.rx_bytes) \
-                .field("connections", telemetry.connections) \
-                .time(telemetry.ts, WritePrecision.NS)
-
-            if telemetry.motion is not None:
-                point = point.field("motion", telemetry.motion)
-            if telemetry.servo_state:
-                point = point.field("servo_state", telemetry.servo_state)
-            if telemetry.led_states:
-                point = point.field("led_states", json.dumps(telemetry.led_states))
+    def enqueue_telemetry(self, telemetry: TelemetryData):
+        """Queue telemetry data for the batching writer; raises TelemetryRejected with the reason"""
+        if not self.is_connected():
+            raise TelemetryRejected("disconnected", "InfluxDB not connected")
 
-            self.write_api.write(bucket=self.bucket, org=self.org, record=point)
-            return True
+        try:
+            line = self._telemetry_point(telemetry).to_line_protocol()
         except Exception as e:
-            print(f"Error saving telemetry: {e}")
-            return False
+            raise TelemetryRejected("invalid", f"Invalid telemetry point: {e}")
+        if not line:
+            raise TelemetryRejected("invalid", "Telemetry point has no field to write")
+        if not self.writer.enqueue(line):
+            raise TelemetryRejected("queue_full", "Telemetry write queue full")
+        # Only points on their way to InfluxDB are served from the hot buffer
+        self.buffer_telemetry(telemetry)
+
+    def save_telemetry_many(self, telemetry: List[TelemetryData]) -> List[bool]:
+        """Queue several telemetry points at once; returns whether each one was accepted"""
+        if not self.is_connected():
+            return [False] * len(telemetry)
+
+        accepted = []
+        for item in telemetry:
+            try:
+                ok = self.writer.enqueue(self._telemetry_point(item))
+            except Exception as e:
+                print(f"Error saving telemetry: {e}")
+                ok = False
+            if ok:
+                self.buffer_telemetry(item)
+            accepted.append(ok)
+        return accepted
+
+    def buffer_telemetry(self, telemetry: TelemetryData):
+        """Keep the point in the hot buffer, with the values written to InfluxDB"""
+        self.hot_buffer.record(telemetry.device_id, telemetry.ts, self._telemetry_fields(telemetry))
+
+    @staticmethod
+    def _telemetry_fields(telemetry: TelemetryData) -> Dict[str, Any]:
+        fields = {
+            "temperature": telemetry.temperature or 0.0,
+            "humidity": telemetry.humidity or 0.0,
+            "distance": telemetry.distance or 0.0,
+            "tx_bytes": telemetry.tx_bytes,
+            "rx_bytes": telemetry.rx_bytes,
+            "connections": telemetry.connections,
+        }
+        if telemetry.motion is not None:
+            fields["motion"] = telemetry.motion
+        return fields
+
+    @staticmethod
+    def _telemetry_point(telemetry: TelemetryData) -> Point:
+        point = Point("telemetry") \
+            .tag("device_id", telemetry.device_id) \
+            .time(telemetry.ts, WritePrecision.NS)
+        for name, value in InfluxDBDataService._telemetry_fields(telemetry).items():
+            point = point.field(name, value)
+
+        if telemetry.servo_state:
+            point = point.field("servo_state", telemetry.servo_state)
+        if telemetry.led_states:
+            point = point.field("led_states", json.dumps(telemetry.led_states))
+        return point
 
     def get_recent_telemetry(self, device_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
-        """Get recent telemetry data"""
+        """Get recent telemetry data (from the hot buffer when it holds the whole answer)"""
+        hot = self.hot_buffer.recent(limit, datetime.utcnow() - timedelta(hours=24), device_id=device_id)
+        if hot is not None:
+            return hot
+
         if not self.is_connected():
             return []
 
-        device_filter = f'|> filter(fn: (r) => r.device_id == "{device_id}")' if device_id else ""
-
-        flux_query = f'''
-        from(bucket: "{self.bucket}")
-        |> range(start: -24h)
-        |> filter(fn: (r) => r._measurement == "telemetry")
-        {device_filter}
-        |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-        |> sort(columns: ["_time"], desc: true)
-        |> limit(n: {limit})
-        '''
+        query = FluxQuery(self.bucket, "telemetry", start="24h") \
+            .tag("device_id", device_id) \
+            .fields(*TELEMETRY_FIELDS) \
+            .keep("device_id", *TELEMETRY_FIELDS) \
+            .newest(limit)
 
         try:
-            result = self.query_api.query(flux_query)
+            result = self.query(query)
             telemetry_data = []
 
             for table in result:
@@ -452,23 +553,12 @@ class InfluxDBDataService:
 
     # Alert Management
     def save_alert(self, alert: AlertData) -> bool:
-        """Save alert data"""
+        """Queue alert data for the batching writer"""
         if not self.is_connected():
             return False
 
         try:
-            point = Point("alerts") \
-                .tag("alert_id", alert.alert_id) \
-                .tag("device_id", alert.device_id) \
-                .field("severity", alert.severity) \
-                .field("score", alert.score) \
-                .field("reason", alert.reason or "") \
-                .field("acknowledged", alert.acknowledged) \
-                .field("metadata", json.dumps(alert.metadata or {})) \
-                .time(alert.ts, WritePrecision.NS)
-
-            self.write_api.write(bucket=self.bucket, org=self.org, record=point)
-            return True
+            return self.writer.enqueue(alert_point(alert))
         except Exception as e:
             print(f"Error saving alert: {e}")
             return False
@@ -478,46 +568,10 @@ class InfluxDBDataService:
         if not self.is_connected():
             return []
 
-        flux_query = f'''
-        from(bucket: "{self.bucket}")
-        |> range(start: -7d)
-        |> filter(fn: (r) => r._measurement == "alerts")
-        |> sort(columns: ["_time"], desc: true)
-        '''
+        query = FluxQuery(self.bucket, "alerts", start="7d").newest(limit)
 
         try:
-            result = self.query_api.query(flux_query)
-            
-            # Group records by alert_id and timestamp
-            alerts_by_key = {}
-            
-            for table in result:
-                for record in table.records:
-                    alert_id = record.values.get("alert_id")
-                    device_id = record.values.get("device_id")
-                    timestamp = record.get_time()
-                    field_name = record.get_field()
-                    field_value = record.get_value()
-                    
-                    key = (alert_id, timestamp)
-                    
-                    if key not in alerts_by_key:
-                        alerts_by_key[key] = {
-                            "alert_id": alert_id,
-                            "device_id": device_id,
-                            "ts": timestamp
-                        }
-                    
-                    alerts_by_key[key][field_name] = field_value
-            
-            # Convert to list and sort by timestamp (descending)
-            alerts = list(alerts_by_key.values())
-            alerts.sort(key=lambda x: x.get("ts", ""), reverse=True)
-            
-            # Limit results
-            alerts = alerts[:limit]
-
-            return alerts
+            return assemble_records(self.query(query))
         except Exception as e:
             print(f"Error getting alerts: {e}")
             return []
@@ -527,45 +581,20 @@ class InfluxDBDataService:
         if not self.is_connected():
             return []
 
-        flux_query = f'''
-        from(bucket: "{self.bucket}")
-        |> range(start: -30d)
-        |> filter(fn: (r) => r._measurement == "alerts")
-        |> filter(fn: (r) => r._field == "acknowledged" and r._value == false)
-        |> sort(columns: ["_time"], desc: true)
-        |> limit(n: 100)
-        '''
+        # Pivot server-side so each row is a full alert, then keep unacknowledged ones
+        query = FluxQuery(self.bucket, "alerts", start="30d") \
+            .where("acknowledged", "==", False) \
+            .newest(100)
 
         try:
-            result = self.query_api.query(flux_query)
-            alerts = []
-
-            for table in result:
-                for record in table.records:
-                    alert = {
-                        "alert_id": record["alert_id"],
-                        "device_id": record["device_id"],
-                        "ts": record["_time"],
-                        "acknowledged": False,
-                    }
-                    # Get other fields for this alert
-                    for field_record in table.records:
-                        if (field_record["alert_id"] == record["alert_id"] and
-                            field_record["_time"] == record["_time"]):
-                            field = field_record["_field"]
-                            value = field_record["_value"]
-                            if field != "acknowledged":
-                                alert[field] = value
-                    alerts.append(alert)
-
-            return alerts
+            return assemble_records(self.query(query))
         except Exception as e:
             print(f"Error getting active alerts: {e}")
             return []
 
     # Suricata Log Management
     def save_suricata_log(self, log_data: SuricataLogData) -> bool:
-        """Save Suricata log data"""
+        """Queue Suricata log data for the batching writer"""
         if not self.is_connected():
             return False
 
@@ -583,8 +612,7 @@ class InfluxDBDataService:
                 .field("raw", json.dumps(log_data.raw or {})) \
                 .time(log_data.event_ts or datetime.utcnow(), WritePrecision.NS)
 
-            self.write_api.write(bucket=self.bucket, org=self.org, record=point)
-            return True
+            return self.writer.enqueue(point)
         except Exception as e:
             print(f"Error saving Suricata log: {e}")
             return False
@@ -594,143 +622,104 @@ class InfluxDBDataService:
         if not self.is_connected():
             return []
 
-        flux_query = f'''
-        from(bucket: "{self.bucket}")
-        |> range(start: -24h)
-        |> filter(fn: (r) => r._measurement == "suricata_alerts")
-        |> sort(columns: ["_time"], desc: true)
-        '''
+        query = FluxQuery(self.bucket, "suricata_alerts", start="24h").newest(limit)
 
         try:
-            result = self.query_api.query(flux_query)
-            
-            # Group records by timestamp
-            logs_by_time = {}
-            
-            for table in result:
-                for record in table.records:
-                    timestamp = record.get_time()
-                    field_name = record.get_field()
-                    field_value = record.get_value()
-                    
-                    if timestamp not in logs_by_time:
-                        logs_by_time[timestamp] = {"event_ts": timestamp}
-                    
-                    logs_by_time[timestamp][field_name] = field_value
-            
-            # Convert to list and sort by timestamp (descending)
-            logs = list(logs_by_time.values())
-            logs.sort(key=lambda x: x.get("event_ts", ""), reverse=True)
-            
-            # Limit results
-            logs = logs[:limit]
-
-            return logs
+            return assemble_records(self.query(query), time_key="event_ts")
         except Exception as e:
             print(f"Error getting Suricata logs: {e}")
             return []
 
     # Dashboard Analytics
     def get_dashboard_summary(self) -> Dict[str, Any]:
-        """Get dashboard summary statistics"""
+        """Get dashboard summary statistics (cached snapshot, refreshed in the background)"""
         if not self.is_connected():
             return {}
-
-        try:
-            # Device count
-            device_query = f'''
-            from(bucket: "{self.bucket}")
+        return self.dashboard_cache.get()
+
+    def _dashboard_queries(self) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """Flux queries behind the dashboard summary, keyed by summary field, and their params"""
+        today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        params = {"bucket": self.bucket, "today_start": today_start}
+        return {
+            # Alert count (last 24h): one "score" value per alert, in both alert schemas
+            "alerts_24h": '''
+            from(bucket: params.bucket)
             |> range(start: -24h)
-            |> filter(fn: (r) => r._measurement == "devices")
+            |> filter(fn: (r) => r._measurement == "alerts" and r._field == "score")
             |> group()
             |> count()
-            '''
-            device_result = self.query_api.query(device_query)
-            device_count = 0
-            if device_result and len(device_result) > 0:
-                device_count = device_result[0].records[0]["_value"] if device_result[0].records else 0
-
-            # Alert count (last 24h)
-            alert_query = f'''
-            from(bucket: "{self.bucket}")
-            |> range(start: -24h)
-            |> filter(fn: (r) => r._measurement == "alerts")
-            |> count()
-            '''
-            alert_result = self.query_api.query(alert_query)
-            alert_count_24h = 0
-            if alert_result and len(alert_result) > 0:
-                alert_count_24h = alert_result[0].records[0]["_value"] if alert_result[0].records else 0
-
+            ''',
             # Active alerts (unacknowledged)
-            active_alert_query = f'''
-            from(bucket: "{self.bucket}")
+            "alerts_active": '''
+            from(bucket: params.bucket)
             |> range(start: -30d)
             |> filter(fn: (r) => r._measurement == "alerts")
             |> filter(fn: (r) => r._field == "acknowledged" and r._value == false)
+            |> group()
             |> count()
-            '''
-            active_alert_result = self.query_api.query(active_alert_query)
-            alerts_active = 0
-            if active_alert_result and len(active_alert_result) > 0:
-                alerts_active = active_alert_result[0].records[0]["_value"] if active_alert_result[0].records else 0
-
-            # Anomalies in last 24h (ML-detected alerts)
-            anomaly_query = f'''
-            from(bucket: "{self.bucket}")
-            |> range(start: -24h)
-            |> filter(fn: (r) => r._measurement == "alerts")
-            |> filter(fn: (r) => r._field == "reason" and contains(value: r._value, set: ["ML", "anomalie"]))
-            |> count()
-            '''
-            anomaly_result = self.query_api.query(anomaly_query)
-            anomalies_24h = 0
-            if anomaly_result and len(anomaly_result) > 0:
-                anomalies_24h = anomaly_result[0].records[0]["_value"] if anomaly_result[0].records else 0
-
-            # Telemetry count (last 24h)
-            telemetry_query = f'''
-            from(bucket: "{self.bucket}")
+            ''',
+            # Anomalies in last 24h (ML-detected alerts: source tag, or reason text for v1 alerts)
+            "anomalies_24h": '''
+            import "strings"
+            from(bucket: params.bucket)
             |> range(start: -24h)
-            |> filter(fn: (r) => r._measurement == "telemetry")
+            |> filter(fn: (r) => r._measurement == "alerts" and r._field == "reason")
+            |> filter(fn: (r) => (exists r.source and r.source == "ml")
+                or strings.containsStr(v: r._value, substr: "ML")
+                or strings.containsStr(v: r._value, substr: "nomalie"))
+            |> group()
             |> count()
-            '''
-            telemetry_result = self.query_api.query(telemetry_query)
-            telemetry_count_24h = 0
-            if telemetry_result and len(telemetry_result) > 0:
-                telemetry_count_24h = telemetry_result[0].records[0]["_value"] if telemetry_result[0].records else 0
-
-            # Data volume today (GB)
-            from datetime import datetime, timedelta
-            today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-            data_volume_query = f'''
-            from(bucket: "{self.bucket}")
-            |> range(start: {today_start.isoformat()}Z)
+            ''',
+            # Data volume today
+            "data_volume_today_bytes": '''
+            from(bucket: params.bucket)
+            |> range(start: params.today_start)
             |> filter(fn: (r) => r._measurement == "telemetry")
             |> filter(fn: (r) => r._field == "tx_bytes" or r._field == "rx_bytes")
             |> sum()
-            '''
-            data_volume_result = self.query_api.query(data_volume_query)
-            data_volume_today_bytes = 0
-            if data_volume_result and len(data_volume_result) > 0:
-                for table in data_volume_result:
-                    for record in table.records:
-                        data_volume_today_bytes += record.get_value() or 0
-            data_volume_today_gb = round(data_volume_today_bytes / (1024 ** 3), 2)
-
-            return {
-                "total_devices": device_count,
-                "alerts_24h": alert_count_24h,
-                "alerts_active": alerts_active,
-                "anomalies_24h": anomalies_24h,
-                "telemetry_24h": telemetry_count_24h,
-                "data_volume_today_gb": data_volume_today_gb,
-                "system_status": "operational" if self.is_connected() else "error"
-            }
-        except Exception as e:
-            print(f"Error getting dashboard summary: {e}")
+            ''',
+        }, params
+
+    def compute_dashboard_summary(self, executor) -> Dict[str, Any]:
+        """
+        Run the dashboard queries concurrently on `executor` and merge the results.
+        Used by the dashboard cache refresher; readers go through get_dashboard_summary.
+        """
+        if not self.is_connected():
             return {}
 
+        queries, params = self._dashboard_queries()
+        futures = {
+            name: executor.submit(self.query_api.query, flux_query, params=params)
+            for name, flux_query in queries.items()
+        }
+        # Telemetry count (last 24h) is summed from the hourly rollup
+        telemetry_24h = executor.submit(self.rollups.count_points, datetime.utcnow() - timedelta(hours=24))
+        values = {}
+        for name, future in futures.items():
+            total = 0
+            # data volume sums one table per series; counts only read the first record
+            tables = future.result()
+            if name == "data_volume_today_bytes":
+                for table in tables:
+                    for record in table.records:
+                        total += record.get_value() or 0
+            elif tables and tables[0].records:
+                total = tables[0].records[0]["_value"]
+            values[name] = total
+
+        return {
+            # Device count comes from the in-memory registry
+            "total_devices": len(self.device_registry.list()),
+            "alerts_24h": values["alerts_24h"],
+            "alerts_active": values["alerts_active"],
+            "anomalies_24h": values["anomalies_24h"],
+            "telemetry_24h": telemetry_24h.result(),
+            "data_volume_today_gb": round(values["data_volume_today_bytes"] / (1024 ** 3), 2),
+            "system_status": "operational" if self.is_connected() else "error"
+        }
+
     def seed_initial_data(self):
         """Seed initial data for development"""
         try:
@@ -773,5 +762,17 @@ class InfluxDBDataService:
         except Exception as e:
             print(f"Error seeding initial data: {e}")
 
-# Global instance
-influx_data_service = InfluxDBDataService()
\ No newline at end of file
+# Global instance for scripts, created on first access: importing this module
+# (the API and ingest workers build their own service) opens no client
+_influx_data_service: Optional[InfluxDBDataService] = None
+_influx_data_service_lock = threading.Lock()
+
+
+def __getattr__(name: str):
+    global _influx_data_service
+    if name != "influx_data_service":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _influx_data_service_lock:
+        if _influx_data_service is None:
+            _influx_data_service = InfluxDBDataService()
+    return _influx_data_service
\ No newline at end of file
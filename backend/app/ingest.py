@@ -0,0 +1,194 @@
+"""
+Telemetry ingestion pipeline: decode -> persist -> stats -> score -> alert -> broadcast.
+Shared by the API process (MQTT_INGEST_IN_API=true) and the standalone ingest
+worker (python -m app.ingest_worker); only the broadcast target differs.
+"""
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from .ml_service import anomaly_service
+from .model_registry import anomaly_batcher
+from .payload_codecs import parse_topic, payload_format, decode_payload
+from .streaming_stats import StreamingStatsStore, ZScoreDetector, STREAM_FIELDS, stream_features
+
+
+class TelemetryIngestor:
+    """
+    Processing of one telemetry message.
+
+    Args:
+        data_service: InfluxDBDataService (None while the database is unavailable)
+        publish: callable receiving live events (dict) for WebSocket clients
+        notifier: NotificationDispatcher for alert e-mails
+
+    Per-device streaming statistics are updated for every sample; they add
+    temporal features to the model input and drive the z-score detector
+    used while the model is not trained.
+    """
+
+    def __init__(self, data_service, publish: Callable[[Dict[str, Any]], Any], notifier):
+        self.data_service = data_service
+        self.publish = publish
+        self.notifier = notifier
+        self.stream_stats = StreamingStatsStore()
+        self.zscore = ZScoreDetector()
+
+    def handle_mqtt_message(self, topic: str, raw_payload: bytes, content_type: Optional[str] = None):
+        """Decode and process one MQTT message (runs in the bridge worker pool)"""
+        device_id, suffix = parse_topic(topic)
+        if device_id is None:
+            return
+        payload = decode_payload(raw_payload, payload_format(suffix, content_type))
+        self.process_telemetry(device_id, payload)
+
+    def process_telemetry(self, device_id: str, payload: dict):
+        """Process incoming telemetry from ESP32 devices"""
+        try:
+            # Extract sensor data
+            sensors = payload.get('sensors', {})
+            net = payload.get('net', {})
+
+            # Create TelemetryData object
+            from .influxdb_data_service import TelemetryData
+            telemetry_data = TelemetryData(
+                device_id=device_id,
+                ts=datetime.utcnow(),
+                temperature=sensors.get('temperature'),
+                humidity=sensors.get('humidity'),
+                distance=sensors.get('distance'),
+                motion=sensors.get('motion'),
+                servo_state=sensors.get('servo_state'),
+                led_states=sensors.get('led_states'),
+                tx_bytes=net.get('tx_bytes', 0),
+                rx_bytes=net.get('rx_bytes', 0),
+                connections=net.get('connections', 0)
+            )
+
+            # Write telemetry to InfluxDB
+            if self.data_service:
+                self.data_service.save_telemetry(telemetry_data)
+
+                # Update device last_seen
+                self.data_service.update_device_last_seen(device_id, datetime.utcnow())
+
+                print(f"✅ Telemetry saved: {device_id} - Temp: {sensors.get('temperature')}°C, Humidity: {sensors.get('humidity')}%")
+
+            stream = self.observe(telemetry_data)
+
+            # Score through the micro-batcher; alerts are raised when the batch completes
+            if anomaly_service:
+                future = anomaly_batcher.submit(self.to_ml_payload(telemetry_data, stream))
+                future.add_done_callback(lambda f: self._on_scored(telemetry_data, stream, f))
+            else:
+                self.check_zscore(telemetry_data, stream)
+
+            # Broadcast telemetry update via WebSocket
+            self.publish({
+                "type": "telemetry",
+                "device_id": device_id,
+                "sensors": sensors,
+                "net": net,
+                "ts": datetime.utcnow().isoformat()
+            })
+
+            print(f"Processed telemetry for device {device_id}")
+
+        except Exception as e:
+            print(f"Error processing telemetry: {e}")
+
+    def observe(self, telemetry_data) -> Dict[str, Dict[str, Any]]:
+        """Update the device's streaming statistics with one sample"""
+        return self.stream_stats.update(telemetry_data.device_id, telemetry_data.ts,
+                                        {name: getattr(telemetry_data, name) for name in STREAM_FIELDS})
+
+    def to_ml_payload(self, telemetry_data, stream: Optional[Dict[str, Dict[str, Any]]] = None) -> dict:
+        """Feature input expected by the anomaly detection service (+ streaming features)"""
+        device = self.data_service.get_device(telemetry_data.device_id) if self.data_service else None
+        payload = {
+            'device_id': telemetry_data.device_id,
+            'device_type': device.get('type') if device else None,
+            'temperature': telemetry_data.temperature,
+            'humidity': telemetry_data.humidity,
+            'distance': telemetry_data.distance,
+            'motion': telemetry_data.motion,
+            'servo_state': telemetry_data.servo_state,
+            'led_states': telemetry_data.led_states,
+            'tx_bytes': telemetry_data.tx_bytes,
+            'rx_bytes': telemetry_data.rx_bytes,
+            'connections': telemetry_data.connections,
+            'ts': telemetry_data.ts.isoformat(),
+        }
+        if stream is not None:
+            payload.update(stream_features(stream))
+        return payload
+
+    def _on_scored(self, telemetry_data, stream, future):
+        """Micro-batch completion callback for MQTT-ingested telemetry"""
+        try:
+            is_anomaly, anom_score, status = future.result()
+        except Exception as e:
+            print(f"Error scoring telemetry: {e}")
+            is_anomaly, status = False, "error"
+        if is_anomaly:
+            self.raise_ml_alert(telemetry_data, anom_score)
+        elif status != "trained":
+            self.check_zscore(telemetry_data, stream)
+
+    def check_zscore(self, telemetry_data, stream: Dict[str, Dict[str, Any]]):
+        """Fallback detection while no model is trained; returns the raised alert, if any"""
+        hit = self.zscore.check(stream)
+        if hit is None:
+            return None
+        field, z = hit
+        return self.raise_zscore_alert(telemetry_data, field, z, stream[field])
+
+    def raise_ml_alert(self, telemetry_data, anom_score: float):
+        """Persist, notify and broadcast an ML anomaly alert"""
+        from .influxdb_data_service import AlertData
+        alert_data = AlertData(
+            alert_id=str(uuid.uuid4()),
+            device_id=telemetry_data.device_id,
+            ts=telemetry_data.ts,
+            severity="high",
+            score=float(-anom_score),
+            reason=f"Anomalie détectée par modèle ML (score={anom_score:.4f})",
+            acknowledged=False,
+            source="ml",
+            metadata={"metric": "ml", "model": "isolation_forest"}
+        )
+        return self._emit_alert(alert_data)
+
+    def raise_zscore_alert(self, telemetry_data, field: str, z: float, stats: Dict[str, Any]):
+        """Persist, notify and broadcast a z-score (fallback detector) alert"""
+        from .influxdb_data_service import AlertData
+        alert_data = AlertData(
+            alert_id=str(uuid.uuid4()),
+            device_id=telemetry_data.device_id,
+            ts=telemetry_data.ts,
+            severity="high" if abs(z) >= 2 * self.zscore.threshold else "medium",
+            score=float(abs(z)),
+            reason=f"Anomalie statistique sur {field} (z-score={z:.2f})",
+            acknowledged=False,
+            source="zscore",
+            metadata={"metric": field, "detector": "zscore", "value": stats["value"],
+                      "mean": stats["mean"], "std": stats["std"], "z": z}
+        )
+        return self._emit_alert(alert_data)
+
+    def _emit_alert(self, alert_data):
+        if self.data_service:
+            self.data_service.save_alert(alert_data)
+        self.notifier.notify(alert_data.model_dump())
+
+        # Broadcast alert via WebSocket
+        self.publish({
+            "type": "alert",
+            "alert_id": alert_data.alert_id,
+            "device_id": alert_data.device_id,
+            "severity": alert_data.severity,
+            "score": alert_data.score,
+            "reason": alert_data.reason,
+            "ts": alert_data.ts.isoformat()
+        })
+        return alert_data
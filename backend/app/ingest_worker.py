@@ -0,0 +1,79 @@
+"""
+Standalone telemetry ingestion process.
+
+    python -m app.ingest_worker
+
+Consumes the MQTT telemetry stream outside the API so consumers scale
+independently of HTTP workers. Run several of these (and/or API replicas)
+with the same MQTT_SHARED_GROUP: the broker delivers each message to one
+consumer of the group. Set MQTT_INGEST_IN_API=false on the API so it stops
+consuming telemetry itself; live telemetry/alert events are published on
+MQTT_EVENTS_TOPIC/<type> and relayed by the API to its WebSocket clients.
+"""
+import asyncio
+import json
+import signal
+from typing import Any, Dict
+
+from .influxdb_data_service import InfluxDBDataService
+from .ingest import TelemetryIngestor
+from .ml_service import anomaly_service
+from .mqtt_bridge import MqttIngestBridge
+from .mqtt_consumer import MqttConsumerGroup, TELEMETRY_TOPICS, EVENTS_TOPIC
+from .notifications import NotificationDispatcher
+
+
+class EventPublisher:
+    """Best-effort publication of live events for the API's WebSocket clients"""
+
+    def __init__(self, consumers: MqttConsumerGroup, topic: str = EVENTS_TOPIC):
+        self.consumers = consumers
+        self.topic = topic
+
+    def __call__(self, message: Dict[str, Any]):
+        try:
+            self.consumers.publish(f"{self.topic}/{message.get('type', 'event')}",
+                                   json.dumps(message, default=str))
+        except Exception:
+            # Live updates are not persisted state: drop them while disconnected
+            pass
+
+
+async def run():
+    anomaly_service.convert_legacy_model()
+
+    try:
+        data_service = InfluxDBDataService()
+        data_service.device_registry.load()
+        data_service.start_writer()
+        print("InfluxDB service initialized successfully")
+    except Exception as e:
+        print(f"Failed to initialize InfluxDB service: {e}")
+        data_service = None
+
+    notifier = NotificationDispatcher()
+    ingestor = TelemetryIngestor(data_service, publish=lambda message: None, notifier=notifier)
+    bridge = MqttIngestBridge(ingestor.handle_mqtt_message)
+    consumers = MqttConsumerGroup(TELEMETRY_TOPICS, bridge.submit, client_id_prefix="siac-ingest-worker")
+    ingestor.publish = EventPublisher(consumers)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await bridge.start()
+    consumers.start()
+    print("Ingest worker running")
+    await stop.wait()
+
+    print("Ingest worker stopping")
+    consumers.stop()
+    await bridge.stop()
+    notifier.close()
+    if data_service:
+        data_service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
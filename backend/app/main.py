@@ -1,7 +1,7 @@
-from fastapi import FastAPI, HTTPException, WebSocket
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
 from pydantic import BaseModel
 from typing import List, Set, Optional
 import uuid
@@ -9,18 +9,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime, timedelta
 import math
 import os
-import pandas as pd
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
-from reportlab.lib import colors
-import io
 import json
+import asyncio
 import threading
-import paho.mqtt.client as mqtt
-import smtplib
-from email.mime.text import MIMEText
 from passlib.context import CryptContext
-import ssl
 
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
@@ -113,12 +105,28 @@ class SuricataLog(BaseModel):
     raw: Optional[dict] = None
 
 # Import services
-from .influxdb_data_service import InfluxDBDataService
+from .influxdb_data_service import InfluxDBDataService, TelemetryRejected
 from .ml_service import anomaly_service
+from .model_registry import model_registry, anomaly_batcher
+from .mqtt_bridge import MqttIngestBridge
+from .ml_training import TrainingJobManager, FLUX_DURATION_RE
+from .flux_records import assemble_records
+from .flux_query import FluxQuery, parse_duration
+from .exports import stream_export, STREAMING_FORMATS
+from .reports import ReportJobManager
+from .notifications import NotificationDispatcher
+from .ws_broadcaster import WebSocketBroadcaster
+from .telemetry_batch import parse_batch, BatchTooLarge
+from .ingest import TelemetryIngestor
+from .rollups import MARKER_FIELD
+from .mqtt_consumer import MqttConsumerGroup, TELEMETRY_TOPICS, EVENTS_TOPIC, ingest_in_api
 
 # Initialize services
 influx_data_service = None
 influx_service = None  # Alias for backward compatibility
+report_jobs: Optional[ReportJobManager] = None
+training_jobs = TrainingJobManager(model_registry.reload_path)
+notification_dispatcher = NotificationDispatcher()
 
 # Create FastAPI app
 app = FastAPI(title="SIAC-IoT Backend", version="1.0.0")
@@ -135,7 +143,10 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup"""
-    global influx_data_service, influx_service
+    global influx_data_service, influx_service, report_jobs
+
+    # Convert a legacy pickled model to the mmap artifact (no-op once converted)
+    anomaly_service.convert_legacy_model()
 
     # Initialize InfluxDB service
     try:
@@ -143,6 +154,23 @@ async def startup_event():
         influx_service = influx_data_service  # Alias for backward compatibility
         print("InfluxDB service initialized successfully")
 
+        # Reports are rendered in worker processes with their own InfluxDB client
+        report_jobs = ReportJobManager({
+            "url": influx_data_service.url,
+            "token": influx_data_service.token,
+            "org": influx_data_service.org,
+            "bucket": influx_data_service.bucket,
+        })
+
+        # Load the device registry once; lookups are served from memory afterwards
+        influx_data_service.device_registry.load()
+
+        # Keep the 1-minute / 1-hour telemetry rollups up to date
+        influx_data_service.rollups.start()
+
+        # Open the write spool and replay what earlier processes left in it
+        influx_data_service.start_writer()
+
         # Seed initial data
         influx_data_service.seed_initial_data()
         print("Initial data seeded successfully")
@@ -150,173 +178,55 @@ async def startup_event():
         print(f"Failed to initialize InfluxDB service: {e}")
         influx_data_service = None
         influx_service = None
+    ingestor.data_service = influx_data_service
 
-    # Initialize MQTT client
-    init_mqtt_client()
-
-# MQTT Client setup
-mqtt_client = None
-mqtt_connected = False
-
-# WebSocket connections
-websocket_connections = set()
-
-def on_mqtt_connect(client, userdata, flags, rc):
-    global mqtt_connected
-    if rc == 0:
-        mqtt_connected = True
-        print("MQTT connected successfully")
-        # Subscribe to ESP32 telemetry topics
-        client.subscribe("devices/+/telemetry")
-        print("Subscribed to devices/+/telemetry")
-    else:
-        mqtt_connected = False
-        print(f"MQTT connection failed with code {rc}")
-
-def on_mqtt_disconnect(client, userdata, rc):
-    global mqtt_connected
-    mqtt_connected = False
-    print(f"MQTT disconnected with code {rc}")
-
-def on_mqtt_message(client, userdata, msg):
-    try:
-        payload = json.loads(msg.payload.decode())
-        device_id = msg.topic.split('/')[1]  # Extract device_id from topic
-        
-        # Process telemetry data
-        process_telemetry(device_id, payload)
-    except Exception as e:
-        print(f"Error processing MQTT message: {e}")
+    # Start the MQTT -> event loop hand-off before messages can arrive
+    await mqtt_bridge.start()
 
-def process_telemetry(device_id: str, payload: dict):
-    """Process incoming telemetry from ESP32 devices"""
-    try:
-        # Extract sensor data
-        sensors = payload.get('sensors', {})
-        net = payload.get('net', {})
-        
-        # Create TelemetryData object
-        from app.influxdb_data_service import TelemetryData
-        telemetry_data = TelemetryData(
-            device_id=device_id,
-            ts=datetime.utcnow(),
-            temperature=sensors.get('temperature'),
-            humidity=sensors.get('humidity'),
-            distance=sensors.get('distance'),
-            motion=sensors.get('motion'),
-            servo_state=sensors.get('servo_state'),
-            led_states=sensors.get('led_states'),
-            tx_bytes=net.get('tx_bytes', 0),
-            rx_bytes=net.get('rx_bytes', 0),
-            connections=net.get('connections', 0)
-        )
-        
-        # Write telemetry to InfluxDB
-        if influx_data_service:
-            influx_data_service.save_telemetry(telemetry_data)
-            
-            # Update device last_seen
-            influx_data_service.update_device_last_seen(device_id, datetime.utcnow())
-            
-            print(f"✅ Telemetry saved: {device_id} - Temp: {sensors.get('temperature')}°C, Humidity: {sensors.get('humidity')}%")
+    # Start the MQTT consumers (telemetry, or ingest worker events)
+    mqtt_consumers.start()
 
-        # Check for anomalies using ML service
-        if anomaly_service:
-            features = [
-                sensors.get('temperature', 0) or 0,
-                sensors.get('humidity', 0) or 0,
-                sensors.get('distance', 0) or 0,
-                1 if sensors.get('motion', False) else 0,
-                net.get('tx_bytes', 0),
-                net.get('rx_bytes', 0),
-                net.get('connections', 0)
-            ]
-            
-            is_anomaly, score, reason = anomaly_service.predict_anomaly(features)
-            
-            if is_anomaly:
-                # Create alert in InfluxDB
-                if influx_data_service:
-                    alert_id = str(uuid.uuid4())
-                    influx_data_service.save_alert(
-                        alert_id=alert_id,
-                        device_id=device_id,
-                        severity="high" if score > 0.8 else "medium",
-                        score=score,
-                        reason=reason or "Anomaly detected in sensor data",
-                        acknowledged=False,
-                        timestamp=datetime.utcnow()
-                    )
-
-                    # Send email alert if configured
-                    alert_data = {
-                        "alert_id": alert_id,
-                        "device_id": device_id,
-                        "severity": "high" if score > 0.8 else "medium",
-                        "score": score,
-                        "reason": reason or "Anomaly detected in sensor data",
-                        "ts": datetime.utcnow()
-                    }
-                    maybe_send_email_alert(alert_data)
-                    
-                    # Broadcast alert via WebSocket
-                    import asyncio
-                    asyncio.create_task(broadcast_websocket_message({
-                        "type": "alert",
-                        "alert_id": alert_id,
-                        "device_id": device_id,
-                        "severity": "high" if score > 0.8 else "medium",
-                        "score": score,
-                        "reason": "Anomaly detected in sensor data",
-                        "ts": datetime.utcnow().isoformat()
-                    }))
-        
-        # Broadcast telemetry update via WebSocket
-        import asyncio
-        asyncio.create_task(broadcast_websocket_message({
-            "type": "telemetry",
-            "device_id": device_id,
-            "sensors": sensors,
-            "net": net,
-            "ts": datetime.utcnow().isoformat()
-        }))
-        
-        print(f"Processed telemetry for device {device_id}")
-        
-    except Exception as e:
-        print(f"Error processing telemetry: {e}")
-
-def init_mqtt_client():
-    global mqtt_client
-    mqtt_host = os.environ.get("MQTT_HOST")
-    mqtt_port = int(os.environ.get("MQTT_PORT"))
-    mqtt_user = os.environ.get("MQTT_USERNAME")
-    mqtt_pass = os.environ.get("MQTT_PASSWORD")
-    mqtt_ca_cert = os.environ.get("MQTT_CA_CERT")
-    mqtt_tls_enabled = os.environ.get("MQTT_TLS_ENABLED", "false").lower() == "true"
-    
-    mqtt_client = mqtt.Client()
-    mqtt_client.on_connect = on_mqtt_connect
-    mqtt_client.on_disconnect = on_mqtt_disconnect
-    mqtt_client.on_message = on_mqtt_message
-    
-    if mqtt_user and mqtt_pass:
-        mqtt_client.username_pw_set(mqtt_user, mqtt_pass)
-
-    # TLS configuration only if enabled
-    if mqtt_tls_enabled and mqtt_ca_cert:
-        mqtt_client.tls_set(ca_certs=mqtt_ca_cert, keyfile=None, tls_version=ssl.PROTOCOL_TLS_CLIENT)
-        mqtt_client.tls_insecure_set(False)
-        print(f"MQTT TLS enabled with CA cert: {mqtt_ca_cert}")
-    else:
-        print("MQTT TLS disabled, using plain connection")
-    
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop consumers and flush pending writes"""
+    mqtt_consumers.stop()
+    await mqtt_bridge.stop()
+    training_jobs.shutdown()
+    if report_jobs:
+        report_jobs.shutdown()
+    notification_dispatcher.close()
+    await ws_broadcaster.close()
+    if influx_data_service:
+        influx_data_service.close()
+
+# WebSocket clients
+ws_broadcaster = WebSocketBroadcaster()
+
+def schedule_broadcast(message: dict):
+    """Broadcast to WebSocket clients from any thread"""
+    ws_broadcaster.publish(message)
+
+def relay_ingest_event(topic: str, raw_payload: bytes, content_type: Optional[str] = None):
+    """Forward a live event published by an ingest worker to WebSocket clients"""
     try:
-        mqtt_client.connect(mqtt_host, mqtt_port, 60)
-        mqtt_client.loop_start()  # Start in background thread
-        print(f"MQTT client initialized for {mqtt_host}:{mqtt_port}")
-    except Exception as e:
-        print(f"Failed to initialize MQTT client: {e}")
+        message = json.loads(raw_payload)
+        ws_broadcaster.publish(message)
+        # Keep relayed telemetry in the hot buffer: recent reads stay local
+        if message.get("type") == "telemetry" and influx_data_service:
+            influx_data_service.buffer_telemetry(telemetry_from_request(Telemetry(**message)))
+    except ValueError as e:
+        print(f"Invalid ingest event on {topic}: {e}")
+
+# Telemetry ingestion: in this process by default, or in app.ingest_worker processes
+# (MQTT_INGEST_IN_API=false), in which case the API only relays their live events
+ingestor = TelemetryIngestor(None, publish=schedule_broadcast, notifier=notification_dispatcher)
+mqtt_bridge = MqttIngestBridge(ingestor.handle_mqtt_message)
+if ingest_in_api():
+    mqtt_consumers = MqttConsumerGroup(TELEMETRY_TOPICS, mqtt_bridge.submit)
+else:
+    mqtt_consumers = MqttConsumerGroup([f"{EVENTS_TOPIC}/#"], relay_ingest_event,
+                                       consumers=1, shared_group="", client_id_prefix="siac-api")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -332,43 +242,71 @@ def root():
 @app.get("/api/v1/health")
 def health():
     influx_status = "connected" if influx_service and influx_service.is_connected() else "disconnected"
-    return {"status": "ok", "components": {"mqtt": "connected" if mqtt_connected else "disconnected", "influx": influx_status}}
+    return {"status": "ok", "components": {"mqtt": "connected" if mqtt_consumers.is_connected() else "disconnected", "influx": influx_status}}
+
+
+@app.get("/api/v1/metrics/pipeline")
+def pipeline_metrics():
+    """Ingest pipeline counters (queue depth, drops, retries)"""
+    return {
+        "influx_writer": influx_data_service.get_write_metrics() if influx_data_service else {},
+        "mqtt_ingest": mqtt_bridge.get_metrics(),
+        "mqtt_consumers": mqtt_consumers.get_metrics(),
+        "ml_scoring": anomaly_batcher.get_stats(),
+        "dashboard_cache": influx_data_service.dashboard_cache.get_stats() if influx_data_service else {},
+        "rollups": influx_data_service.rollups.get_metrics() if influx_data_service else {},
+        "hot_buffer": influx_data_service.hot_buffer.get_metrics() if influx_data_service else {},
+        "stream_stats": ingestor.stream_stats.get_metrics(),
+        "notifications": notification_dispatcher.get_metrics(),
+        "websocket": ws_broadcaster.get_metrics(),
+    }
 
 
 async def broadcast_websocket_message(message: dict):
-    """Broadcast message to all connected WebSocket clients"""
-    disconnected = set()
-    for websocket in websocket_connections:
-        try:
-            await websocket.send_json(message)
-        except:
-            disconnected.add(websocket)
-    
-    # Remove disconnected clients
-    websocket_connections.difference_update(disconnected)
+    """Broadcast message to all subscribed WebSocket clients"""
+    ws_broadcaster.publish(message)
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    websocket_connections.add(websocket)
-
+    """
+    Live updates. Filters can be given in the URL
+    (/ws?device_id=a,b&types=telemetry,alert&rate=2&aggregate=1) or changed later by sending
+    {"action": "subscribe", "device_ids": [...], "types": [...], "rate": 2, "aggregate": true}.
+    With a rate (Hz), telemetry is coalesced to the latest sample per device per window
+    (plus min/max/mean with aggregate); alerts are always delivered immediately.
+    Any other message is answered with a pong.
+    """
+    client = await ws_broadcaster.connect(websocket,
+                                          device_ids=websocket.query_params.get("device_id"),
+                                          types=websocket.query_params.get("types"),
+                                          rate=websocket.query_params.get("rate"),
+                                          aggregate=websocket.query_params.get("aggregate", False))
     try:
-        # Keep connection alive for broadcasting, don't expect client messages
         while True:
             try:
-                # Wait for any message with a timeout to keep connection alive
-                await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
-                # If we get a message, echo it back for health check
-                await websocket.send_json({"type": "pong", "timestamp": datetime.utcnow().isoformat()})
+                text = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
             except asyncio.TimeoutError:
                 # Send a ping to keep connection alive
-                await websocket.send_json({"type": "ping", "timestamp": datetime.utcnow().isoformat()})
+                ws_broadcaster.send(client, {"type": "ping", "timestamp": datetime.utcnow().isoformat()})
+                continue
+            if client.closed:
+                break
+            try:
+                request = json.loads(text)
+            except ValueError:
+                request = None
+            if isinstance(request, dict) and request.get("action") == "subscribe":
+                ws_broadcaster.subscribe(client, request.get("device_ids"), request.get("types"),
+                                         request.get("rate"), request.get("aggregate", False))
+                ws_broadcaster.send(client, {"type": "subscribed", **client.subscription()})
+            else:
+                ws_broadcaster.send(client, {"type": "pong", "timestamp": datetime.utcnow().isoformat()})
     except Exception:
         # Connection closed or error
         pass
     finally:
-        websocket_connections.discard(websocket)
+        await ws_broadcaster.disconnect(client)
 
 
 @app.post("/api/v1/auth/login", response_model=AuthResponse)
@@ -519,7 +457,7 @@ def list_devices():
             tags=device.get("tags", []),
             type=device.get("type"),
             location=device.get("location"),
-            last_seen=datetime.utcnow()  # Mock last_seen
+            last_seen=device.get("last_seen") or datetime.utcnow()
         )
         for i, device in enumerate(devices)
     ]
@@ -542,7 +480,7 @@ def get_device(device_id: str):
         tags=device.get("tags", []),
         type=device.get("type"),
         location=device.get("location"),
-        last_seen=datetime.utcnow()
+        last_seen=device.get("last_seen") or datetime.utcnow()
     )
 
 
@@ -580,7 +518,7 @@ def create_device(payload: DeviceCreate):
         tags=device.get("tags", []),
         type=device.get("type"),
         location=device.get("location"),
-        last_seen=datetime.utcnow()
+        last_seen=device.get("last_seen") or datetime.utcnow()
     )
 
 
@@ -620,14 +558,14 @@ def update_device(device_id: str, payload: DeviceUpdate):
         tags=device.get("tags", []),
         type=device.get("type"),
         location=device.get("location"),
-        last_seen=datetime.utcnow()
+        last_seen=device.get("last_seen") or datetime.utcnow()
     )
 
 
 @app.post("/api/v1/devices/{device_id}/commands")
 def send_device_command(device_id: str, cmd_green: Optional[bool] = None, cmd_red: Optional[bool] = None):
     """Send command to device and record in InfluxDB"""
-    if not mqtt_connected:
+    if not mqtt_consumers.is_connected():
         raise HTTPException(status_code=503, detail="MQTT not connected")
 
     # Prepare command payload
@@ -642,7 +580,7 @@ def send_device_command(device_id: str, cmd_green: Optional[bool] = None, cmd_re
 
     # Publish to MQTT
     try:
-        mqtt_client.publish(f"devices/{device_id}/commands", json.dumps(command_payload))
+        mqtt_consumers.publish(f"devices/{device_id}/commands", json.dumps(command_payload))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to send MQTT command: {str(e)}")
 
@@ -658,30 +596,42 @@ def send_device_command(device_id: str, cmd_green: Optional[bool] = None, cmd_re
     return {"status": "command_sent", "device_id": device_id, "commands": command_payload}
 
 
+def telemetry_from_request(t: Telemetry, now: Optional[datetime] = None):
+    """TelemetryData from a validated API payload"""
+    from .influxdb_data_service import TelemetryData
+    sensors = t.sensors or Sensors()
+    net = t.net or Net()
+    return TelemetryData(
+        device_id=t.device_id,
+        ts=t.ts or now or datetime.utcnow(),
+        temperature=sensors.temperature,
+        humidity=sensors.humidity,
+        distance=sensors.distance,
+        motion=sensors.motion,
+        servo_state=sensors.servo_state,
+        led_states=sensors.led_states,
+        tx_bytes=net.tx_bytes,
+        rx_bytes=net.rx_bytes,
+        connections=net.connections
+    )
+
+
 @app.post("/api/v1/telemetry", status_code=202)
 def ingest_telemetry(t: Telemetry):
     if not influx_data_service:
         raise HTTPException(status_code=503, detail="Database service unavailable")
 
-    # Create telemetry data
-    from .influxdb_data_service import TelemetryData
-    telemetry_data = TelemetryData(
-        device_id=t.device_id,
-        ts=t.ts or datetime.utcnow(),
-        temperature=t.sensors.temperature if t.sensors and t.sensors.temperature is not None else None,
-        humidity=t.sensors.humidity if t.sensors and t.sensors.humidity is not None else None,
-        distance=t.sensors.distance if t.sensors and t.sensors.distance is not None else None,
-        motion=t.sensors.motion if t.sensors and t.sensors.motion is not None else None,
-        servo_state=t.sensors.servo_state if t.sensors and t.sensors.servo_state is not None else None,
-        led_states=t.sensors.led_states if t.sensors and t.sensors.led_states is not None else None,
-        tx_bytes=t.net.tx_bytes if t.net and t.net.tx_bytes is not None else 0,
-        rx_bytes=t.net.rx_bytes if t.net and t.net.rx_bytes is not None else 0,
-        connections=t.net.connections if t.net and t.net.connections is not None else 0
-    )
+    telemetry_data = telemetry_from_request(t)
 
-    success = influx_data_service.save_telemetry(telemetry_data)
-    if not success:
-        raise HTTPException(status_code=500, detail="Failed to save telemetry")
+    try:
+        influx_data_service.enqueue_telemetry(telemetry_data)
+    except TelemetryRejected as e:
+        if e.reason == "invalid":
+            raise HTTPException(status_code=422, detail=str(e))
+        # Disconnected or backpressure: worth retrying later
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": "1"} if e.reason == "queue_full" else None)
+    stream = ingestor.observe(telemetry_data)
 
     # Try ML model prediction
     is_anomaly = False
@@ -689,50 +639,22 @@ def ingest_telemetry(t: Telemetry):
     model_status = getattr(anomaly_service, 'model_status', 'unavailable') if anomaly_service else 'unavailable'
 
     try:
-        payload = {
-            'temperature': telemetry_data.temperature,
-            'humidity': telemetry_data.humidity,
-            'distance': telemetry_data.distance,
-            'motion': telemetry_data.motion,
-            'servo_state': telemetry_data.servo_state,
-            'led_states': telemetry_data.led_states,
-            'tx_bytes': telemetry_data.tx_bytes,
-            'rx_bytes': telemetry_data.rx_bytes,
-            'connections': telemetry_data.connections,
-            'ts': telemetry_data.ts.isoformat(),
-        }
-
-        # Try ML model prediction
+        # Try ML model prediction (micro-batched with concurrent requests)
         if anomaly_service:
-            pred_is_anom, anom_score, status = anomaly_service.predict_anomaly(payload)
+            pred_is_anom, anom_score, status = anomaly_batcher.predict(ingestor.to_ml_payload(telemetry_data, stream))
             if status == 'trained':
                 model_used = True
-        else:
-            pred_is_anom, anom_score, status = False, 0.0, "unavailable"
             if pred_is_anom:
                 is_anomaly = True
-                from .influxdb_data_service import AlertData
-                alert_data = AlertData(
-                    alert_id=str(uuid.uuid4()),
-                    device_id=t.device_id,
-                    ts=telemetry_data.ts,
-                    severity="high",
-                    score=float(-anom_score) if isinstance(anom_score, (int, float)) else 0.0,
-                    reason=f"Anomalie détectée par modèle ML (score={anom_score:.4f})",
-                    acknowledged=False,
-                    metadata={"metric": "ml", "model": "isolation_forest"}
-                )
-                influx_data_service.save_alert(alert_data)
-                maybe_send_email_alert(alert_data)
+                ingestor.raise_ml_alert(telemetry_data, anom_score)
     except Exception:
         # On any model error, don't block ingestion
         pass
 
-    # Fallback to simple z-score detection on temperature when model not ready
-    if not model_used and telemetry_data.temperature is not None:
-        # For simplicity, we'll skip the z-score calculation for now
-        # This would require querying recent telemetry data
-        pass
+    # Fallback to z-score detection on the device's streaming statistics when model not ready
+    if not model_used and not is_anomaly:
+        if ingestor.check_zscore(telemetry_data, stream):
+            is_anomaly = True
 
     return JSONResponse(status_code=202, content={
         "received": True,
@@ -743,6 +665,87 @@ def ingest_telemetry(t: Telemetry):
     })
 
 
+@app.post("/api/v1/telemetry/batch", status_code=202)
+async def ingest_telemetry_batch(request: Request):
+    """
+    Bulk ingestion for gateways and backfills.
+
+    Body: JSON array of Telemetry objects or NDJSON (one per line), optionally
+    gzip-compressed (Content-Encoding: gzip). Valid items are written in one
+    batch and scored in one model call; each item gets its own result.
+    """
+    if not influx_data_service:
+        raise HTTPException(status_code=503, detail="Database service unavailable")
+
+    body = await request.body()
+    try:
+        total, valid, errors = parse_batch(Telemetry, body,
+                                           content_type=request.headers.get("content-type"),
+                                           content_encoding=request.headers.get("content-encoding"))
+    except BatchTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return await run_in_threadpool(process_telemetry_batch, total, valid, errors)
+
+
+def process_telemetry_batch(total: int, valid: dict, errors: dict) -> JSONResponse:
+    """Write, score and report a validated batch (runs in the threadpool)"""
+    now = datetime.utcnow()
+    indices = sorted(valid)
+    telemetry = [telemetry_from_request(valid[i], now) for i in indices]
+
+    accepted = influx_data_service.save_telemetry_many(telemetry)
+    latest: dict = {}
+    for item, ok in zip(telemetry, accepted):
+        if ok and (item.device_id not in latest or item.ts > latest[item.device_id]):
+            latest[item.device_id] = item.ts
+    for device_id, ts in latest.items():
+        influx_data_service.update_device_last_seen(device_id, ts)
+
+    # Streaming statistics in batch order, then one scoring call for the whole
+    # batch (grouped per resolved model)
+    written = [(i, item) for i, item, ok in zip(indices, telemetry, accepted) if ok]
+    streams = {i: ingestor.observe(item) for i, item in written}
+    scores = {}
+    model_status = getattr(anomaly_service, 'model_status', 'unavailable') if anomaly_service else 'unavailable'
+    if anomaly_service and written:
+        try:
+            predictions = model_registry.predict_batch([ingestor.to_ml_payload(item, streams[i]) for i, item in written])
+            scores = {i: prediction for (i, _), prediction in zip(written, predictions)}
+        except Exception as e:
+            # On any model error, don't block ingestion
+            print(f"Error scoring telemetry batch: {e}")
+
+    results = [{"index": i, "status": "invalid", "error": error} for i, error in errors.items()]
+    anomalies = 0
+    for i, item, ok in zip(indices, telemetry, accepted):
+        result = {"index": i, "device_id": item.device_id, "status": "accepted" if ok else "dropped"}
+        if ok:
+            is_anom, anom_score, status = scores.get(i, (False, 0.0, "unavailable"))
+            if is_anom:
+                ingestor.raise_ml_alert(item, anom_score)
+            elif status != "trained" and ingestor.check_zscore(item, streams[i]):
+                is_anom = True
+            result.update({"is_anomaly": is_anom, "model_used": status == "trained"})
+            if is_anom:
+                anomalies += 1
+        results.append(result)
+    results.sort(key=lambda r: r["index"])
+
+    accepted_count = sum(accepted)
+    return JSONResponse(status_code=202, content={
+        "received": total,
+        "accepted": accepted_count,
+        "invalid": len(errors),
+        "dropped": len(telemetry) - accepted_count,
+        "anomalies": anomalies,
+        "model_status": model_status,
+        "results": results,
+    })
+
+
 @app.post("/api/v1/predict")
 def predict(t: Telemetry):
     # Dummy prediction: random threshold logic can be replaced by real model
@@ -865,6 +868,9 @@ def get_ml_status():
     try:
         if anomaly_service:
             status = anomaly_service.get_status()
+            status["registry"] = model_registry.get_status()
+            if training_jobs.current_job_id:
+                status["training_job"] = training_jobs.get_job(training_jobs.current_job_id)
             return status
         else:
             return {"status": "error", "message": "ML service not available"}
@@ -873,23 +879,82 @@ def get_ml_status():
 
 
 @app.post("/api/v1/ml/train")
-def train_ml_model(n_samples: int = 1000):
+def train_ml_model(n_samples: int = 1000, source: str = "simulated", window: str = "7d",
+                   device_id: Optional[str] = None, device_type: Optional[str] = None,
+                   max_samples: int = 50000, contamination: float = 0.05, stream_features: bool = True):
     """
     Force l'entraînement du modèle ML (pour admin).
+    
+    source=simulated entraîne immédiatement sur des données simulées ;
+    source=influx lance en arrière-plan un entraînement sur l'historique réel
+    (fenêtre `window`, sous-échantillonné à `max_samples`) et renvoie le job ;
+    avec stream_features, le modèle utilise aussi les statistiques glissantes
+    par device (z-score, EWMA, taux de variation) rejouées sur l'historique.
+    Avec device_id ou device_type, le modèle entraîné est propre à ce device
+    ou à ce type de device ; sinon il remplace le modèle global.
     """
+    if not anomaly_service:
+        raise HTTPException(status_code=503, detail="ML service not available")
+
+    if source == "influx":
+        if not influx_data_service or not influx_data_service.is_connected():
+            raise HTTPException(status_code=503, detail="InfluxDB not connected")
+        if not FLUX_DURATION_RE.match(window):
+            raise HTTPException(status_code=400, detail="Invalid window, expected a Flux duration such as 7d or 12h")
+
+        device_ids = None
+        model_path = anomaly_service.model_path
+        if device_id:
+            device_ids = [device_id]
+            model_path = model_registry.model_path_for(model_registry.device_key(device_id))
+        elif device_type:
+            device_ids = [d["device_id"] for d in influx_data_service.list_devices() if d.get("type") == device_type]
+            if not device_ids:
+                raise HTTPException(status_code=404, detail="No device of this type")
+            model_path = model_registry.model_path_for(model_registry.type_key(device_type))
+
+        try:
+            job = training_jobs.submit({
+                "url": influx_data_service.url,
+                "token": influx_data_service.token,
+                "org": influx_data_service.org,
+                "bucket": influx_data_service.bucket,
+                "window": window,
+                "device_ids": device_ids,
+                "model_path": model_path,
+                "max_samples": max_samples,
+                "chunk_size": int(os.environ.get("ML_TRAINING_CHUNK_SIZE", "10000")),
+                "contamination": contamination,
+                "stream_features": stream_features,
+            })
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return JSONResponse(status_code=202, content={"status": "accepted", "job": job})
+
+    if source != "simulated":
+        raise HTTPException(status_code=400, detail="Invalid source. Use 'simulated' or 'influx'")
+
     try:
-        if not anomaly_service:
-            raise HTTPException(status_code=503, detail="ML service not available")
-        
-        success = anomaly_service.train_on_simulated_data(n_samples=n_samples)
+        success = anomaly_service.train_on_simulated_data(n_samples=n_samples, contamination=contamination)
         if success:
             return {"status": "success", "message": f"Model trained with {n_samples} samples"}
         else:
             raise HTTPException(status_code=500, detail="Training failed")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/v1/ml/train/{job_id}")
+def get_training_job(job_id: str):
+    """Statut d'un entraînement en arrière-plan."""
+    job = training_jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    return job
+
+
 # InfluxDB Endpoints
 @app.get("/api/v1/influx/measurements/{measurement}")
 def get_influx_measurements(measurement: str, limit: int = 20):
@@ -916,41 +981,6 @@ def get_influx_measurements(measurement: str, limit: int = 20):
         raise HTTPException(status_code=500, detail=f"Failed to query InfluxDB: {str(e)}")
 
 
-@app.get("/api/v1/influx/sensor-data")
-def get_sensor_data(device_id: Optional[str] = None, limit: int = 50):
-    """Get sensor data from InfluxDB"""
-    if not influx_service or not influx_service.is_connected():
-        raise HTTPException(status_code=503, detail="InfluxDB not connected")
-
-    try:
-        device_filter = f'|> filter(fn: (r) => r.device == "{device_id}")' if device_id else ""
-        flux_query = f'''
-        from(bucket: "bucket_iot")
-        |> range(start: -24h)
-        |> filter(fn: (r) => r._measurement == "measurement")
-        {device_filter}
-        |> limit(n: {limit})
-        |> sort(columns: ["_time"], desc: true)
-        '''
-
-        result = influx_service.query_data(flux_query)
-        if result:
-            data = []
-            for table in result:
-                for record in table.records:
-                    data.append({
-                        "time": record.get_time().isoformat(),
-                        "device": record.values.get("device"),
-                        "temperature": record.values.get("temperature"),
-                        "humidity": record.values.get("humidity"),
-                        "distance": record.values.get("distance")
-                    })
-            return {"data": data}
-        return {"data": []}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to query sensor data: {str(e)}")
-
-
 @app.get("/api/v1/influx/commands")
 def get_commands(device_id: Optional[str] = None, limit: int = 20):
     """Get command history from InfluxDB"""
@@ -958,17 +988,13 @@ def get_commands(device_id: Optional[str] = None, limit: int = 20):
         raise HTTPException(status_code=503, detail="InfluxDB not connected")
 
     try:
-        device_filter = f'|> filter(fn: (r) => r.device == "{device_id}")' if device_id else ""
-        flux_query = f'''
-        from(bucket: "bucket_iot")
-        |> range(start: -24h)
-        |> filter(fn: (r) => r._measurement == "commands")
-        {device_filter}
-        |> limit(n: {limit})
-        |> sort(columns: ["_time"], desc: true)
-        '''
+        query = FluxQuery(influx_service.bucket, "commands", start="24h") \
+            .tag("device", device_id) \
+            .fields("cmd_green", "cmd_red") \
+            .keep("device", "cmd_green", "cmd_red") \
+            .newest(limit)
 
-        result = influx_service.query_data(flux_query)
+        result = influx_service.query(query)
         if result:
             data = []
             for table in result:
@@ -992,42 +1018,36 @@ def get_influx_alerts(device_id: Optional[str] = None, limit: int = 20):
         raise HTTPException(status_code=503, detail="InfluxDB not connected")
 
     try:
-        device_filter = f'|> filter(fn: (r) => r.device == "{device_id}")' if device_id else ""
-        flux_query = f'''
-        from(bucket: "bucket_iot")
-        |> range(start: -24h)
-        |> filter(fn: (r) => r._measurement == "alerts")
-        {device_filter}
-        |> limit(n: {limit})
-        |> sort(columns: ["_time"], desc: true)
-        '''
-
-        result = influx_service.query_data(flux_query)
-        if result:
-            data = []
-            for table in result:
-                for record in table.records:
-                    data.append({
-                        "time": record.get_time().isoformat(),
-                        "device": record.values.get("device"),
-                        "temp": record.values.get("temp"),
-                        "temp_high": record.values.get("tempHigh"),
-                        "temp_low": record.values.get("tempLow"),
-                        "hum": record.values.get("hum"),
-                        "hum_high": record.values.get("humHigh"),
-                        "distance": record.values.get("distance"),
-                        "distance_alert": record.values.get("distanceAlert"),
-                        "message": record.values.get("message")
-                    })
-            return {"data": data}
-        return {"data": []}
+        alert_fields = ["temp", "tempHigh", "tempLow", "hum", "humHigh", "distance", "distanceAlert", "message"]
+        query = FluxQuery(influx_service.bucket, "alerts", start="24h") \
+            .tag("device", device_id) \
+            .fields(*alert_fields) \
+            .keep("device", *alert_fields) \
+            .newest(limit)
+
+        result = influx_service.query(query)
+        data = []
+        for record in assemble_records(result, time_key="time"):
+            data.append({
+                "time": record["time"].isoformat() if record.get("time") else None,
+                "device": record.get("device"),
+                "temp": record.get("temp"),
+                "temp_high": record.get("tempHigh"),
+                "temp_low": record.get("tempLow"),
+                "hum": record.get("hum"),
+                "hum_high": record.get("humHigh"),
+                "distance": record.get("distance"),
+                "distance_alert": record.get("distanceAlert"),
+                "message": record.get("message")
+            })
+        return {"data": data}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to query alerts: {str(e)}")
 
 
 @app.get("/api/v1/telemetry/recent")
 def recent_telemetry(limit: int = 20):
-    """Get recent telemetry from InfluxDB"""
+    """Get recent telemetry (hot buffer, InfluxDB for what it does not hold)"""
     if not influx_service or not influx_service.is_connected():
         raise HTTPException(status_code=503, detail="InfluxDB not connected")
 
@@ -1064,54 +1084,33 @@ def devices_activity_24h():
         raise HTTPException(status_code=503, detail="InfluxDB not connected")
 
     try:
-        # Get telemetry data from last 24h
-        flux_query = '''
-        from(bucket: "bucket_iot")
-        |> range(start: -24h)
-        |> filter(fn: (r) => r._measurement == "telemetry")
-        |> aggregateWindow(every: 1h, fn: count, createEmpty: false)
-        |> group(columns: ["device_id", "_start"])
-        |> sort(columns: ["_start"], desc: true)
-        '''
-
-        result = influx_service.query_data(flux_query)
+        # Active devices per hour, from the hourly rollup (raw points only for the unrolled tail)
+        now = datetime.utcnow()
+        activity = influx_service.rollups.aggregate(
+            [MARKER_FIELD], now - timedelta(hours=24), timedelta(hours=1), by_device=True)
         device_counts = {}
-        alert_counts = {}
-
-        # Process telemetry data
-        if result:
-            for table in result:
-                for record in table.records:
-                    start_time = record.get_start()
-                    device_id = record.values.get("device_id")
-                    count = record.get_value()
-
-                    hour_key = start_time.replace(minute=0, second=0, microsecond=0)
-                    if hour_key not in device_counts:
-                        device_counts[hour_key] = set()
-                    if device_id:
-                        device_counts[hour_key].add(device_id)
+        for (hour_key, device_id), values in activity.items():
+            if device_id and values.get(MARKER_FIELD, {}).get("count"):
+                device_counts.setdefault(hour_key, set()).add(device_id)
 
-        # Get alerts data from last 24h
+        # Get alerts data from last 24h (windows are labelled by their start)
         alert_query = '''
-        from(bucket: "bucket_iot")
+        from(bucket: params.bucket)
         |> range(start: -24h)
-        |> filter(fn: (r) => r._measurement == "alerts")
-        |> aggregateWindow(every: 1h, fn: count, createEmpty: false)
-        |> sort(columns: ["_start"], desc: true)
+        |> filter(fn: (r) => r._measurement == "alerts" and r._field == "score")
+        |> group()
+        |> aggregateWindow(every: 1h, fn: count, timeSrc: "_start", createEmpty: false)
         '''
 
-        alert_result = influx_service.query_data(alert_query)
+        alert_result = influx_service.query_data(alert_query, {"bucket": influx_service.bucket})
+        alert_counts = {}
         if alert_result:
             for table in alert_result:
                 for record in table.records:
-                    start_time = record.get_start()
-                    count = record.get_value()
-                    hour_key = start_time.replace(minute=0, second=0, microsecond=0)
-                    alert_counts[hour_key] = count
+                    hour_key = record.get_time().replace(minute=0, second=0, microsecond=0, tzinfo=None)
+                    alert_counts[hour_key] = record.get_value()
 
         # Build response for last 24h (6 points, every 4 hours)
-        now = datetime.utcnow()
         out = []
         for i in range(24, -1, -4):
             t = now - timedelta(hours=i)
@@ -1136,30 +1135,15 @@ def data_volume_7d():
         raise HTTPException(status_code=503, detail="InfluxDB not connected")
 
     try:
-        # Get data volume from last 7 days
-        flux_query = '''
-        from(bucket: "bucket_iot")
-        |> range(start: -7d)
-        |> filter(fn: (r) => r._measurement == "telemetry")
-        |> filter(fn: (r) => r._field == "tx_bytes" or r._field == "rx_bytes")
-        |> aggregateWindow(every: 1d, fn: sum, createEmpty: false)
-        |> group(columns: ["_start"])
-        |> sort(columns: ["_start"], desc: true)
-        '''
-
-        result = influx_service.query_data(flux_query)
+        # Daily tx+rx bytes over the last 7 days, summed from the hourly rollup
+        now = datetime.utcnow()
+        first_day = datetime(now.year, now.month, now.day) - timedelta(days=6)
+        volumes = influx_service.rollups.aggregate(["tx_bytes", "rx_bytes"], first_day, timedelta(days=1))
         daily_volumes = {}
-
-        if result:
-            for table in result:
-                for record in table.records:
-                    start_time = record.get_start()
-                    day_key = datetime(start_time.year, start_time.month, start_time.day)
-                    volume = record.get_value() or 0
-                    daily_volumes[day_key] = daily_volumes.get(day_key, 0) + volume
+        for (day_key, _), values in volumes.items():
+            daily_volumes[day_key] = sum(values[f]["sum"] for f in ("tx_bytes", "rx_bytes") if f in values)
 
         # Build response for last 7 days
-        now = datetime.utcnow()
         out = []
         for i in range(6, -1, -1):
             d = now - timedelta(days=i)
@@ -1176,63 +1160,42 @@ def data_volume_7d():
 
 # InfluxDB Sensor Data Endpoint
 @app.get("/api/v1/influx/sensor-data")
-def get_influx_sensor_data(device_id: Optional[str] = None, limit: int = 50):
-    """Get sensor data from InfluxDB for charting"""
+def get_influx_sensor_data(device_id: Optional[str] = None, limit: int = 50, resolution: str = "1m"):
+    """
+    Get sensor data from InfluxDB for charting: the mean of each `resolution`
+    window (e.g. 1m, 15m, 1h, 1d) over the newest `limit` windows
+    """
     if not influx_service or not influx_service.is_connected():
         raise HTTPException(status_code=503, detail="InfluxDB not connected")
-
     try:
-        # Get recent telemetry data and aggregate by time for charting
-        device_filter = f'|> filter(fn: (r) => r.device_id == "{device_id}")' if device_id else ""
-
-        flux_query = f'''
-        from(bucket: "{influx_service.bucket}")
-        |> range(start: -24h)
-        |> filter(fn: (r) => r._measurement == "telemetry")
-        {device_filter}
-        |> sort(columns: ["_time"], desc: true)
-        |> limit(n: {limit * 3})  // Get more records since we have multiple fields per timestamp
-        '''
+        every = parse_duration(resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        result = influx_service.query_data(flux_query)
-
-        # Aggregate data by timestamp
-        time_series = {}
-
-        if result:
-            for table in result:
-                for record in table.records:
-                    ts = record["_time"]
-                    time_key = ts.replace(second=0, microsecond=0)  # Round to minute
-
-                    if time_key not in time_series:
-                        time_series[time_key] = {
-                            "time": time_key,
-                            "temperature": None,
-                            "humidity": None,
-                            "distance": None
-                        }
-
-                    field = record["_field"]
-                    value = record["_value"]
-
-                    if field == "temperature":
-                        time_series[time_key]["temperature"] = value
-                    elif field == "humidity":
-                        time_series[time_key]["humidity"] = value
-                    elif field == "distance":
-                        time_series[time_key]["distance"] = value
-
-        # Convert to list and sort by time
-        chart_data = list(time_series.values())
+    try:
+        # Served from the hot buffer when it covers the range, else from the
+        # coarsest rollup matching the resolution
+        fields = ("temperature", "humidity", "distance")
+        start = datetime.utcnow() - every * limit
+        series = influx_service.hot_buffer.aggregate(fields, start, every, device_id=device_id)
+        if series is None:
+            series = influx_service.rollups.aggregate(fields, start, every, device_id=device_id)
+
+        chart_data = []
+        for (time_key, _), values in series.items():
+            item = {"time": time_key}
+            for field in fields:
+                item[field] = values[field]["mean"] if field in values else None
+            chart_data.append(item)
         chart_data.sort(key=lambda x: x["time"], reverse=True)
 
         # Limit the results
         chart_data = chart_data[:limit]
 
         # Format time for frontend
+        time_format = "%H:%M" if every < timedelta(days=1) else "%d/%m"
         for item in chart_data:
-            item["time"] = item["time"].strftime("%H:%M")
+            item["time"] = item["time"].strftime(time_format)
 
         return chart_data
 
@@ -1290,27 +1253,13 @@ def get_suricata_stats():
         raise HTTPException(status_code=503, detail="InfluxDB not connected")
 
     try:
-        # Get logs from last 24h
-        flux_query = '''
-        from(bucket: "bucket_iot")
-        |> range(start: -24h)
-        |> filter(fn: (r) => r._measurement == "suricata_alerts")
-        |> sort(columns: ["_time"], desc: true)
-        '''
+        # Get logs from last 24h (only the columns the stats need)
+        query = FluxQuery(influx_service.bucket, "suricata_alerts", start="24h") \
+            .fields("signature", "severity")
 
-        result = influx_service.query_data(flux_query)
-        logs_24h = []
-        total_logs = 0
-
-        if result:
-            for table in result:
-                for record in table.records:
-                    log_data = {
-                        "signature": record["_value"] if record["_field"] == "signature" else None,
-                        "severity": record["_value"] if record["_field"] == "severity" else None,
-                    }
-                    logs_24h.append(log_data)
-                    total_logs += 1
+        result = influx_service.query(query)
+        logs_24h = assemble_records(result, time_key="event_ts")
+        total_logs = len(logs_24h)
 
         # Derive categories from signatures (simplified logic)
         def categorize_signature(signature):
@@ -1336,10 +1285,10 @@ def get_suricata_stats():
         severities = {}
 
         for log in logs_24h:
-            cat = categorize_signature(log["signature"])
+            cat = categorize_signature(log.get("signature"))
             categories[cat] = categories.get(cat, 0) + 1
 
-            sev = log["severity"] or '3'
+            sev = log.get("severity") or '3'
             severities[sev] = severities.get(sev, 0) + 1
 
         return {
@@ -1359,376 +1308,136 @@ def get_suricata_alerts():
         raise HTTPException(status_code=503, detail="InfluxDB not connected")
 
     try:
-        # Get high-priority logs (severity '1' and '2')
-        flux_query = '''
-        from(bucket: "bucket_iot")
-        |> range(start: -7d)
-        |> filter(fn: (r) => r._measurement == "suricata_alerts")
-        |> filter(fn: (r) => r._field == "severity" and (r._value == "1" or r._value == "2"))
-        |> sort(columns: ["_time"], desc: true)
-        |> limit(n: 50)
-        '''
-
-        result = influx_service.query_data(flux_query)
-        alerts = []
+        # Get high-priority logs (severity '1' and '2'), pivoted server-side
+        query = FluxQuery(influx_service.bucket, "suricata_alerts", start="7d") \
+            .where_in("severity", ["1", "2"]) \
+            .newest(50)
 
-        if result:
-            for table in result:
-                for record in table.records:
-                    alert = {
-                        "event_ts": record["_time"],
-                        "severity": record["_value"] if record["_field"] == "severity" else None,
-                    }
-                    # Get other fields for this record
-                    for field_record in table.records:
-                        if field_record["_time"] == record["_time"]:
-                            field = field_record["_field"]
-                            value = field_record["_value"]
-                            if field != "severity":
-                                alert[field] = value
-                    alerts.append(alert)
-
-        return alerts
+        result = influx_service.query(query)
+        return assemble_records(result, time_key="event_ts")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get Suricata alerts: {str(e)}")
 
 
-@app.get("/api/v1/suricata/logs/export")
-async def export_suricata_logs(format: str = "excel"):
-    """Export Suricata logs to Excel or PDF"""
-    if not influx_service or not influx_service.is_connected():
-        raise HTTPException(status_code=503, detail="InfluxDB not connected")
-
+async def streaming_export(kind: str, format: str, start: Optional[str], stop: Optional[str]):
+    """
+    Stream an export as CSV, NDJSON or XLSX ('excel'), without row cap.
+    start/stop: duration ("30d") or ISO datetime; default window depends on the export.
+    """
+    fmt = "xlsx" if format.lower() == "excel" else format.lower()
     try:
-        # Get all recent Suricata logs
-        logs = influx_service.get_recent_suricata_logs(limit=1000)
-        
-        if format.lower() == "excel":
-            # Create Excel file
-            import io
-            from openpyxl import Workbook
-            from openpyxl.styles import Font, PatternFill, Alignment
-            
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Suricata Alerts"
-            
-            # Headers
-            headers = ["Timestamp", "Signature", "Severity", "Source IP", "Source Port", 
-                      "Destination IP", "Destination Port", "Protocol", "Action", "Category"]
-            ws.append(headers)
-            
-            # Style headers
-            for cell in ws[1]:
-                cell.font = Font(bold=True, color="FFFFFF")
-                cell.fill = PatternFill(start_color="D32F2F", end_color="D32F2F", fill_type="solid")
-                cell.alignment = Alignment(horizontal="center")
-            
-            # Add data
-            for log in logs:
-                severity = log.get('severity', '')
-                severity_label = 'CRITIQUE' if severity == 1 else 'ÉLEVÉ' if severity == 2 else 'MOYEN' if severity == 3 else 'FAIBLE'
-                
-                ws.append([
-                    str(log.get('event_ts', '')),
-                    log.get('signature', ''),
-                    severity_label,
-                    log.get('src_ip', ''),
-                    log.get('src_port', ''),
-                    log.get('dest_ip', ''),
-                    log.get('dest_port', ''),
-                    log.get('proto', ''),
-                    log.get('action', ''),
-                    log.get('category', '')
-                ])
-            
-            # Auto-adjust column widths
-            for column in ws.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(cell.value)
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                ws.column_dimensions[column_letter].width = adjusted_width
-            
-            # Save to bytes
-            output = io.BytesIO()
-            wb.save(output)
-            output.seek(0)
-            
-            return Response(
-                content=output.getvalue(),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": f"attachment; filename=suricata_alerts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"}
-            )
-            
-        elif format.lower() == "pdf":
-            # Create PDF file
-            from reportlab.lib import colors
-            from reportlab.lib.pagesizes import letter, landscape
-            from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-            from reportlab.lib.styles import getSampleStyleSheet
-            import io
-            
-            buffer = io.BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=landscape(letter))
-            elements = []
-            
-            # Title
-            styles = getSampleStyleSheet()
-            title = Paragraph("<b>Rapport d'Alertes Suricata IDS</b>", styles['Title'])
-            elements.append(title)
-            elements.append(Spacer(1, 12))
-            
-            # Subtitle
-            subtitle = Paragraph(f"Généré le {datetime.now().strftime('%d/%m/%Y à %H:%M:%S')}", styles['Normal'])
-            elements.append(subtitle)
-            elements.append(Spacer(1, 20))
-            
-            # Table data
-            data = [["Timestamp", "Signature", "Sév.", "IP Source", "IP Dest", "Action"]]
-            
-            for log in logs[:100]:  # Limit to 100 for PDF
-                severity = log.get('severity', '')
-                severity_label = 'CRIT' if severity == 1 else 'ÉLEV' if severity == 2 else 'MOY' if severity == 3 else 'FAIB'
-                
-                data.append([
-                    str(log.get('event_ts', ''))[:19],
-                    str(log.get('signature', ''))[:40],
-                    severity_label,
-                    log.get('src_ip', ''),
-                    log.get('dest_ip', ''),
-                    log.get('action', '')
-                ])
-            
-            # Create table
-            table = Table(data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#D32F2F')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            
-            elements.append(table)
-            doc.build(elements)
-            
-            buffer.seek(0)
-            return Response(
-                content=buffer.getvalue(),
-                media_type="application/pdf",
-                headers={"Content-Disposition": f"attachment; filename=suricata_alerts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"}
-            )
-        
-        else:
-            raise HTTPException(status_code=400, detail="Format not supported. Use 'excel' or 'pdf'")
-            
+        # The first rows are fetched here, off the event loop, so query errors return a 500
+        chunks, media_type, filename = await run_in_threadpool(stream_export, influx_service, kind, fmt, start, stop)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to export Suricata logs: {str(e)}")
-
-
-# Export endpoints
-@app.get("/api/v1/telemetry/export")
-async def export_telemetry(format: str = "excel"):
-    """Export telemetry data from InfluxDB"""
-    if not influx_service or not influx_service.is_connected():
-        raise HTTPException(status_code=503, detail="InfluxDB not connected")
-
-    try:
-        # Get all telemetry data
-        telemetry_data = influx_service.get_recent_telemetry(limit=10000)  # Large limit for export
+        raise HTTPException(status_code=500, detail=f"Failed to export {kind}: {str(e)}")
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
-        data = []
-        for item in telemetry_data:
-            data.append({
-                "device_id": item.get("device_id"),
-                "ts": item.get("ts").isoformat() if item.get("ts") else None,
-                "temperature": item.get("temperature"),
-                "humidity": item.get("humidity"),
-                "distance": item.get("distance"),
-                "tx_bytes": item.get("tx_bytes"),
-                "rx_bytes": item.get("rx_bytes"),
-                "connections": item.get("connections")
-            })
 
-        if format == "excel":
-            df = pd.DataFrame(data)
-            buffer = io.BytesIO()
-            df.to_excel(buffer, index=False, engine='openpyxl')
-            buffer.seek(0)
-            return FileResponse(buffer, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', filename='telemetry.xlsx')
-        elif format == "pdf":
-            buffer = io.BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=letter)
-            elements = []
-            table_data = [["Device ID", "Timestamp", "Temp", "Humidity", "Distance", "TX", "RX", "Connections"]]
-            for d in data:
-                table_data.append([d["device_id"], str(d["ts"]), d["temperature"], d["humidity"], d["distance"], d["tx_bytes"], d["rx_bytes"], d["connections"]])
-            table = Table(table_data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 14),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            elements.append(table)
-            doc.build(elements)
-            buffer.seek(0)
-            return FileResponse(buffer, media_type='application/pdf', filename='telemetry.pdf')
-        else:
-            raise HTTPException(status_code=400, detail="Invalid format. Use 'excel' or 'pdf'")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to export telemetry: {str(e)}")
+def is_streaming_format(format: str) -> bool:
+    return format.lower() == "excel" or format.lower() in STREAMING_FORMATS
 
 
-@app.get("/api/v1/alerts/export")
-async def export_alerts(format: str = "excel"):
-    """Export alerts data from InfluxDB"""
+async def rendered_report(kind: str, format: str, start: Optional[str], stop: Optional[str]):
+    """Render a report in the report pool and return it once ready (the event loop is not blocked)"""
+    if report_jobs is None:
+        raise HTTPException(status_code=503, detail="Report rendering unavailable")
+    try:
+        job = report_jobs.submit(kind, format, start, stop)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    future = report_jobs.get_future(job["job_id"])
+    if future is not None:
+        try:
+            await asyncio.wrap_future(future)
+        except Exception:
+            pass
+    return report_file_response(job["job_id"])
+
+
+def report_file_response(job_id: str):
+    job = report_jobs.get_job(job_id) if report_jobs else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Failed to render report: {job['error']}")
+    report_file = report_jobs.get_file(job_id)
+    if not report_file:
+        raise HTTPException(status_code=409, detail=f"Report not ready (status: {job['status']})")
+    path, media_type, filename = report_file
+    return FileResponse(path, media_type=media_type, filename=filename)
+
+
+async def export_response(kind: str, format: str, start: Optional[str], stop: Optional[str]):
     if not influx_service or not influx_service.is_connected():
         raise HTTPException(status_code=503, detail="InfluxDB not connected")
+    if is_streaming_format(format):
+        return await streaming_export(kind, format, start, stop)
+    if format.lower() == "pdf":
+        return await rendered_report(kind, "pdf", start, stop)
+    raise HTTPException(status_code=400, detail="Format not supported. Use 'excel', 'csv', 'ndjson' or 'pdf'")
 
-    try:
-        # Get all alerts data
-        alerts_data = influx_service.get_recent_alerts(limit=10000)  # Large limit for export
 
-        data = []
-        for item in alerts_data:
-            data.append({
-                "alert_id": item.get("alert_id"),
-                "device_id": item.get("device_id"),
-                "ts": item.get("ts").isoformat() if item.get("ts") else None,
-                "severity": item.get("severity"),
-                "score": item.get("score"),
-                "reason": item.get("reason"),
-                "acknowledged": item.get("acknowledged"),
-            })
+@app.get("/api/v1/suricata/logs/export")
+async def export_suricata_logs(format: str = "excel", start: Optional[str] = None, stop: Optional[str] = None):
+    """Export Suricata logs to Excel, CSV, NDJSON (streamed) or PDF"""
+    return await export_response("suricata_alerts", format, start, stop)
 
-        if format == "excel":
-            df = pd.DataFrame(data)
-            buffer = io.BytesIO()
-            df.to_excel(buffer, index=False, engine='openpyxl')
-            buffer.seek(0)
-            return FileResponse(buffer, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', filename='alerts.xlsx')
-        elif format == "pdf":
-            buffer = io.BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=letter)
-            elements = []
-            table_data = [["Alert ID", "Device ID", "Timestamp", "Severity", "Score", "Reason", "Acknowledged"]]
-            for d in data:
-                table_data.append([d["alert_id"], d["device_id"], str(d["ts"]), d["severity"], d["score"], d["reason"], d["acknowledged"]])
-            table = Table(table_data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 14),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            elements.append(table)
-            doc.build(elements)
-            buffer.seek(0)
-            return FileResponse(buffer, media_type='application/pdf', filename='alerts.pdf')
-        else:
-            raise HTTPException(status_code=400, detail="Invalid format. Use 'excel' or 'pdf'")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to export alerts: {str(e)}")
 
+# Export endpoints
+@app.get("/api/v1/telemetry/export")
+async def export_telemetry(format: str = "excel", start: Optional[str] = None, stop: Optional[str] = None):
+    """Export telemetry data from InfluxDB (Excel/CSV/NDJSON are streamed, PDF is rendered)"""
+    return await export_response("telemetry", format, start, stop)
 
-@app.get("/api/v1/logs/export")
-async def export_logs(format: str = "excel"):
-    """Export Suricata logs from InfluxDB"""
-    if not influx_service or not influx_service.is_connected():
-        raise HTTPException(status_code=503, detail="InfluxDB not connected")
 
-    try:
-        # Get all Suricata logs
-        logs_data = influx_service.get_recent_suricata_logs(limit=10000)  # Large limit for export
+@app.get("/api/v1/alerts/export")
+async def export_alerts(format: str = "excel", start: Optional[str] = None, stop: Optional[str] = None):
+    """Export alerts data from InfluxDB (Excel/CSV/NDJSON are streamed, PDF is rendered)"""
+    return await export_response("alerts", format, start, stop)
 
-        data = []
-        for item in logs_data:
-            data.append({
-                "event_ts": item.get("event_ts").isoformat() if item.get("event_ts") else None,
-                "event_type": item.get("event_type"),
-                "src_ip": item.get("src_ip"),
-                "src_port": item.get("src_port"),
-                "dest_ip": item.get("dest_ip"),
-                "dest_port": item.get("dest_port"),
-                "proto": item.get("proto"),
-                "signature": item.get("signature"),
-                "signature_id": item.get("signature_id"),
-                "severity": item.get("severity"),
-            })
 
-        if format == "excel":
-            df = pd.DataFrame(data)
-            buffer = io.BytesIO()
-            df.to_excel(buffer, index=False, engine='openpyxl')
-            buffer.seek(0)
-            return FileResponse(buffer, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', filename='logs.xlsx')
-        elif format == "pdf":
-            buffer = io.BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=letter)
-            elements = []
-            table_data = [["Event TS", "Event Type", "Src IP", "Src Port", "Dest IP", "Dest Port", "Proto", "Signature", "Sig ID", "Severity"]]
-            for d in data:
-                table_data.append([str(d["event_ts"]), d["event_type"], d["src_ip"], d["src_port"], d["dest_ip"], d["dest_port"], d["proto"], d["signature"], d["signature_id"], d["severity"]])
-            table = Table(table_data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 14),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            elements.append(table)
-            doc.build(elements)
-            buffer.seek(0)
-            return FileResponse(buffer, media_type='application/pdf', filename='logs.pdf')
-        else:
-            raise HTTPException(status_code=400, detail="Invalid format. Use 'excel' or 'pdf'")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to export logs: {str(e)}")
+@app.get("/api/v1/logs/export")
+async def export_logs(format: str = "excel", start: Optional[str] = None, stop: Optional[str] = None):
+    """Export Suricata logs from InfluxDB (Excel/CSV/NDJSON are streamed, PDF is rendered)"""
+    return await export_response("logs", format, start, stop)
 
 
-def maybe_send_email_alert(alert):
+# Report jobs (rendered in the report process pool)
+@app.post("/api/v1/reports", status_code=202)
+def submit_report(kind: str, format: str = "pdf", start: Optional[str] = None, stop: Optional[str] = None):
+    """
+    Submit a report rendering job.
+    kind: telemetry, alerts, logs or suricata_alerts ; format: pdf or xlsx
+    """
+    if report_jobs is None:
+        raise HTTPException(status_code=503, detail="Report rendering unavailable")
     try:
-        host = os.environ.get("SMTP_HOST")
-        to_addr = os.environ.get("ALERT_EMAIL_TO")
-        if not host or not to_addr:
-            return
-        port = int(os.environ.get("SMTP_PORT", "25"))
-        user = os.environ.get("SMTP_USER")
-        pwd = os.environ.get("SMTP_PASS")
-        sender = os.environ.get("SMTP_FROM", user or "alerts@siac.local")
-        subj = f"[SIAC-IoT] Alerte {alert.get('severity', 'unknown').upper()} - {alert.get('device_id', 'unknown')}"
-        body = f"Device: {alert.get('device_id', 'unknown')}\nTime: {alert.get('ts', 'unknown')}\nReason: {alert.get('reason', 'unknown')}\nScore: {alert.get('score', 0)}"
-        msg = MIMEText(body)
-        msg['Subject'] = subj
-        msg['From'] = sender
-        msg['To'] = to_addr
-        with smtplib.SMTP(host, port, timeout=5) as s:
-            if user and pwd:
-                s.starttls()
-                s.login(user, pwd)
-            s.sendmail(sender, [to_addr], msg.as_string())
-    except Exception:
-        # Best-effort only; ignore failures
-        pass
+        return report_jobs.submit(kind, format.lower(), start, stop)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+
+@app.get("/api/v1/reports/{job_id}")
+def get_report(job_id: str):
+    """Status of a report job"""
+    job = report_jobs.get_job(job_id) if report_jobs else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return job
+
+
+@app.get("/api/v1/reports/{job_id}/download")
+def download_report(job_id: str):
+    """Download a finished report"""
+    return report_file_response(job_id)
@@ -5,9 +5,14 @@ from sklearn.ensemble import IsolationForest
 import numpy as np
 import pickle
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime
-from typing import Dict, Any, Optional, Tuple
-from .feature_engineering import TelemetryFeatureEngineer, generate_normal_training_data
+from typing import Dict, Any, List, Optional, Tuple
+from .feature_engineering import TelemetryFeatureEngineer, generate_normal_training_data, input_columns, SUPPORTED_N_FEATURES
+from .forest_artifact import ForestArtifact, ARTIFACT_SUFFIX, read_header, verify_parity
 
 
 class AnomalyDetectionService:
@@ -15,41 +20,130 @@ class AnomalyDetectionService:
     Service de détection d'anomalies utilisant IsolationForest.
     """
     
+    # Échantillons utilisés pour vérifier la forêt compilée contre scikit-learn
+    PARITY_CHECK_SAMPLES = 1000
+    
     def __init__(self, model_path: str = "model_isolation_forest.pkl"):
         self.model_path = model_path
+        # Artefact mappable en mémoire (format principal) ; le pickle n'est lu
+        # que pour migrer les anciens modèles
+        self.artifact_path = artifact_path_for(model_path)
         self.model: Optional[IsolationForest] = None
+        self.forest: Optional[ForestArtifact] = None
         self.model_status = "pending"  # pending, training, trained, error
         self.trained_at: Optional[datetime] = None
+        self.training_source: Optional[str] = None
+        self.n_training_samples: Optional[int] = None
+        self.model_version = 0
+        # Cause du dernier échec d'entraînement (entraînement, parité ou sauvegarde)
+        self.last_error: Optional[str] = None
         self.feature_engineer = TelemetryFeatureEngineer()
         
-        # Charger le modèle s'il existe
-        if os.path.exists(model_path):
+        # Charger le modèle s'il existe (un ancien pickle n'est converti que par
+        # convert_legacy_model, appelé au démarrage des processus)
+        if os.path.exists(self.artifact_path):
             self._load_model()
     
     def _load_model(self) -> bool:
-        """Charge le modèle depuis le disque."""
+        """Charge l'artefact du modèle depuis le disque (mmap)."""
         try:
-            with open(self.model_path, 'rb') as f:
-                data = pickle.load(f)
-                self.model = data['model']
-                self.trained_at = data.get('trained_at')
-                self.model_status = "trained"
+            forest = ForestArtifact.load(self.artifact_path, mmap=True)
+            if forest.n_features not in SUPPORTED_N_FEATURES:
+                raise ValueError(f"Modèle à {forest.n_features} features non supporté")
+            self.forest = forest
+            self._apply_metadata(self.forest.metadata)
+            self.model_status = "trained"
             return True
         except Exception as e:
             self.model_status = "error"
             return False
     
-    def _save_model(self):
-        """Sauvegarde le modèle sur le disque."""
+    def convert_legacy_model(self) -> bool:
+        """
+        Convertit un ancien modèle pickle en artefact s'il n'y a pas encore d'artefact.
+        
+        Étape explicite du démarrage : désérialiser le pickle, compiler la forêt et
+        vérifier sa parité est trop coûteux pour l'import du module.
+        
+        Returns:
+            True si un modèle a été converti et chargé
+        """
+        if self.forest is not None or os.path.exists(self.artifact_path) or not os.path.exists(self.model_path):
+            return False
         try:
-            with open(self.model_path, 'wb') as f:
-                pickle.dump({
-                    'model': self.model,
-                    'trained_at': self.trained_at
-                }, f)
-        except Exception:
+            self._load_legacy_pickle()
+        except Exception as e:
+            print(f"Échec de la conversion du modèle {self.model_path}: {e}")
+            self.model_status = "error"
+            return False
+        self.model_status = "trained"
+        return True
+    
+    def _load_legacy_pickle(self):
+        """Charge un ancien modèle pickle puis le convertit en artefact."""
+        with open(self.model_path, 'rb') as f:
+            data = pickle.load(f)
+        model = data['model']
+        self._apply_metadata({
+            'trained_at': data.get('trained_at'),
+            'source': data.get('source'),
+            'n_samples': data.get('n_samples'),
+            'version': data.get('version', 1),
+        })
+        forest = ForestArtifact.from_model(model, self._metadata())
+        verify_parity(model, forest, generate_normal_training_data(self.PARITY_CHECK_SAMPLES))
+        self.model = model
+        self.forest = forest
+        try:
+            self.forest.save(self.artifact_path)
+        except OSError:
+            # Répertoire en lecture seule : on garde la forêt compilée en mémoire
             pass
     
+    def _apply_metadata(self, metadata: Dict[str, Any]):
+        trained_at = metadata.get('trained_at')
+        if isinstance(trained_at, str):
+            trained_at = datetime.fromisoformat(trained_at)
+        self.trained_at = trained_at
+        self.training_source = metadata.get('source')
+        self.n_training_samples = metadata.get('n_samples')
+        self.model_version = metadata.get('version', 1)
+    
+    def _save_model(self, forest: ForestArtifact) -> bool:
+        """Sauvegarde une forêt sur le disque (artefact versionné, écriture atomique)."""
+        try:
+            forest.save(self.artifact_path)
+            return True
+        except Exception as e:
+            self.last_error = f"Échec de la sauvegarde du modèle {self.artifact_path}: {e}"
+            return False
+    
+    def _metadata(self) -> Dict[str, Any]:
+        return {
+            "version": self.model_version,
+            "trained_at": self.trained_at.isoformat() if self.trained_at else None,
+            "source": self.training_source,
+            "n_samples": self.n_training_samples,
+        }
+    
+    @staticmethod
+    def read_metadata(model_path: str) -> Optional[Dict[str, Any]]:
+        """Lit les métadonnées d'un modèle sauvegardé sans charger ses tableaux."""
+        try:
+            header, _ = read_header(artifact_path_for(model_path))
+            return header.get("metadata")
+        except (OSError, ValueError):
+            return None
+    
+    def memory_bytes(self) -> int:
+        """Empreinte mémoire du modèle (tableaux de la forêt compilée)."""
+        if self.forest is None:
+            return 0
+        return self.forest.nbytes
+    
+    def is_ready(self) -> bool:
+        return self.forest is not None and self.model_status == "trained"
+    
     def train_on_simulated_data(self, n_samples: int = 1000, contamination: float = 0.05):
         """
         Entraîne le modèle sur des données normales simulées.
@@ -63,27 +157,76 @@ class AnomalyDetectionService:
             
             # Générer des données normales
             X_train = generate_normal_training_data(n_samples)
-            
+        except Exception as e:
+            self.model_status = "error"
+            return False
+        
+        return self.fit(X_train, contamination=contamination, source="simulated")
+    
+    def fit(self, X_train: np.ndarray, contamination: float = 0.05, source: str = "simulated") -> bool:
+        """
+        Entraîne IsolationForest sur une matrice de features et sauvegarde le modèle.
+        
+        Args:
+            X_train: Matrice (n_samples, 7) de features, ou (n_samples, N_STREAM_FEATURES)
+                avec les features temporelles glissantes
+            contamination: Proportion d'anomalies attendue (pour calibrage)
+            source: Origine des données ('simulated', 'influxdb', ...)
+        """
+        self.model_status = "training"
+        self.last_error = None
+        try:
             # Entraîner IsolationForest
-            self.model = IsolationForest(
+            model = IsolationForest(
                 contamination=contamination,
                 random_state=42,
                 n_estimators=100,
                 max_samples='auto',
                 n_jobs=-1
             )
-            self.model.fit(X_train)
-            
-            self.trained_at = datetime.utcnow()
-            self.model_status = "trained"
-            
-            # Sauvegarder le modèle
-            self._save_model()
-            
-            return True
+            model.fit(X_train)
         except Exception as e:
-            self.model_status = "error"
+            return self._fit_failed(f"Échec de l'entraînement IsolationForest: {e}")
+        try:
+            # Le score en production passe par la forêt compilée : vérifier qu'elle
+            # reproduit scikit-learn avant de la publier
+            forest = ForestArtifact.from_model(model)
+            verify_parity(model, forest, X_train[:self.PARITY_CHECK_SAMPLES])
+        except Exception as e:
+            return self._fit_failed(f"Échec de la vérification de la forêt compilée: {e}")
+        
+        trained_at = datetime.utcnow()
+        forest.metadata = {
+            "version": self.model_version + 1,
+            "trained_at": trained_at.isoformat(),
+            "source": source,
+            "n_samples": int(len(X_train)),
+        }
+        # Publier seulement un modèle persisté : sinon le prochain rechargement
+        # (ou le processus API, pour un entraînement hors processus) ne le verrait pas
+        if not self._save_model(forest):
+            return self._fit_failed(self.last_error)
+        
+        self.model = model
+        self.forest = forest
+        self._apply_metadata(forest.metadata)
+        self.model_status = "trained"
+        
+        return True
+    
+    def _fit_failed(self, error: str) -> bool:
+        """Enregistre la cause d'un échec d'entraînement ; le modèle en service (s'il y en a un) reste en place."""
+        print(error)
+        self.last_error = error
+        self.model_status = "trained" if self.forest is not None else "error"
+        return False
+    
+    def reload(self) -> bool:
+        """Recharge le modèle depuis le disque (après un entraînement hors processus)."""
+        if not os.path.exists(self.artifact_path):
             return False
+        self.model = None
+        return self._load_model()
     
     def predict_anomaly(self, telemetry_dict: Dict[str, Any]) -> Tuple[bool, float, str]:
         """
@@ -98,24 +241,41 @@ class AnomalyDetectionService:
             - anomaly_score: Score d'anomalie (plus négatif = plus anormal)
             - status: 'trained' ou 'pending'
         """
-        if self.model is None or self.model_status != "trained":
-            return False, 0.0, "pending"
+        return self.predict_batch([telemetry_dict])[0]
+    
+    def predict_batch(self, telemetry_dicts: List[Dict[str, Any]]) -> List[Tuple[bool, float, str]]:
+        """
+        Prédit les anomalies pour un lot de télémétries en un seul passage du modèle.
         
-        try:
-            # Extraire les features
-            X = self.feature_engineer.extract_features_from_dict(telemetry_dict)
-            
-            # Prédire (-1 = anomalie, 1 = normal)
-            prediction = self.model.predict(X)[0]
+        `score_samples` n'est calculé qu'une fois par lot ; le score de décision et
+        l'étiquette en sont dérivés via l'offset appris (équivalent à
+        `decision_function` + `predict`, sans parcourir deux fois les arbres).
+        
+        Args:
+            telemetry_dicts: Liste de dicts (mêmes clés que predict_anomaly)
             
-            # Score d'anomalie (plus négatif = plus anormal)
-            anomaly_score = self.model.decision_function(X)[0]
+        Returns:
+            Liste de tuples (is_anomaly, anomaly_score, status), dans l'ordre d'entrée
+        """
+        if not telemetry_dicts:
+            return []
+        if not self.is_ready():
+            return [(False, 0.0, "pending")] * len(telemetry_dicts)
+        
+        try:
+            now = datetime.utcnow()
+            # Colonnes du modèle chargé (avec ou sans features temporelles)
+            n_features = self.forest.n_features
+            columns = {name: [d.get(name) for d in telemetry_dicts] for name in input_columns(n_features)}
+            columns['ts'] = [d.get('ts') or now for d in telemetry_dicts]
+            X = self.feature_engineer.extract_features_columnar(columns, n_features=n_features)
             
-            is_anomaly = (prediction == -1)
+            # decision_function = score_samples - offset ; anomalie si < 0
+            scores = self.forest.decision_function(X)
             
-            return is_anomaly, float(anomaly_score), "trained"
+            return [(bool(score < 0), float(score), "trained") for score in scores]
         except Exception as e:
-            return False, 0.0, "error"
+            return [(False, 0.0, "error")] * len(telemetry_dicts)
     
     def predict_from_records(self, telemetry_records: list) -> np.ndarray:
         """
@@ -127,12 +287,12 @@ class AnomalyDetectionService:
         Returns:
             Array numpy de prédictions (-1 = anomalie, 1 = normal)
         """
-        if self.model is None or not telemetry_records:
+        if self.forest is None or not telemetry_records:
             return np.array([])
         
         try:
-            X = self.feature_engineer.extract_features(telemetry_records)
-            return self.model.predict(X)
+            X = self.feature_engineer.extract_features(telemetry_records, n_features=self.forest.n_features)
+            return np.where(self.forest.decision_function(X) < 0, -1, 1)
         except Exception:
             return np.array([])
     
@@ -146,8 +306,14 @@ class AnomalyDetectionService:
         return {
             "status": self.model_status,
             "trained_at": self.trained_at.isoformat() if self.trained_at else None,
-            "model_loaded": self.model is not None,
-            "model_path": self.model_path
+            "model_loaded": self.forest is not None,
+            "model_path": self.model_path,
+            "artifact_path": self.artifact_path,
+            "training_source": self.training_source,
+            "n_training_samples": self.n_training_samples,
+            "model_version": self.model_version,
+            "last_error": self.last_error,
+            "n_features": self.forest.n_features if self.forest is not None else None
         }
     
     def generate_recommendations(self, alert: Dict[str, Any], telemetry_history: list = None) -> Dict[str, Any]:
@@ -161,7 +327,7 @@ class AnomalyDetectionService:
         Returns:
             Dict avec recommendations, priority, root_cause_analysis
         """
-        if self.model is None or self.model_status != "trained":
+        if not self.is_ready():
             return {
                 "status": "ml_not_ready",
                 "recommendations": ["Modèle ML non entraîné - recommandations génériques disponibles"],
@@ -400,5 +566,93 @@ class AnomalyDetectionService:
             }
 
 
+def artifact_path_for(model_path: str) -> str:
+    """Chemin de l'artefact associé à un chemin de modèle (.pkl ou .ifm)."""
+    if model_path.endswith(ARTIFACT_SUFFIX):
+        return model_path
+    return os.path.splitext(model_path)[0] + ARTIFACT_SUFFIX
+
+
+class AnomalyMicroBatcher:
+    """
+    Regroupe les demandes de score en micro-lots (taille max ou délai max)
+    pour amortir le coût par appel d'IsolationForest sur le chemin d'ingestion.
+    
+    `service` est tout objet exposant predict_batch (AnomalyDetectionService
+    ou ModelRegistry).
+    """
+    
+    def __init__(self, service,
+                 max_batch_size: Optional[int] = None,
+                 max_delay: Optional[float] = None):
+        self.service = service
+        self.max_batch_size = max_batch_size or int(os.getenv("ML_BATCH_SIZE", "256"))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv("ML_BATCH_MAX_DELAY", "0.01"))
+        
+        self._queue: "queue.Queue[Tuple[Dict[str, Any], Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.samples = 0
+    
+    def submit(self, telemetry_dict: Dict[str, Any]) -> Future:
+        """
+        Soumet une télémétrie au prochain micro-lot.
+        
+        Returns:
+            Future résolu avec le tuple (is_anomaly, anomaly_score, status)
+        """
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((telemetry_dict, future))
+        return future
+    
+    def predict(self, telemetry_dict: Dict[str, Any], timeout: Optional[float] = 5.0) -> Tuple[bool, float, str]:
+        """Version bloquante de submit (pour les appels synchrones)."""
+        return self.submit(telemetry_dict).result(timeout=timeout)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "samples": self.samples,
+            "avg_batch_size": round(self.samples / self.batches, 2) if self.batches else 0.0,
+            "queue_depth": self._queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_delay": self.max_delay,
+        }
+    
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="ml-microbatch", daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            payloads = [payload for payload, _ in batch]
+            try:
+                results = self.service.predict_batch(payloads)
+            except Exception:
+                results = [(False, 0.0, "error")] * len(batch)
+            
+            self.batches += 1
+            self.samples += len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.set_running_or_notify_cancel():
+                    future.set_result(result)
+
+
 # Instance globale du service
 anomaly_service = AnomalyDetectionService()
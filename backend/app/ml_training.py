@@ -0,0 +1,232 @@
+"""
+Entraînement du modèle d'anomalies sur l'historique réel de télémétrie InfluxDB.
+L'historique est lu en flux (query_stream), transformé en features par blocs et
+sous-échantillonné par reservoir sampling pour borner la mémoire. Par défaut
+(stream_features), les statistiques glissantes par device sont rejouées sur
+l'historique pour produire les mêmes features temporelles qu'à l'ingestion. L'entraînement
+s'exécute dans un processus séparé pour ne pas bloquer l'API.
+"""
+import multiprocessing
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .feature_engineering import TelemetryFeatureEngineer, FEATURE_COLUMNS, N_FEATURES, N_STREAM_FEATURES
+from .flux_query import FluxQuery
+from .streaming_stats import StreamingStatsStore, replay_stream_features
+
+# Durées Flux acceptées pour la fenêtre d'historique (ex: 7d, 12h, 2w)
+FLUX_DURATION_RE = re.compile(r"^\d+(ms|s|m|h|d|w|mo|y)$")
+_WINDOW_UNITS = {"ms": ("milliseconds", 1), "s": ("seconds", 1), "m": ("minutes", 1), "h": ("hours", 1),
+                 "d": ("days", 1), "w": ("weeks", 1), "mo": ("days", 30), "y": ("days", 365)}
+
+
+class ReservoirSampler:
+    """
+    Échantillon uniforme de taille fixe sur un flux de lignes (algorithme R),
+    alimenté par blocs NumPy.
+    """
+
+    def __init__(self, capacity: int, n_features: int = N_FEATURES, seed: int = 42):
+        self.capacity = capacity
+        self.sample = np.empty((capacity, n_features), dtype=np.float32)
+        self.seen = 0
+        self._rng = np.random.default_rng(seed)
+
+    def add_batch(self, X: np.ndarray):
+        """Intègre un bloc de lignes au réservoir."""
+        n = len(X)
+        if n == 0:
+            return
+
+        # Remplissage initial
+        fill = min(max(self.capacity - self.seen, 0), n)
+        if fill:
+            self.sample[self.seen:self.seen + fill] = X[:fill]
+
+        # Remplacement : la ligne d'indice global t (1-based) remplace
+        # une case j ~ U[0, t) si j < capacity
+        rest = X[fill:]
+        if len(rest):
+            t = np.arange(self.seen + fill + 1, self.seen + n + 1)
+            j = self._rng.integers(0, t)
+            keep = j < self.capacity
+            self.sample[j[keep]] = rest[keep]
+
+        self.seen += n
+
+    def result(self) -> np.ndarray:
+        return self.sample[:min(self.seen, self.capacity)]
+
+
+def history_window(window: str) -> timedelta:
+    """Durée Flux (ex: 7d, 12h) en timedelta ; mo et y comptent 30 et 365 jours."""
+    match = FLUX_DURATION_RE.match(window)
+    if not match:
+        raise ValueError(f"Fenêtre invalide: {window}")
+    amount, unit = int(window[:-len(match.group(1))]), match.group(1)
+    return timedelta(**{_WINDOW_UNITS[unit][0]: amount * _WINDOW_UNITS[unit][1]})
+
+
+def build_history_query(bucket: str, window: str,
+                        device_ids: Optional[List[str]] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Requête Flux (texte, params) de l'historique de télémétrie, une ligne par point
+    (pivot). Les lignes d'une même série (device) sortent dans l'ordre du temps.
+    """
+    query = FluxQuery(bucket, "telemetry", start=history_window(window)) \
+        .tag("device_id", device_ids or None) \
+        .fields(*FEATURE_COLUMNS) \
+        .keep("device_id", *FEATURE_COLUMNS)
+    return query.build()
+
+
+def stream_telemetry_columns(query_api, query: str, chunk_size: int = 10000,
+                             params: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, List[Any]]]:
+    """
+    Lit le résultat de la requête en flux et le regroupe en blocs colonnaires.
+
+    Yields:
+        Dicts colonne -> liste de valeurs (au plus chunk_size lignes)
+    """
+    names = FEATURE_COLUMNS + ['device_id', 'ts']
+    columns: Dict[str, List[Any]] = {name: [] for name in names}
+    count = 0
+    for record in query_api.query_stream(query, params=params):
+        values = record.values
+        for name in FEATURE_COLUMNS:
+            columns[name].append(values.get(name))
+        columns['device_id'].append(values.get('device_id'))
+        columns['ts'].append(values.get('_time'))
+        count += 1
+        if count >= chunk_size:
+            yield columns
+            columns = {name: [] for name in names}
+            count = 0
+    if count:
+        yield columns
+
+
+def train_from_influx(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Tâche d'entraînement exécutée dans le processus de travail.
+
+    Args:
+        params: url, token, org, bucket, window, device_ids, max_samples,
+            chunk_size, contamination, model_path, stream_features (défaut True)
+
+    Returns:
+        Résumé de l'entraînement (échantillons lus / retenus, trained_at)
+    """
+    from influxdb_client import InfluxDBClient
+    from .ml_service import AnomalyDetectionService
+
+    query, query_params = build_history_query(params['bucket'], params['window'], params.get('device_ids'))
+    # Features temporelles : statistiques rejouées dans l'ordre de l'historique
+    stats = StreamingStatsStore() if params.get('stream_features', True) else None
+    n_features = N_STREAM_FEATURES if stats else N_FEATURES
+    sampler = ReservoirSampler(params['max_samples'], n_features)
+
+    with InfluxDBClient(url=params['url'], token=params['token'], org=params['org'],
+                        timeout=params.get('timeout_ms', 300_000)) as client:
+        query_api = client.query_api()
+        buffer = np.empty((params['chunk_size'], n_features), dtype=np.float32)
+        for columns in stream_telemetry_columns(query_api, query, params['chunk_size'], query_params):
+            n = len(columns['ts'])
+            if stats:
+                columns.update(replay_stream_features(stats, columns))
+            X = TelemetryFeatureEngineer.extract_features_columnar(columns, out=buffer[:n], n_features=n_features)
+            sampler.add_batch(X)
+
+    X_train = sampler.result()
+    if len(X_train) < params.get('min_samples', 100):
+        raise ValueError(f"Historique insuffisant: {len(X_train)} échantillons sur {params['window']}")
+
+    os.makedirs(os.path.dirname(params['model_path']) or ".", exist_ok=True)
+    service = AnomalyDetectionService(model_path=params['model_path'])
+    if not service.fit(X_train, contamination=params['contamination'], source="influxdb"):
+        raise RuntimeError(service.last_error)
+
+    return {
+        "rows_read": sampler.seen,
+        "samples_used": int(len(X_train)),
+        "n_features": n_features,
+        "trained_at": service.trained_at.isoformat(),
+    }
+
+
+class TrainingJobManager:
+    """
+    Lance les entraînements dans un processus dédié (un seul à la fois) et
+    signale le fichier modèle réécrit une fois l'entraînement terminé.
+    """
+
+    def __init__(self, on_model_saved: Callable[[str], Any]):
+        self.on_model_saved = on_model_saved
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.current_job_id: Optional[str] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn : ne pas hériter des threads (MQTT, writer) du processus API
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def is_running(self) -> bool:
+        job = self.jobs.get(self.current_job_id) if self.current_job_id else None
+        return bool(job and job["status"] == "running")
+
+    def submit(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Soumet un entraînement ; lève RuntimeError si un autre est en cours.
+
+        Args:
+            params: Paramètres de train_from_influx (model_path compris)
+        """
+        with self._lock:
+            if self.is_running():
+                raise RuntimeError("Un entraînement est déjà en cours")
+            job_id = str(uuid.uuid4())
+            public_params = {k: v for k, v in params.items() if k not in ("token", "url", "org")}
+            job = {
+                "job_id": job_id,
+                "status": "running",
+                "params": public_params,
+                "submitted_at": datetime.utcnow().isoformat(),
+                "finished_at": None,
+                "result": None,
+                "error": None,
+            }
+            self.jobs[job_id] = job
+            self.current_job_id = job_id
+            future = self._get_executor().submit(train_from_influx, params)
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return dict(job)
+
+    def _on_done(self, job_id: str, future: Future):
+        job = self.jobs[job_id]
+        try:
+            job["result"] = future.result()
+            job["status"] = "completed"
+            self.on_model_saved(job["params"]["model_path"])
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+        job["finished_at"] = datetime.utcnow().isoformat()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        return dict(job) if job else None
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,236 @@
+"""
+Registre de modèles d'anomalies par device_id ou par type de device.
+Les modèles sont chargés à la demande depuis le disque et gardés dans un cache
+LRU borné par un budget mémoire ; les chargements concurrents d'un même modèle
+sont dédupliqués. Le modèle global sert de repli.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .ml_service import AnomalyDetectionService, AnomalyMicroBatcher, anomaly_service
+from .forest_artifact import ARTIFACT_SUFFIX
+
+
+class ModelRegistry:
+    """
+    Cache LRU de AnomalyDetectionService indexé par clé ("device:<id>" ou "type:<type>").
+
+    Résolution d'un échantillon : modèle du device, sinon modèle de son type,
+    sinon modèle global.
+    """
+
+    # Intervalle de rescan du répertoire des modèles (détection des nouveaux fichiers)
+    SCAN_INTERVAL = 30.0
+
+    def __init__(self, default_service: AnomalyDetectionService,
+                 models_dir: Optional[str] = None,
+                 memory_budget_mb: Optional[float] = None):
+        self.default_service = default_service
+        self.models_dir = models_dir or os.getenv("ML_MODELS_DIR", "models")
+        budget_mb = memory_budget_mb or float(os.getenv("ML_MODELS_MEMORY_MB", "256"))
+        self.memory_budget = int(budget_mb * 1024 * 1024)
+
+        self._cache: "OrderedDict[str, Tuple[AnomalyDetectionService, int]]" = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        # Chargements en cours : clé -> Event (single-flight)
+        self._loading: Dict[str, threading.Event] = {}
+
+        self._on_disk: Set[str] = set()
+        self._last_scan = 0.0
+        # Modèles illisibles : clé -> mtime du fichier au moment de l'échec.
+        # Pas de nouvelle tentative tant que le fichier n'a pas changé.
+        self._failed: Dict[str, float] = {}
+
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0, "load_errors": 0}
+
+    # Clés et chemins
+    @staticmethod
+    def device_key(device_id: str) -> str:
+        return f"device:{device_id}"
+
+    @staticmethod
+    def type_key(device_type: str) -> str:
+        return f"type:{device_type}"
+
+    def model_path_for(self, key: str) -> str:
+        """
+        Chemin du fichier modèle d'une clé : "<kind>__<nom encodé>.ifm", le nom
+        étant percent-encodé (réversible ; inchangé s'il ne contient que [A-Za-z0-9_.~-]).
+        """
+        kind, name = key.split(":", 1)
+        return os.path.join(self.models_dir, f"{kind}__{quote(name, safe='')}{ARTIFACT_SUFFIX}")
+
+    def _key_from_filename(self, filename: str) -> Optional[str]:
+        if not filename.endswith(ARTIFACT_SUFFIX) or "__" not in filename:
+            return None
+        kind, name = filename[:-len(ARTIFACT_SUFFIX)].split("__", 1)
+        return f"{kind}:{unquote(name)}" if kind in ("device", "type") else None
+
+    def _scan(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_scan < self.SCAN_INTERVAL:
+            return
+        self._last_scan = now
+        try:
+            names = os.listdir(self.models_dir)
+        except OSError:
+            names = []
+        self._on_disk = {key for key in map(self._key_from_filename, names) if key}
+        for key, mtime in list(self._failed.items()):
+            if self._mtime(key) != mtime:
+                self._failed.pop(key, None)
+
+    def _mtime(self, key: str) -> Optional[float]:
+        try:
+            return os.stat(self.model_path_for(key)).st_mtime
+        except OSError:
+            return None
+
+    # Résolution
+    def resolve(self, device_id: Optional[str] = None, device_type: Optional[str] = None) -> AnomalyDetectionService:
+        """Modèle le plus spécifique disponible pour ce device."""
+        self._scan()
+        for key in (self.device_key(device_id) if device_id else None,
+                    self.type_key(device_type) if device_type else None):
+            if key and key in self._on_disk and key not in self._failed:
+                service = self.get(key)
+                if service is not None:
+                    return service
+        return self.default_service
+
+    def get(self, key: str) -> Optional[AnomalyDetectionService]:
+        """Modèle d'une clé, chargé depuis le disque au premier accès."""
+        while True:
+            with self._lock:
+                entry = self._cache.get(key)
+                if entry is not None:
+                    self._cache.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[0]
+                event = self._loading.get(key)
+                if event is None:
+                    # Ce thread charge le modèle ; les autres attendront l'événement
+                    event = threading.Event()
+                    self._loading[key] = event
+                    self.stats["misses"] += 1
+                    break
+            event.wait()
+            with self._lock:
+                entry = self._cache.get(key)
+                if entry is not None:
+                    self._cache.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[0]
+                if key not in self._loading:
+                    # Le chargement a échoué : ne pas relancer en boucle
+                    return None
+
+        try:
+            return self._load(key)
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            event.set()
+
+    def _load(self, key: str) -> Optional[AnomalyDetectionService]:
+        path = self.model_path_for(key)
+        mtime = self._mtime(key)
+        if mtime is None:
+            return None
+        service = AnomalyDetectionService(model_path=path)
+        if service.model_status != "trained":
+            self.stats["load_errors"] += 1
+            self._failed[key] = mtime
+            return None
+        self.stats["loads"] += 1
+        self._insert(key, service)
+        return service
+
+    def _insert(self, key: str, service: AnomalyDetectionService):
+        size = service.memory_bytes()
+        with self._lock:
+            previous = self._cache.pop(key, None)
+            if previous is not None:
+                self._memory_used -= previous[1]
+            self._cache[key] = (service, size)
+            self._memory_used += size
+            # Éviction LRU jusqu'à respecter le budget (on garde au moins l'entrée insérée)
+            while self._memory_used > self.memory_budget and len(self._cache) > 1:
+                _, (_, evicted_size) = self._cache.popitem(last=False)
+                self._memory_used -= evicted_size
+                self.stats["evictions"] += 1
+
+    def register(self, key: str, service: AnomalyDetectionService):
+        """Ajoute (ou remplace) un modèle fraîchement entraîné."""
+        self._insert(key, service)
+        self._failed.pop(key, None)
+        self._on_disk.add(key)
+
+    def reload_path(self, model_path: str):
+        """Recharge le modèle correspondant à un fichier réécrit (fin d'entraînement)."""
+        if os.path.abspath(model_path) == os.path.abspath(self.default_service.model_path):
+            self.default_service.reload()
+            return
+        with self._lock:
+            for key in list(self._cache):
+                if os.path.abspath(self.model_path_for(key)) == os.path.abspath(model_path):
+                    _, size = self._cache.pop(key)
+                    self._memory_used -= size
+        self._scan(force=True)
+
+    # Score
+    def predict_batch(self, telemetry_dicts: List[Dict[str, Any]]) -> List[Tuple[bool, float, str]]:
+        """
+        Score un lot hétérogène : les échantillons sont regroupés par modèle résolu
+        et chaque groupe est scoré en un seul appel.
+        """
+        groups: Dict[int, Tuple[AnomalyDetectionService, List[int]]] = {}
+        for i, payload in enumerate(telemetry_dicts):
+            service = self.resolve(payload.get('device_id'), payload.get('device_type'))
+            groups.setdefault(id(service), (service, []))[1].append(i)
+
+        results: List[Tuple[bool, float, str]] = [(False, 0.0, "pending")] * len(telemetry_dicts)
+        for service, indices in groups.values():
+            scored = service.predict_batch([telemetry_dicts[i] for i in indices])
+            for i, result in zip(indices, scored):
+                results[i] = result
+        return results
+
+    # Statut
+    def get_status(self) -> Dict[str, Any]:
+        """Version et date d'entraînement par clé, état du cache."""
+        self._scan()
+        with self._lock:
+            resident = {key: service for key, (service, _) in self._cache.items()}
+            memory_used = self._memory_used
+        models = []
+        for key in sorted(self._on_disk | set(resident)):
+            service = resident.get(key)
+            if service is not None:
+                meta = {"version": service.model_version,
+                        "trained_at": service.trained_at.isoformat() if service.trained_at else None}
+            else:
+                meta = AnomalyDetectionService.read_metadata(self.model_path_for(key)) or {}
+            models.append({
+                "key": key,
+                "version": meta.get("version"),
+                "trained_at": meta.get("trained_at"),
+                "resident": service is not None,
+                "load_failed": key in self._failed,
+            })
+        return {
+            "models": models,
+            "memory_used_bytes": memory_used,
+            "memory_budget_bytes": self.memory_budget,
+            **self.stats,
+        }
+
+
+# Registre global (le modèle global sert de repli)
+model_registry = ModelRegistry(anomaly_service)
+anomaly_batcher = AnomalyMicroBatcher(model_registry)
@@ -0,0 +1,132 @@
+"""
+Hand-off layer between the paho MQTT network thread and the asyncio event loop.
+MQTT callbacks only push raw payloads into bounded queues; a pool of asyncio
+consumers drains them and runs the (blocking) processing in a thread pool, so a slow
+InfluxDB or ML call can never stall MQTT keepalives.
+
+Messages are sharded by device: the device_id is hashed to one consumer, which
+processes its messages one at a time, so each device's telemetry is handled in
+the order it reached this process while different devices proceed in parallel
+(whether all of a device's messages reach the same process depends on the
+shared subscription strategy, see mqtt_consumer).
+"""
+import asyncio
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+
+def device_key(topic: str) -> str:
+    """Ordering key of a devices/<device_id>/... topic"""
+    parts = topic.split("/", 2)
+    return parts[1] if len(parts) > 1 else topic
+
+
+class MqttIngestBridge:
+    """
+    Bounded per-worker queues + consumer pool fed from a foreign thread.
+
+    `submit` is safe to call from any thread.
+    """
+
+    def __init__(self, handler: Callable[[str, bytes, Optional[str]], Any],
+                 max_queue_size: Optional[int] = None,
+                 workers: Optional[int] = None,
+                 key_func: Callable[[str], str] = device_key):
+        self.handler = handler
+        self.key_func = key_func
+        self.max_queue_size = max_queue_size or int(os.getenv("MQTT_INGEST_QUEUE_SIZE", "10000"))
+        self.workers = workers or int(os.getenv("MQTT_INGEST_WORKERS", "4"))
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues: List[asyncio.Queue] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks = []
+
+        self._metrics_lock = threading.Lock()
+        self._metrics: Dict[str, int] = {
+            "received": 0,
+            "dropped": 0,
+            "processed": 0,
+            "errors": 0,
+            "in_flight": 0,
+        }
+
+    async def start(self):
+        """Bind to the running loop and spawn the consumer pool"""
+        if self._tasks:
+            return
+        self.loop = asyncio.get_running_loop()
+        shard_size = max(1, self.max_queue_size // self.workers)
+        self._queues = [asyncio.Queue(maxsize=shard_size) for _ in range(self.workers)]
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="mqtt-ingest")
+        self._tasks = [self.loop.create_task(self._consume(q)) for q in self._queues]
+
+    async def stop(self):
+        """Cancel consumers and release the worker threads"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def is_running(self) -> bool:
+        return bool(self._tasks) and self.loop is not None and not self.loop.is_closed()
+
+    # Producer side (paho thread)
+    def submit(self, topic: str, payload: bytes, content_type: Optional[str] = None) -> bool:
+        """Queue a raw MQTT message (and its MQTT v5 content type, if any) for processing. Never blocks."""
+        self._incr("received")
+        if not self.is_running():
+            self._incr("dropped")
+            return False
+        try:
+            shard = zlib.crc32(self.key_func(topic).encode()) % self.workers
+            self.loop.call_soon_threadsafe(self._put, shard, topic, payload, content_type)
+        except RuntimeError:
+            # Loop closed between the check and the call (shutdown)
+            self._incr("dropped")
+            return False
+        return True
+
+    def _put(self, shard: int, topic: str, payload: bytes, content_type: Optional[str]):
+        try:
+            self._queues[shard].put_nowait((topic, payload, content_type))
+        except asyncio.QueueFull:
+            self._incr("dropped")
+
+    # Consumer side
+    async def _consume(self, queue: asyncio.Queue):
+        while True:
+            topic, payload, content_type = await queue.get()
+            self._incr("in_flight")
+            try:
+                await self.loop.run_in_executor(self._executor, self.handler, topic, payload, content_type)
+                self._incr("processed")
+            except Exception as e:
+                self._incr("errors")
+                print(f"Error processing MQTT message on {topic}: {e}")
+            finally:
+                self._incr("in_flight", -1)
+                queue.task_done()
+
+    def _incr(self, key: str, amount: int = 1):
+        with self._metrics_lock:
+            self._metrics[key] += amount
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Queue depth and drop counters"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics.update({
+            "queue_depth": sum(q.qsize() for q in self._queues),
+            "shard_depths": [q.qsize() for q in self._queues],
+            "queue_capacity": self.max_queue_size,
+            "workers": self.workers,
+            "running": self.is_running(),
+        })
+        return metrics
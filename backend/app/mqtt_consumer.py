@@ -0,0 +1,180 @@
+"""
+MQTT consumer clients for telemetry ingestion.
+With MQTT_SHARED_GROUP set, each consumer is an MQTT v5 client subscribed to
+`$share/<group>/<topic>`: the broker spreads the stream across every consumer of
+the group (in this process and in other replicas / ingest workers), so each
+message is processed once. Without a group a single classic subscription is
+used, as before.
+
+How the broker spreads a shared subscription decides whether a device stays on
+one consumer, which per-device ordering and per-device state (registry
+last_seen, hot buffer, streaming statistics) rely on. MQTT_SHARED_STRATEGY
+declares the broker's strategy:
+- round_robin (default, Mosquitto): any message can go to any consumer, so one
+  device's samples are split across processes. Only one consumer per process
+  is opened; use it to spread load when per-device state may be partial.
+- hash_topic: the broker is configured to hash the topic to a consumer (e.g.
+  EMQX `broker.shared_subscription_strategy = hash_topic`), so each device
+  sticks to one consumer and MQTT_CONSUMERS clients per process are allowed.
+"""
+import os
+import socket
+import ssl
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+# Telemetry topics: JSON, and binary encodings by topic suffix (see payload_codecs)
+TELEMETRY_TOPICS = ["devices/+/telemetry", "devices/+/telemetry/+"]
+# Live events (telemetry/alert) relayed from ingest workers to the API process
+EVENTS_TOPIC = os.getenv("MQTT_EVENTS_TOPIC", "siac/events")
+
+
+def ingest_in_api() -> bool:
+    """Whether the API process consumes telemetry itself (MQTT_INGEST_IN_API, default true)"""
+    return os.getenv("MQTT_INGEST_IN_API", "true").lower() == "true"
+
+
+SHARED_STRATEGIES = ("round_robin", "hash_topic")
+
+
+def shared_topics(topics: List[str], group: Optional[str]) -> List[str]:
+    return [f"$share/{group}/{topic}" for topic in topics] if group else list(topics)
+
+
+class MqttConsumerGroup:
+    """
+    N MQTT clients feeding one message handler.
+
+    `on_message(topic, payload, content_type)` is called on paho's network
+    threads and must return immediately (e.g. MqttIngestBridge.submit).
+    """
+
+    def __init__(self, topics: List[str], on_message: Callable[[str, bytes, Optional[str]], Any],
+                 consumers: Optional[int] = None, shared_group: Optional[str] = None,
+                 client_id_prefix: str = "siac-ingest", qos: Optional[int] = None,
+                 shared_strategy: Optional[str] = None):
+        self.topics = topics
+        self.on_message = on_message
+        self.shared_group = shared_group if shared_group is not None else os.getenv("MQTT_SHARED_GROUP", "")
+        self.shared_strategy = (shared_strategy or os.getenv("MQTT_SHARED_STRATEGY", "round_robin")).lower()
+        if self.shared_strategy not in SHARED_STRATEGIES:
+            raise ValueError(f"MQTT_SHARED_STRATEGY must be one of {', '.join(SHARED_STRATEGIES)}")
+        self.consumers = consumers or int(os.getenv("MQTT_CONSUMERS", "1"))
+        if not self.shared_group and self.consumers > 1:
+            # Several classic subscriptions would each receive the full stream
+            print("MQTT_CONSUMERS > 1 requires MQTT_SHARED_GROUP; using a single consumer")
+            self.consumers = 1
+        elif self.consumers > 1 and self.shared_strategy != "hash_topic":
+            # Round-robin would interleave one device's messages across our clients
+            print("MQTT_CONSUMERS > 1 requires MQTT_SHARED_STRATEGY=hash_topic; using a single consumer")
+            self.consumers = 1
+        if self.shared_group and self.shared_strategy != "hash_topic":
+            print(f"MQTT shared group {self.shared_group} is round-robin: a device's messages may be "
+                  "split across the group's processes (no per-device order across them)")
+        self.qos = qos if qos is not None else int(os.getenv("MQTT_QOS", "0"))
+        self.client_id_prefix = client_id_prefix
+
+        self.host = os.environ.get("MQTT_HOST")
+        self.port = int(os.environ.get("MQTT_PORT", "1883"))
+        self.user = os.environ.get("MQTT_USERNAME")
+        self.password = os.environ.get("MQTT_PASSWORD")
+        self.ca_cert = os.environ.get("MQTT_CA_CERT")
+        self.tls_enabled = os.environ.get("MQTT_TLS_ENABLED", "false").lower() == "true"
+
+        self.clients: List[mqtt.Client] = []
+        self._connected: Dict[int, bool] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def subscriptions(self) -> List[str]:
+        return shared_topics(self.topics, self.shared_group)
+
+    def _client_id(self, index: int) -> str:
+        return f"{self.client_id_prefix}-{socket.gethostname()}-{os.getpid()}-{index}"
+
+    def _make_client(self, index: int) -> mqtt.Client:
+        if self.shared_group:
+            client = mqtt.Client(client_id=self._client_id(index), protocol=mqtt.MQTTv5)
+        else:
+            client = mqtt.Client(client_id=self._client_id(index))
+
+        def on_connect(client, userdata, flags, rc, properties=None):
+            ok = rc == 0
+            with self._lock:
+                self._connected[index] = ok
+            if ok:
+                client.subscribe([(topic, self.qos) for topic in self.subscriptions])
+                print(f"MQTT consumer {index} connected, subscribed to {', '.join(self.subscriptions)}")
+            else:
+                print(f"MQTT consumer {index} connection failed with code {rc}")
+
+        def on_disconnect(client, userdata, rc, properties=None):
+            with self._lock:
+                self._connected[index] = False
+            print(f"MQTT consumer {index} disconnected with code {rc}")
+
+        def on_message(client, userdata, msg):
+            content_type = getattr(getattr(msg, "properties", None), "ContentType", None)
+            self.on_message(msg.topic, msg.payload, content_type)
+
+        client.on_connect = on_connect
+        client.on_disconnect = on_disconnect
+        client.on_message = on_message
+
+        if self.user and self.password:
+            client.username_pw_set(self.user, self.password)
+        # TLS configuration only if enabled
+        if self.tls_enabled and self.ca_cert:
+            client.tls_set(ca_certs=self.ca_cert, keyfile=None, tls_version=ssl.PROTOCOL_TLS_CLIENT)
+            client.tls_insecure_set(False)
+        return client
+
+    def start(self):
+        """Connect every consumer and start its network thread"""
+        for index in range(self.consumers):
+            client = self._make_client(index)
+            self.clients.append(client)
+            try:
+                client.connect(self.host, self.port, 60)
+            except Exception as e:
+                # loop_start keeps retrying in the background
+                print(f"Failed to connect MQTT consumer {index} to {self.host}:{self.port}: {e}")
+            client.loop_start()
+        print(f"MQTT consumers started: {self.consumers} on {self.host}:{self.port}"
+              + (f" (shared group {self.shared_group})" if self.shared_group else ""))
+
+    def stop(self):
+        for client in self.clients:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+            client.loop_stop()
+        self.clients = []
+        with self._lock:
+            self._connected.clear()
+
+    def is_connected(self) -> bool:
+        with self._lock:
+            return any(self._connected.values())
+
+    def publish(self, topic: str, payload: Any, qos: int = 0):
+        """Publish through the first connected client"""
+        with self._lock:
+            connected = [i for i, ok in self._connected.items() if ok]
+        if not connected:
+            raise RuntimeError("MQTT not connected")
+        return self.clients[connected[0]].publish(topic, payload, qos=qos)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            connected = sum(1 for ok in self._connected.values() if ok)
+        return {
+            "consumers": self.consumers,
+            "connected": connected,
+            "shared_group": self.shared_group or None,
+            "shared_strategy": self.shared_strategy if self.shared_group else None,
+            "subscriptions": self.subscriptions,
+        }
@@ -0,0 +1,286 @@
+"""
+Alert e-mail notifications, decoupled from ingestion.
+Alerts are pushed into a bounded queue; a background worker applies per-device /
+per-severity deduplication and rate limiting, groups what arrives within the
+digest window into a single mail and sends it over a persistent SMTP session.
+"""
+import os
+import queue
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _score(alert: Dict[str, Any]) -> float:
+    try:
+        return abs(float(alert.get("score") or 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class NotificationDispatcher:
+    """
+    Queue + worker thread sending alert digests by e-mail.
+
+    `notify` never performs network I/O. Alerts with the same (device, severity,
+    source, metric) inside the dedup window are folded into one digest line (the
+    free-text reason embeds scores and never repeats), and each
+    (device, severity) pair may produce at most `rate_limit` notifications per
+    `rate_period` seconds.
+    """
+
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None,
+                 user: Optional[str] = None, password: Optional[str] = None,
+                 sender: Optional[str] = None, recipients: Optional[List[str]] = None,
+                 max_queue_size: Optional[int] = None,
+                 digest_window: Optional[float] = None,
+                 digest_max_alerts: Optional[int] = None,
+                 dedup_window: Optional[float] = None,
+                 rate_limit: Optional[int] = None,
+                 rate_period: Optional[float] = None,
+                 smtp_idle_timeout: Optional[float] = None):
+        self.host = host or os.getenv("SMTP_HOST")
+        self.port = port or int(os.getenv("SMTP_PORT", "25"))
+        self.user = user or os.getenv("SMTP_USER")
+        self.password = password or os.getenv("SMTP_PASS")
+        self.sender = sender or os.getenv("SMTP_FROM", self.user or "alerts@siac.local")
+        to_addr = os.getenv("ALERT_EMAIL_TO", "")
+        self.recipients = recipients or [addr.strip() for addr in to_addr.split(",") if addr.strip()]
+
+        self.max_queue_size = max_queue_size or int(os.getenv("NOTIFY_QUEUE_SIZE", "1000"))
+        self.digest_window = digest_window if digest_window is not None else float(os.getenv("NOTIFY_DIGEST_WINDOW", "30"))
+        self.digest_max_alerts = digest_max_alerts or int(os.getenv("NOTIFY_DIGEST_MAX_ALERTS", "50"))
+        self.dedup_window = dedup_window if dedup_window is not None else float(os.getenv("NOTIFY_DEDUP_WINDOW", "300"))
+        self.rate_limit = rate_limit or int(os.getenv("NOTIFY_RATE_LIMIT", "5"))
+        self.rate_period = rate_period or float(os.getenv("NOTIFY_RATE_PERIOD", "3600"))
+        self.smtp_idle_timeout = smtp_idle_timeout or float(os.getenv("NOTIFY_SMTP_IDLE_TIMEOUT", "60"))
+
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=self.max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        # Worker-thread state
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._smtp_last_used = 0.0
+        self._last_sent: Dict[Tuple[str, str, str, str], float] = {}
+        self._sent_times: Dict[Tuple[str, str], List[float]] = {}
+
+        self._metrics_lock = threading.Lock()
+        self._metrics: Dict[str, Any] = {
+            "queued": 0,
+            "dropped": 0,
+            "deduplicated": 0,
+            "rate_limited": 0,
+            "mails_sent": 0,
+            "alerts_sent": 0,
+            "errors": 0,
+            "smtp_connects": 0,
+            "last_error": None,
+        }
+
+    def is_enabled(self) -> bool:
+        return bool(self.host and self.recipients)
+
+    # Producer side
+    def notify(self, alert: Dict[str, Any]) -> bool:
+        """Queue an alert for notification. Never blocks; returns False if dropped or disabled."""
+        if not self.is_enabled():
+            return False
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            self._incr("dropped")
+            return False
+        self._incr("queued")
+        return True
+
+    # Lifecycle
+    def start(self):
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="alert-notifier", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout: float = 10.0):
+        """Send what is queued and close the SMTP session"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    # Worker
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                if self._stop.is_set():
+                    break
+                self._close_idle_session()
+                continue
+
+            batch = self._collect_digest(first)
+            try:
+                self._dispatch(batch)
+            except Exception as e:
+                self._incr("errors")
+                self._set_error(e)
+                print(f"Error sending alert notification: {e}")
+
+        self._close_session()
+
+    def _collect_digest(self, first: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Gather alerts arriving within the digest window (shorter when stopping)"""
+        batch = [first]
+        deadline = time.monotonic() + self.digest_window
+        while len(batch) < self.digest_max_alerts:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0 or self._stop.is_set():
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                if remaining <= 0 or self._stop.is_set():
+                    break
+        return batch
+
+    def _dispatch(self, batch: List[Dict[str, Any]]):
+        # Fold duplicates: (device, severity, source, metric) -> [alert, count]
+        entries: Dict[Tuple[str, str, str, str], List[Any]] = {}
+        now = time.monotonic()
+        for alert in batch:
+            key = self._dedup_key(alert)
+            device, severity = key[0], key[1]
+            if key in entries:
+                entry = entries[key]
+                entry[1] += 1
+                # The digest line shows the strongest of the folded alerts
+                if _score(alert) > _score(entry[0]):
+                    entry[0] = alert
+                self._incr("deduplicated")
+                continue
+            if now - self._last_sent.get(key, float("-inf")) < self.dedup_window:
+                self._incr("deduplicated")
+                continue
+            if not self._allow(device, severity, now):
+                self._incr("rate_limited")
+                continue
+            entries[key] = [alert, 1]
+
+        if not entries:
+            return
+        self._send(*self._format(list(entries.values())))
+        for key in entries:
+            self._last_sent[key] = now
+        self._prune(now)
+        self._incr("mails_sent")
+        self._incr("alerts_sent", sum(count for _, count in entries.values()))
+
+    @staticmethod
+    def _dedup_key(alert: Dict[str, Any]) -> Tuple[str, str, str, str]:
+        """(device, severity, source, metric): bounded values only"""
+        metadata = alert.get("metadata") or {}
+        source = alert.get("source") or metadata.get("source") or "unknown"
+        return (str(alert.get("device_id", "unknown")), str(alert.get("severity", "unknown")),
+                str(source).lower(), str(metadata.get("metric", "")))
+
+    def _allow(self, device: str, severity: str, now: float) -> bool:
+        """Sliding-window rate limit per (device, severity)"""
+        times = [t for t in self._sent_times.get((device, severity), []) if now - t < self.rate_period]
+        if len(times) >= self.rate_limit:
+            self._sent_times[(device, severity)] = times
+            return False
+        times.append(now)
+        self._sent_times[(device, severity)] = times
+        return True
+
+    def _prune(self, now: float):
+        horizon = max(self.dedup_window, self.rate_period)
+        self._last_sent = {k: t for k, t in self._last_sent.items() if now - t < horizon}
+        self._sent_times = {k: v for k, v in self._sent_times.items() if v and now - v[-1] < self.rate_period}
+
+    @staticmethod
+    def _format(entries: List[List[Any]]) -> Tuple[str, str]:
+        if len(entries) == 1 and entries[0][1] == 1:
+            alert = entries[0][0]
+            subject = f"[SIAC-IoT] Alerte {str(alert.get('severity', 'unknown')).upper()} - {alert.get('device_id', 'unknown')}"
+            body = (f"Device: {alert.get('device_id', 'unknown')}\n"
+                    f"Time: {alert.get('ts', 'unknown')}\n"
+                    f"Reason: {alert.get('reason', 'unknown')}\n"
+                    f"Score: {alert.get('score', 0)}")
+            return subject, body
+
+        total = sum(count for _, count in entries)
+        devices = {str(alert.get("device_id", "unknown")) for alert, _ in entries}
+        subject = f"[SIAC-IoT] {total} alertes sur {len(devices)} device(s)"
+        lines = []
+        for alert, count in entries:
+            repeat = f" (x{count})" if count > 1 else ""
+            lines.append(f"- [{str(alert.get('severity', 'unknown')).upper()}] {alert.get('device_id', 'unknown')} "
+                         f"{alert.get('ts', 'unknown')} : {alert.get('reason', 'unknown')} "
+                         f"(score={alert.get('score', 0)}){repeat}")
+        return subject, "\n".join(lines)
+
+    # SMTP session
+    def _send(self, subject: str, body: str):
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = ", ".join(self.recipients)
+        try:
+            self._session().sendmail(self.sender, self.recipients, msg.as_string())
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # Stale pooled connection: reconnect once
+            self._close_session()
+            self._session().sendmail(self.sender, self.recipients, msg.as_string())
+        self._smtp_last_used = time.monotonic()
+
+    def _session(self) -> smtplib.SMTP:
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=10)
+            if self.user and self.password:
+                smtp.starttls()
+                smtp.login(self.user, self.password)
+            self._smtp = smtp
+            self._incr("smtp_connects")
+        return self._smtp
+
+    def _close_idle_session(self):
+        if self._smtp is not None and time.monotonic() - self._smtp_last_used > self.smtp_idle_timeout:
+            self._close_session()
+
+    def _close_session(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
+
+    # Metrics
+    def _incr(self, key: str, amount: int = 1):
+        with self._metrics_lock:
+            self._metrics[key] += amount
+
+    def _set_error(self, error: Exception):
+        with self._metrics_lock:
+            self._metrics["last_error"] = str(error)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics.update({
+            "enabled": self.is_enabled(),
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self.max_queue_size,
+            "smtp_session_open": self._smtp is not None,
+        })
+        return metrics
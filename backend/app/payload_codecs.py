@@ -0,0 +1,113 @@
+"""
+Decoding of MQTT telemetry payloads.
+The format is negotiated per message: MQTT v5 content type first, then the topic
+suffix (devices/<id>/telemetry/cbor, .../msgpack), JSON otherwise. CBOR and
+MessagePack support is optional (cbor2 / msgpack are imported on first use).
+
+Binary payloads may use the nested layout of the JSON messages
+({"sensors": {...}, "net": {...}}) or a flat map of the telemetry fields, which
+is cheaper to produce on the ESP32; both are returned in the nested layout.
+"""
+import json
+from typing import Any, Callable, Dict, Optional, Tuple
+
+SENSOR_FIELDS = ("temperature", "humidity", "distance", "motion", "servo_state", "led_states")
+NET_FIELDS = ("tx_bytes", "rx_bytes", "connections")
+
+# Topic suffix / content type -> format
+TOPIC_FORMATS = {"json": "json", "cbor": "cbor", "msgpack": "msgpack", "mp": "msgpack"}
+CONTENT_TYPE_FORMATS = {
+    "application/json": "json",
+    "application/cbor": "cbor",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+}
+
+_decoders: Dict[str, Callable[[bytes], Any]] = {}
+
+
+class PayloadError(ValueError):
+    """Payload cannot be decoded"""
+
+
+def parse_topic(topic: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    (device_id, format suffix) of a telemetry topic.
+
+    devices/<id>/telemetry -> (id, None); devices/<id>/telemetry/cbor -> (id, "cbor")
+    """
+    parts = topic.split("/")
+    if len(parts) < 3 or parts[0] != "devices" or parts[2] != "telemetry":
+        return None, None
+    return parts[1], parts[3] if len(parts) > 3 else None
+
+
+def payload_format(topic_suffix: Optional[str] = None, content_type: Optional[str] = None) -> str:
+    """Negotiated format name: content type, then topic suffix, then JSON"""
+    if content_type:
+        fmt = CONTENT_TYPE_FORMATS.get(content_type.split(";")[0].strip().lower())
+        if fmt:
+            return fmt
+    if topic_suffix:
+        fmt = TOPIC_FORMATS.get(topic_suffix.lower())
+        if fmt:
+            return fmt
+        raise PayloadError(f"Unsupported payload format: {topic_suffix}")
+    return "json"
+
+
+def _decoder(fmt: str) -> Callable[[bytes], Any]:
+    decoder = _decoders.get(fmt)
+    if decoder is not None:
+        return decoder
+    if fmt == "json":
+        decoder = json.loads
+    elif fmt == "cbor":
+        try:
+            import cbor2
+        except ImportError:
+            raise PayloadError("CBOR payloads require the cbor2 package")
+        decoder = cbor2.loads
+    elif fmt == "msgpack":
+        try:
+            import msgpack
+        except ImportError:
+            raise PayloadError("MessagePack payloads require the msgpack package")
+        decoder = lambda data: msgpack.unpackb(data, raw=False, strict_map_key=False)
+    else:
+        raise PayloadError(f"Unsupported payload format: {fmt}")
+    _decoders[fmt] = decoder
+    return decoder
+
+
+def decode_payload(raw: bytes, fmt: str = "json") -> Dict[str, Any]:
+    """
+    Decode a telemetry payload into {"sensors": {...}, "net": {...}, ...}.
+
+    A binary-declared payload that is actually JSON (legacy firmware publishing
+    on the new topic) is accepted as JSON.
+    """
+    try:
+        payload = _decoder(fmt)(raw)
+    except Exception as e:
+        error = e if isinstance(e, PayloadError) else PayloadError(f"Invalid {fmt} payload: {e}")
+        if fmt == "json" or raw[:1] != b"{":
+            raise error
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            raise error
+    if not isinstance(payload, dict):
+        raise PayloadError(f"Telemetry payload must be a map, got {type(payload).__name__}")
+    return normalize_payload(payload)
+
+
+def normalize_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Nested layout for flat payloads; nested payloads are returned unchanged"""
+    if "sensors" in payload or "net" in payload:
+        return payload
+    normalized = {k: v for k, v in payload.items() if k not in SENSOR_FIELDS and k not in NET_FIELDS}
+    normalized["sensors"] = {k: payload[k] for k in SENSOR_FIELDS if k in payload}
+    normalized["net"] = {k: payload[k] for k in NET_FIELDS if k in payload}
+    return normalized
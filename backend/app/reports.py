@@ -0,0 +1,309 @@
+"""
+Report rendering (PDF / XLSX) off the event loop.
+Reports are rendered in a small process pool; callers submit a job, poll it and
+download the file. Finished reports are cached by (type, range, format) and
+reused until they expire.
+"""
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .exports import EXPORT_SPECS, parse_time_bound, write_xlsx, suricata_severity_label
+from .flux_query import FluxQuery
+from .flux_records import stream_records
+
+REPORT_FORMATS = {
+    "pdf": ("application/pdf", "pdf"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+# PDF layout per report type: title, (record key, header) columns, header color, landscape, max rows
+PDF_LAYOUTS: Dict[str, Dict[str, Any]] = {
+    "telemetry": {
+        "title": None,
+        "columns": [("device_id", "Device ID"), ("ts", "Timestamp"), ("temperature", "Temp"),
+                    ("humidity", "Humidity"), ("distance", "Distance"), ("tx_bytes", "TX"),
+                    ("rx_bytes", "RX"), ("connections", "Connections")],
+        "header_color": "#808080",
+        "landscape": False,
+        "max_rows": 10000,
+    },
+    "alerts": {
+        "title": None,
+        "columns": [("alert_id", "Alert ID"), ("device_id", "Device ID"), ("ts", "Timestamp"),
+                    ("severity", "Severity"), ("score", "Score"), ("reason", "Reason"),
+                    ("acknowledged", "Acknowledged")],
+        "header_color": "#808080",
+        "landscape": False,
+        "max_rows": 10000,
+    },
+    "logs": {
+        "title": None,
+        "columns": [("event_ts", "Event TS"), ("event_type", "Event Type"), ("src_ip", "Src IP"),
+                    ("src_port", "Src Port"), ("dest_ip", "Dest IP"), ("dest_port", "Dest Port"),
+                    ("proto", "Proto"), ("signature", "Signature"), ("signature_id", "Sig ID"),
+                    ("severity", "Severity")],
+        "header_color": "#808080",
+        "landscape": False,
+        "max_rows": 10000,
+    },
+    "suricata_alerts": {
+        "title": "Rapport d'Alertes Suricata IDS",
+        "columns": [("event_ts", "Timestamp"), ("signature", "Signature"), ("severity", "Sév."),
+                    ("src_ip", "IP Source"), ("dest_ip", "IP Dest"), ("action", "Action")],
+        "header_color": "#D32F2F",
+        "landscape": True,
+        "max_rows": 100,
+    },
+}
+
+
+def _pdf_cell(kind: str, key: str, value: Any) -> Any:
+    if kind == "suricata_alerts":
+        if key == "severity":
+            return suricata_severity_label(value)[:4]
+        if key == "event_ts":
+            return str(value or "")[:19]
+        if key == "signature":
+            return str(value or "")[:40]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+def write_pdf(kind: str, rows, path: str):
+    """Render a report table with reportlab"""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter, landscape
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+    layout = PDF_LAYOUTS[kind]
+    doc = SimpleDocTemplate(path, pagesize=landscape(letter) if layout["landscape"] else letter)
+    elements = []
+    if layout["title"]:
+        styles = getSampleStyleSheet()
+        elements.append(Paragraph(f"<b>{layout['title']}</b>", styles['Title']))
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph(f"Généré le {datetime.now().strftime('%d/%m/%Y à %H:%M:%S')}", styles['Normal']))
+        elements.append(Spacer(1, 20))
+
+    table_data = [[header for _, header in layout["columns"]]]
+    for record in rows:
+        table_data.append([_pdf_cell(kind, key, record.get(key)) for key, _ in layout["columns"]])
+
+    table = Table(table_data, repeatRows=1)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor(layout["header_color"])),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT' if layout["landscape"] else 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    elements.append(table)
+    doc.build(elements)
+
+
+def render_report(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Worker-process task: query the rows and render the report file.
+
+    Args:
+        params: url, token, org, bucket, kind, format, start, stop, path
+    """
+    from influxdb_client import InfluxDBClient
+
+    kind, fmt = params["kind"], params["format"]
+    spec = EXPORT_SPECS[kind]
+    start, stop = parse_time_bound(params.get("start")), parse_time_bound(params.get("stop"))
+    query = FluxQuery(params["bucket"], spec.measurement, start=start or spec.window, stop=stop) \
+        .fields(*spec.fields) \
+        .keep(*spec.tags, *spec.fields)
+    if fmt == "pdf":
+        # A PDF table is held in memory by reportlab: newest rows only
+        query.newest(params.get("max_rows") or PDF_LAYOUTS[kind]["max_rows"])
+
+    tmp_path = params["path"] + ".part"
+    try:
+        with InfluxDBClient(url=params["url"], token=params["token"], org=params["org"],
+                            timeout=params.get("timeout_ms", 300_000)) as client:
+            flux_query, query_params = query.build()
+            rows = stream_records(client.query_api().query_stream(flux_query, params=query_params), spec.time_key)
+            counted = _Counter(rows)
+            if fmt == "pdf":
+                write_pdf(kind, counted, tmp_path)
+            else:
+                write_xlsx(spec, counted, tmp_path)
+        os.replace(tmp_path, params["path"])
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+    return {"rows": counted.count, "size_bytes": os.path.getsize(params["path"])}
+
+
+class _Counter:
+    """Iterator wrapper counting the rows consumed"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self.rows)
+        self.count += 1
+        return row
+
+
+class ReportJobManager:
+    """
+    Bounded process pool + job table for report rendering.
+
+    Jobs with the same (kind, start, stop, format) share one rendering while it
+    runs, and the finished file is reused for `cache_ttl` seconds.
+    """
+
+    def __init__(self, connection: Dict[str, str], reports_dir: Optional[str] = None,
+                 workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 cache_ttl: Optional[float] = None):
+        self.connection = connection
+        self.reports_dir = reports_dir or os.getenv("REPORTS_DIR", "reports")
+        self.workers = workers or int(os.getenv("REPORT_WORKERS", "2"))
+        self.max_pending = max_pending or int(os.getenv("REPORT_MAX_PENDING", "20"))
+        self.cache_ttl = cache_ttl or float(os.getenv("REPORT_CACHE_TTL", "300"))
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._futures: Dict[str, Future] = {}
+        self._by_key: Dict[Tuple, str] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: do not inherit the API process threads (MQTT, writer)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    @staticmethod
+    def cache_key(kind: str, fmt: str, start: Optional[str], stop: Optional[str]) -> Tuple:
+        return (kind, start, stop, fmt)
+
+    def submit(self, kind: str, fmt: str, start: Optional[str] = None, stop: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Queue a report, or return the running/cached job for the same key.
+
+        Raises:
+            ValueError: unknown report type/format or invalid range
+            RuntimeError: too many reports pending
+        """
+        if kind not in EXPORT_SPECS or fmt not in REPORT_FORMATS:
+            raise ValueError(f"Unsupported report: {kind}/{fmt}")
+        # Validate the range now rather than in the worker
+        parse_time_bound(start)
+        parse_time_bound(stop)
+
+        key = self.cache_key(kind, fmt, start, stop)
+        with self._lock:
+            self._expire()
+            existing = self.jobs.get(self._by_key.get(key))
+            if existing and existing["status"] in ("running", "completed"):
+                return self._public(existing)
+
+            pending = sum(1 for job in self.jobs.values() if job["status"] == "running")
+            if pending >= self.max_pending:
+                raise RuntimeError("Too many reports pending")
+
+            job_id = str(uuid.uuid4())
+            os.makedirs(self.reports_dir, exist_ok=True)
+            path = os.path.abspath(os.path.join(self.reports_dir, f"{kind}_{job_id}.{REPORT_FORMATS[fmt][1]}"))
+            job = {
+                "job_id": job_id,
+                "status": "running",
+                "kind": kind,
+                "format": fmt,
+                "start": start,
+                "stop": stop,
+                "submitted_at": datetime.utcnow().isoformat(),
+                "finished_at": None,
+                "result": None,
+                "error": None,
+            }
+            self.jobs[job_id] = {**job, "path": path, "finished": None}
+            self._by_key[key] = job_id
+            params = {**self.connection, "kind": kind, "format": fmt, "start": start, "stop": stop, "path": path}
+            future = self._get_executor().submit(render_report, params)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return job
+
+    def _on_done(self, job_id: str, future: Future):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            self._futures.pop(job_id, None)
+            if job is None:
+                return
+            try:
+                job["result"] = future.result()
+                job["status"] = "completed"
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+            job["finished_at"] = datetime.utcnow().isoformat()
+            job["finished"] = time.monotonic()
+
+    def _expire(self):
+        """Drop expired reports and their files (lock held)"""
+        now = time.monotonic()
+        for job_id, job in list(self.jobs.items()):
+            if job["finished"] is not None and now - job["finished"] > self.cache_ttl:
+                if job["status"] == "completed" and os.path.exists(job["path"]):
+                    os.unlink(job["path"])
+                del self.jobs[job_id]
+                key = self.cache_key(job["kind"], job["format"], job["start"], job["stop"])
+                if self._by_key.get(key) == job_id:
+                    del self._by_key[key]
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in job.items() if k not in ("path", "finished")}
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return self._public(job) if job else None
+
+    def get_future(self, job_id: str) -> Optional[Future]:
+        """Future of a running job (None once finished)"""
+        with self._lock:
+            return self._futures.get(job_id)
+
+    def get_file(self, job_id: str) -> Optional[Tuple[str, str, str]]:
+        """(path, media type, download filename) of a completed report"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if not job or job["status"] != "completed" or not os.path.exists(job["path"]):
+                return None
+            media_type, extension = REPORT_FORMATS[job["format"]]
+            finished = job["finished_at"][:19].replace("-", "").replace(":", "").replace("T", "_")
+            return job["path"], media_type, f"{job['kind']}_{finished}.{extension}"
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [self._public(job) for job in self.jobs.values()]
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
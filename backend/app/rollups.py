@@ -0,0 +1,471 @@
+"""
+Telemetry rollups and range-aware query routing.
+
+A background worker keeps two downsampled copies of the numeric telemetry
+fields in the telemetry bucket:
+
+    telemetry_1m / telemetry_1h   tag device_id
+                                  fields <field>_count, _min, _max, _mean, _sum
+
+Each rollup run is a single Flux query executed server-side (aggregateWindow
+then `to()`), so raw points never leave InfluxDB. Windows are closed
+ROLLUP_LAG after their end and the last rolled window is recomputed on the
+next run, which makes runs idempotent.
+
+Points written after their window was rolled (batch backfills, spool replay
+after an outage, writes retried past ROLLUP_LAG) are reported by the write
+pipeline through note_written(): the next run moves its cursor back to the
+oldest such window. Processes that do not run the worker publish that
+timestamp as a `rollup_dirty` point, which the worker reads on each run.
+
+Chart and metric endpoints call `aggregate()`, which reads the coarsest rollup
+whose interval divides the requested resolution and whose history covers the
+requested range, and aggregates only the not-yet-rolled tail from raw points.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from influxdb_client import Point
+
+from .flux_query import parse_duration
+
+# Numeric telemetry fields that are rolled up (motion/servo/LED states are not)
+ROLLUP_FIELDS = ("temperature", "humidity", "distance", "tx_bytes", "rx_bytes", "connections")
+# Field written with every telemetry point: its rollup count is the point count
+MARKER_FIELD = "temperature"
+# Oldest late point reported by processes without a rollup worker (field "since", ns)
+DIRTY_MEASUREMENT = "rollup_dirty"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass(frozen=True)
+class RollupLevel:
+    measurement: str
+    interval: timedelta
+    # Span rolled up by one query, and history built when the rollup is empty
+    chunk: timedelta
+    backfill: timedelta
+
+
+ROLLUP_LEVELS = (
+    RollupLevel("telemetry_1m", timedelta(minutes=1), chunk=timedelta(hours=6),
+                backfill=parse_duration(os.getenv("ROLLUP_1M_BACKFILL", "2d"))),
+    RollupLevel("telemetry_1h", timedelta(hours=1), chunk=timedelta(days=7),
+                backfill=parse_duration(os.getenv("ROLLUP_1H_BACKFILL", "30d"))),
+)
+
+# Raw telemetry -> one rollup level, written back by InfluxDB itself
+ROLLUP_QUERY = '''
+data = from(bucket: params.bucket)
+    |> range(start: params.start, stop: params.stop)
+    |> filter(fn: (r) => r._measurement == "telemetry")
+    |> filter(fn: (r) => {fields})
+    |> toFloat()
+rollup = (tables=<-, fn, stat) => tables
+    |> aggregateWindow(every: params.every, fn: fn, timeSrc: "_start", createEmpty: false)
+    |> map(fn: (r) => ({{r with _measurement: params.target, _field: r._field + "_" + stat}}))
+union(tables: [
+    data |> rollup(fn: count, stat: "count"),
+    data |> rollup(fn: min, stat: "min"),
+    data |> rollup(fn: max, stat: "max"),
+    data |> rollup(fn: mean, stat: "mean"),
+    data |> rollup(fn: sum, stat: "sum"),
+])
+    |> to(bucket: params.bucket)
+    |> filter(fn: (r) => false)
+'''
+
+# Partial aggregates of a rollup level, re-aggregated to the requested resolution
+ROLLUP_READ_QUERY = '''
+data = from(bucket: params.bucket)
+    |> range(start: params.start, stop: params.stop)
+    |> filter(fn: (r) => r._measurement == params.target)
+    |> filter(fn: (r) => {fields}){device_filter}
+    |> group(columns: {group})
+combine = (tables=<-, stat, fn) => tables
+    |> filter(fn: (r) => strings.hasSuffix(v: r._field, suffix: "_" + stat))
+    |> aggregateWindow(every: params.every, fn: fn, timeSrc: "_start", createEmpty: false)
+union(tables: [
+    data |> combine(stat: "count", fn: sum),
+    data |> combine(stat: "sum", fn: sum),
+    data |> combine(stat: "min", fn: min),
+    data |> combine(stat: "max", fn: max),
+])
+'''
+
+# Same partial aggregates computed from raw points (tail not rolled up yet)
+RAW_READ_QUERY = '''
+data = from(bucket: params.bucket)
+    |> range(start: params.start, stop: params.stop)
+    |> filter(fn: (r) => r._measurement == "telemetry")
+    |> filter(fn: (r) => {fields}){device_filter}
+    |> toFloat()
+    |> group(columns: {group})
+partial = (tables=<-, fn, stat) => tables
+    |> aggregateWindow(every: params.every, fn: fn, timeSrc: "_start", createEmpty: false)
+    |> map(fn: (r) => ({{r with _field: r._field + "_" + stat}}))
+union(tables: [
+    data |> partial(fn: count, stat: "count"),
+    data |> partial(fn: sum, stat: "sum"),
+    data |> partial(fn: min, stat: "min"),
+    data |> partial(fn: max, stat: "max"),
+])
+'''
+
+# Oldest / newest rolled window of a level
+ROLLUP_BOUNDS_QUERY = '''
+data = from(bucket: params.bucket)
+    |> range(start: params.start)
+    |> filter(fn: (r) => r._measurement == params.target and r._field == params.marker)
+    |> keep(columns: ["_time", "_value", "device_id"])
+union(tables: [
+    data |> first() |> group() |> min(column: "_time") |> set(key: "bound", value: "first"),
+    data |> last() |> group() |> max(column: "_time") |> set(key: "bound", value: "last"),
+])
+'''
+
+
+# Oldest late point reported since params.start
+ROLLUP_DIRTY_QUERY = '''
+from(bucket: params.bucket)
+    |> range(start: params.start)
+    |> filter(fn: (r) => r._measurement == params.target and r._field == "since")
+    |> group()
+    |> min()
+'''
+
+
+def floor_time(ts: datetime, every: timedelta) -> datetime:
+    """Start of the epoch-aligned window containing ts (same alignment as aggregateWindow)"""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return _EPOCH + ((ts - _EPOCH) // every) * every
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _any_of(column: str, prefix: str, values: Sequence[str], params: Dict[str, Any]) -> str:
+    conditions = []
+    for i, value in enumerate(values):
+        params[f"{prefix}{i}"] = value
+        conditions.append(f"{column} == params.{prefix}{i}")
+    return " or ".join(conditions)
+
+
+class TelemetryRollups:
+    """
+    Rollup worker (ROLLUP_WORKER_ENABLED, every ROLLUP_INTERVAL seconds) and
+    router of aggregate reads.
+
+    Several API replicas may run the worker: runs are idempotent. Processes
+    that do not run it read the rollup bounds from InfluxDB instead.
+    """
+
+    def __init__(self, data_service, interval: Optional[float] = None, lag: Optional[float] = None,
+                 levels: Sequence[RollupLevel] = ROLLUP_LEVELS):
+        self.data_service = data_service
+        self.interval = interval or float(os.getenv("ROLLUP_INTERVAL", "60"))
+        self.lag = timedelta(seconds=lag or float(os.getenv("ROLLUP_LAG", "30")))
+        self.enabled = os.getenv("ROLLUP_WORKER_ENABLED", "true").lower() == "true"
+        self.levels = sorted(levels, key=lambda level: level.interval)
+
+        # measurement -> {"first": oldest rolled window, "last": newest rolled window}
+        self._bounds: Dict[str, Dict[str, Optional[datetime]]] = {}
+        self._bounds_loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # Oldest late point not rolled up again yet (this process' writes)
+        self._dirty: Optional[datetime] = None
+        # Last dirty timestamp published for another process' worker
+        self._published_dirty: Optional[datetime] = None
+        self._published_at = 0.0
+        # rollup_dirty points are read from here on (covers a worker that was down)
+        self._marks_since = _utcnow() - min(level.backfill for level in self.levels)
+
+        self.metrics = {"runs": 0, "errors": 0, "last_error": None, "last_run_seconds": None, "late_marks": 0,
+                        "windows": {level.measurement: 0 for level in self.levels},
+                        "reads": {"raw": 0, **{level.measurement: 0 for level in self.levels}}}
+
+    # Worker
+    def start(self):
+        """Start the rollup thread (no-op if disabled or already running)"""
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry-rollups", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self.metrics["errors"] += 1
+                    self.metrics["last_error"] = str(e)
+                print(f"Telemetry rollup failed: {e}")
+            self._stop.wait(self.interval)
+
+    def run_once(self, now: Optional[datetime] = None):
+        """Roll up every closed window since the last run, finest level first"""
+        if not self.data_service.is_connected():
+            return
+        with self._run_lock:
+            started = time.monotonic()
+            now = now or _utcnow()
+            self._read_dirty_marks(now)
+            with self._lock:
+                dirty, self._dirty = self._dirty, None
+            try:
+                for level in self.levels:
+                    if self._stop.is_set():
+                        break
+                    self._roll_level(level, now, dirty)
+            except Exception:
+                # Keep the late mark for the next run
+                with self._lock:
+                    if dirty is not None and (self._dirty is None or dirty < self._dirty):
+                        self._dirty = dirty
+                raise
+            with self._lock:
+                self.metrics["runs"] += 1
+                self.metrics["last_run_seconds"] = round(time.monotonic() - started, 3)
+
+    def _roll_level(self, level: RollupLevel, now: datetime, dirty: Optional[datetime] = None):
+        bounds = self._level_bounds(level)
+        end = floor_time(now - self.lag, level.interval)
+        if bounds["last"] is None:
+            cursor = floor_time(now - level.backfill, level.interval)
+        else:
+            # Recompute the newest rolled window: it may have received late points
+            cursor = bounds["last"]
+            if dirty is not None:
+                # ... and every window from the oldest late point on (within the rolled history)
+                cursor = min(cursor, max(floor_time(dirty, level.interval), bounds["first"] or cursor))
+
+        while cursor < end and not self._stop.is_set():
+            stop = min(cursor + level.chunk, end)
+            self._roll_window(level, cursor, stop)
+            with self._lock:
+                state = self._bounds[level.measurement]
+                if state["first"] is None or cursor < state["first"]:
+                    state["first"] = cursor
+                # Points in [stop - interval, stop) are complete: next run starts there
+                state["last"] = stop - level.interval
+                self.metrics["windows"][level.measurement] += int((stop - cursor) / level.interval)
+            cursor = stop
+
+    def _roll_window(self, level: RollupLevel, start: datetime, stop: datetime):
+        params = {"bucket": self.data_service.bucket, "target": level.measurement,
+                  "start": start, "stop": stop, "every": level.interval}
+        fields = _any_of("r._field", "field", ROLLUP_FIELDS, params)
+        self.data_service.query_api.query(ROLLUP_QUERY.format(fields=fields), params=params)
+
+    # Late points
+    def note_written(self, lines: Sequence[str]):
+        """Write pipeline hook: mark the windows of telemetry lines that arrived after ROLLUP_LAG"""
+        late_before = time.time_ns() - int(self.lag.total_seconds() * 1_000_000_000)
+        oldest = None
+        for line in lines:
+            if not line.startswith("telemetry,"):
+                continue
+            ts = line.rpartition(" ")[2]
+            if ts.isdigit() and int(ts) < late_before and (oldest is None or int(ts) < oldest):
+                oldest = int(ts)
+        if oldest is not None:
+            self.mark_dirty(_EPOCH + timedelta(microseconds=oldest // 1000))
+
+    def mark_dirty(self, ts: datetime):
+        """Have the next run roll up again every window from ts on"""
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        with self._lock:
+            self.metrics["late_marks"] += 1
+            if self._thread and self._thread.is_alive():
+                if self._dirty is None or ts < self._dirty:
+                    self._dirty = ts
+                return
+            # The worker runs elsewhere: publish, at most once per interval unless older
+            if (self._published_dirty is not None and ts >= self._published_dirty
+                    and time.monotonic() - self._published_at < self.interval):
+                return
+            self._published_dirty = ts
+            self._published_at = time.monotonic()
+        writer = self.data_service.writer
+        if writer:
+            # No timestamp: InfluxDB stamps it on arrival, after a spool replay included
+            writer.enqueue(Point(DIRTY_MEASUREMENT).field("since", int((ts - _EPOCH) / timedelta(microseconds=1)) * 1000))
+
+    def _read_dirty_marks(self, now: datetime):
+        """Fold the rollup_dirty points written since the last check into the pending mark"""
+        # Points are stamped by the server: allow for clock skew and write delay
+        params = {"bucket": self.data_service.bucket, "target": DIRTY_MEASUREMENT,
+                  "start": self._marks_since - self.lag}
+        try:
+            tables = self.data_service.query_api.query(ROLLUP_DIRTY_QUERY, params=params)
+        except Exception as e:
+            print(f"Failed to read rollup dirty marks: {e}")
+            return
+        self._marks_since = now
+        for table in tables:
+            for record in table.records:
+                value = record.get_value()
+                if value is None:
+                    continue
+                ts = _EPOCH + timedelta(microseconds=int(value) // 1000)
+                with self._lock:
+                    if self._dirty is None or ts < self._dirty:
+                        self._dirty = ts
+
+    # Rollup bounds
+    def _level_bounds(self, level: RollupLevel) -> Dict[str, Optional[datetime]]:
+        """Oldest/newest rolled window; loaded from InfluxDB once (or periodically without a worker)"""
+        with self._lock:
+            stale = not self._bounds or (
+                not (self._thread and self._thread.is_alive())
+                and time.monotonic() - self._bounds_loaded_at > self.interval
+            )
+        if stale:
+            self._load_bounds()
+        with self._lock:
+            return dict(self._bounds.get(level.measurement) or {"first": None, "last": None})
+
+    def _load_bounds(self):
+        loaded = {}
+        for level in self.levels:
+            params = {"bucket": self.data_service.bucket, "target": level.measurement,
+                      "marker": f"{MARKER_FIELD}_count", "start": -timedelta(days=3650)}
+            bounds = {"first": None, "last": None}
+            try:
+                for table in self.data_service.query_api.query(ROLLUP_BOUNDS_QUERY, params=params):
+                    for record in table.records:
+                        bounds[record.values.get("bound")] = record.get_time()
+            except Exception as e:
+                print(f"Failed to load rollup bounds of {level.measurement}: {e}")
+            loaded[level.measurement] = bounds
+        with self._lock:
+            for measurement, bounds in loaded.items():
+                # Keep progress made by this process' worker
+                current = self._bounds.get(measurement)
+                if current and current["last"] and (bounds["last"] is None or current["last"] > bounds["last"]):
+                    bounds = current
+                self._bounds[measurement] = bounds
+            self._bounds_loaded_at = time.monotonic()
+
+    # Routing
+    def select(self, start: datetime, every: timedelta) -> Tuple[Optional[RollupLevel], Optional[datetime]]:
+        """
+        Coarsest level whose interval divides `every` and whose history starts
+        at or before `start`, with the end of its rolled data; (None, None)
+        means raw points must be read.
+        """
+        start = floor_time(start, every)
+        for level in reversed(self.levels):
+            if level.interval > every or every % level.interval:
+                continue
+            bounds = self._level_bounds(level)
+            if bounds["first"] is None or bounds["last"] is None or bounds["first"] > start:
+                continue
+            return level, bounds["last"] + level.interval
+        return None, None
+
+    def aggregate(self, fields: Sequence[str], start: datetime, every: timedelta,
+                  stop: Optional[datetime] = None, device_id: Optional[str] = None,
+                  by_device: bool = False) -> Dict[Tuple[datetime, Optional[str]], Dict[str, Dict[str, Any]]]:
+        """
+        count/sum/min/max/mean of `fields` per `every` window over [start, stop).
+
+        Returns {(window start (naive UTC), device_id or None): {field: {"count", "sum", "min", "max", "mean"}}}.
+        """
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        stop = stop or _utcnow()
+        if stop.tzinfo is None:
+            stop = stop.replace(tzinfo=timezone.utc)
+
+        partials: Dict[Tuple[datetime, Optional[str]], Dict[str, Dict[str, Any]]] = {}
+        level, rolled_until = self.select(start, every)
+        tail_start = start
+        if level is not None:
+            tail_start = min(max(rolled_until, start), stop)
+            if tail_start > start:
+                self._read(ROLLUP_READ_QUERY, level.measurement, fields, start, tail_start,
+                           every, device_id, by_device, partials)
+        if tail_start < stop:
+            self._read(RAW_READ_QUERY, "telemetry", fields, tail_start, stop,
+                       every, device_id, by_device, partials)
+
+        with self._lock:
+            self.metrics["reads"][level.measurement if level else "raw"] += 1
+
+        for values in partials.values():
+            for stats in values.values():
+                stats["mean"] = stats["sum"] / stats["count"] if stats["count"] else None
+        return partials
+
+    def count_points(self, start: datetime, stop: Optional[datetime] = None) -> int:
+        """Number of telemetry points written in [start, stop)"""
+        totals = self.aggregate([MARKER_FIELD], start, timedelta(days=1), stop=stop)
+        return int(sum(values[MARKER_FIELD]["count"] for values in totals.values() if MARKER_FIELD in values))
+
+    def _read(self, template: str, source: str, fields: Sequence[str], start: datetime, stop: datetime,
+              every: timedelta, device_id: Optional[str], by_device: bool,
+              partials: Dict[Tuple[datetime, Optional[str]], Dict[str, Dict[str, Any]]]):
+        params = {"bucket": self.data_service.bucket, "target": source,
+                  "start": start, "stop": stop, "every": every}
+        if template is ROLLUP_READ_QUERY:
+            names = [f"{f}_{stat}" for f in fields for stat in ("count", "sum", "min", "max")]
+        else:
+            names = list(fields)
+        device_filter = ""
+        if device_id is not None:
+            params["device_id"] = device_id
+            device_filter = "\n    |> filter(fn: (r) => r.device_id == params.device_id)"
+        group = '["_field", "device_id"]' if by_device else '["_field"]'
+        flux = template.format(fields=_any_of("r._field", "field", names, params),
+                               device_filter=device_filter, group=group)
+        if template is ROLLUP_READ_QUERY:
+            flux = 'import "strings"\n' + flux
+
+        for table in self.data_service.query_api.query(flux, params=params):
+            for record in table.records:
+                field, _, stat = record.get_field().rpartition("_")
+                value = record.get_value()
+                if value is None:
+                    continue
+                window = floor_time(record.get_time(), every).replace(tzinfo=None)
+                key = (window, record.values.get("device_id") if by_device else None)
+                stats = partials.setdefault(key, {}).setdefault(
+                    field, {"count": 0, "sum": 0.0, "min": None, "max": None})
+                if stat in ("count", "sum"):
+                    stats[stat] += value
+                elif stat == "min":
+                    stats["min"] = value if stats["min"] is None else min(stats["min"], value)
+                elif stat == "max":
+                    stats["max"] = value if stats["max"] is None else max(stats["max"], value)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = {**self.metrics, "windows": dict(self.metrics["windows"]),
+                       "reads": dict(self.metrics["reads"])}
+            metrics["levels"] = {
+                measurement: {k: v.isoformat() if v else None for k, v in bounds.items()}
+                for measurement, bounds in self._bounds.items()
+            }
+        metrics["worker"] = bool(self._thread and self._thread.is_alive())
+        return metrics
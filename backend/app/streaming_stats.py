@@ -0,0 +1,210 @@
+"""
+Statistiques glissantes de télémétrie par device, mises à jour en O(1) par échantillon.
+
+Pour chaque champ numérique : moyenne/variance de Welford, moyenne mobile
+exponentielle (EWMA), taux de variation par seconde et min/max sur une fenêtre
+de temps (deques monotones, O(1) amorti). Elles alimentent le détecteur z-score
+de repli tant que l'IsolationForest n'est pas entraîné, et donnent un contexte
+temporel au modèle sans relire l'historique dans InfluxDB.
+"""
+import math
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+# Champs suivis
+STREAM_FIELDS = ("temperature", "humidity", "distance", "tx_bytes", "rx_bytes", "connections")
+# Features temporelles du modèle (<champ>_zscore, _ewma, _rate), après les 7 features
+# de base (feature_engineering) pour les modèles entraînés sur l'historique
+STREAM_FEATURE_FIELDS = ("temperature", "humidity", "connections")
+STREAM_FEATURE_COLUMNS = [f"{name}_{stat}" for name in STREAM_FEATURE_FIELDS for stat in ("zscore", "ewma", "rate")]
+
+
+class RunningStats:
+    """Statistiques incrémentales d'une série (un champ d'un device)"""
+
+    __slots__ = ("count", "mean", "m2", "ewma", "last_value", "last_ts", "rate", "_mins", "_maxs")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma: Optional[float] = None
+        self.last_value: Optional[float] = None
+        self.last_ts: Optional[float] = None
+        self.rate = 0.0
+        # (ts, valeur) croissantes / décroissantes : le min / max de la fenêtre est en tête
+        self._mins: deque = deque()
+        self._maxs: deque = deque()
+
+    @property
+    def std(self) -> float:
+        """Écart-type (échantillon) de Welford"""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def zscore(self, value: float, min_std: float) -> Optional[float]:
+        """Écart de value à la moyenne courante, en écarts-types (None sans historique)"""
+        if self.count < 2:
+            return None
+        return (value - self.mean) / max(self.std, min_std)
+
+    def update(self, ts: float, value: float, alpha: float, window: float):
+        """
+        Ajoute un échantillon.
+
+        Args:
+            ts: Horodatage en secondes (epoch)
+            value: Valeur mesurée
+            alpha: Poids de l'EWMA
+            window: Fenêtre du min/max en secondes
+        """
+        # Welford
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        self.ewma = value if self.ewma is None else self.ewma + alpha * (value - self.ewma)
+
+        # Taux de variation (unités / seconde), ignoré pour les échantillons en retard
+        if self.last_ts is not None and ts > self.last_ts:
+            self.rate = (value - self.last_value) / (ts - self.last_ts)
+        if self.last_ts is None or ts >= self.last_ts:
+            self.last_value = value
+            self.last_ts = ts
+
+        while self._mins and self._mins[-1][1] >= value:
+            self._mins.pop()
+        self._mins.append((ts, value))
+        while self._maxs and self._maxs[-1][1] <= value:
+            self._maxs.pop()
+        self._maxs.append((ts, value))
+        horizon = (self.last_ts or ts) - window
+        while self._mins and self._mins[0][0] < horizon:
+            self._mins.popleft()
+        while self._maxs and self._maxs[0][0] < horizon:
+            self._maxs.popleft()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "std": self.std,
+            "ewma": self.ewma,
+            "rate": self.rate,
+            "min": self._mins[0][1] if self._mins else None,
+            "max": self._maxs[0][1] if self._maxs else None,
+        }
+
+
+class StreamingStatsStore:
+    """
+    Statistiques glissantes de tous les devices.
+
+    update() renvoie, pour chaque champ présent, le z-score de l'échantillon par
+    rapport à l'historique *avant* sa prise en compte, suivi des statistiques à jour.
+    """
+
+    def __init__(self, alpha: Optional[float] = None, window: Optional[float] = None,
+                 min_std: Optional[float] = None):
+        self.alpha = alpha or float(os.getenv("STREAM_EWMA_ALPHA", "0.1"))
+        self.window = window or float(os.getenv("STREAM_WINDOW_SECONDS", "300"))
+        # Plancher de l'écart-type : un capteur stable (quantifié) ne déclenche pas sur un pas de mesure
+        self.min_std = min_std or float(os.getenv("STREAM_MIN_STD", "0.5"))
+
+        self._devices: Dict[str, Dict[str, RunningStats]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"updates": 0}
+
+    def update(self, device_id: str, ts: datetime, values: Mapping[str, Any]) -> Dict[str, Dict[str, Any]]:
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        seconds = ts.timestamp()
+        result = {}
+        with self._lock:
+            series = self._devices.setdefault(device_id, {})
+            for name in STREAM_FIELDS:
+                value = values.get(name)
+                if value is None or isinstance(value, bool):
+                    continue
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                if not math.isfinite(value):
+                    continue
+                running = series.get(name)
+                if running is None:
+                    running = series[name] = RunningStats()
+                z = running.zscore(value, self.min_std)
+                running.update(seconds, value, self.alpha, self.window)
+                result[name] = {"value": value, "z": z, **running.snapshot()}
+            self.stats["updates"] += 1
+        return result
+
+    def get(self, device_id: str) -> Dict[str, Dict[str, Any]]:
+        """Statistiques courantes d'un device"""
+        with self._lock:
+            return {name: running.snapshot() for name, running in self._devices.get(device_id, {}).items()}
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "devices": len(self._devices)}
+
+
+def stream_features(stream: Mapping[str, Mapping[str, Any]]) -> Dict[str, Optional[float]]:
+    """
+    Features temporelles (STREAM_FEATURE_COLUMNS) d'un résultat de StreamingStatsStore.update.
+    Sans historique, z-score et taux valent 0 et l'EWMA None (remplacée par la valeur courante).
+    """
+    features = {}
+    for name in STREAM_FEATURE_FIELDS:
+        stats = stream.get(name) or {}
+        features[f"{name}_zscore"] = stats.get("z") or 0.0
+        features[f"{name}_ewma"] = stats.get("ewma")
+        features[f"{name}_rate"] = stats.get("rate") or 0.0
+    return features
+
+
+def replay_stream_features(store: StreamingStatsStore, columns: Mapping[str, List[Any]]) -> Dict[str, List[Optional[float]]]:
+    """
+    Rejoue un bloc colonnaire d'historique (device_id, ts, champs) dans store,
+    dans l'ordre des lignes, et renvoie les features temporelles de chaque ligne
+    telles que l'ingestion les aurait calculées.
+    """
+    features: Dict[str, List[Optional[float]]] = {name: [] for name in STREAM_FEATURE_COLUMNS}
+    names = [name for name in STREAM_FIELDS if name in columns]
+    for i, (device_id, ts) in enumerate(zip(columns["device_id"], columns["ts"])):
+        stream = store.update(device_id or "", ts, {name: columns[name][i] for name in names}) if ts else {}
+        for name, value in stream_features(stream).items():
+            features[name].append(value)
+    return features
+
+
+class ZScoreDetector:
+    """
+    Détecteur de repli : anomalie si |z| dépasse le seuil sur un des champs
+    surveillés, une fois assez d'échantillons vus pour le device.
+    """
+
+    def __init__(self, threshold: Optional[float] = None, min_samples: Optional[int] = None,
+                 fields: Optional[Tuple[str, ...]] = None):
+        self.threshold = threshold or float(os.getenv("ZSCORE_THRESHOLD", "3.0"))
+        self.min_samples = min_samples or int(os.getenv("ZSCORE_MIN_SAMPLES", "30"))
+        self.fields = fields or tuple(
+            name.strip() for name in os.getenv("ZSCORE_FIELDS", "temperature,humidity").split(",") if name.strip()
+        )
+
+    def check(self, stream: Mapping[str, Mapping[str, Any]]) -> Optional[Tuple[str, float]]:
+        """(champ, z) du plus fort dépassement, ou None"""
+        worst = None
+        for name in self.fields:
+            stats = stream.get(name)
+            # count inclut l'échantillon courant, le z-score a été calculé sans lui
+            if not stats or stats["z"] is None or stats["count"] - 1 < self.min_samples:
+                continue
+            if abs(stats["z"]) >= self.threshold and (worst is None or abs(stats["z"]) > abs(worst[1])):
+                worst = (name, stats["z"])
+        return worst
@@ -0,0 +1,112 @@
+"""
+Decoding and validation of bulk telemetry uploads.
+A batch body is either a JSON array or NDJSON (one object per line), optionally
+gzip-compressed. Items are validated together; invalid items are reported by
+index and do not reject the rest of the batch.
+"""
+import json
+import os
+import zlib
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+MAX_ITEMS = int(os.getenv("TELEMETRY_BATCH_MAX_ITEMS", "10000"))
+# Limit on the decompressed body size (guards against gzip bombs)
+MAX_BYTES = int(os.getenv("TELEMETRY_BATCH_MAX_BYTES", str(32 * 1024 * 1024)))
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+class BatchTooLarge(ValueError):
+    """Batch exceeds TELEMETRY_BATCH_MAX_ITEMS / TELEMETRY_BATCH_MAX_BYTES"""
+
+
+def decompress(body: bytes, content_encoding: Optional[str] = None, max_bytes: int = MAX_BYTES) -> bytes:
+    """Gunzip the body if it is gzip-encoded (header or magic bytes), within max_bytes"""
+    gzipped = (content_encoding or "").strip().lower() in ("gzip", "x-gzip") or body[:2] == _GZIP_MAGIC
+    if not gzipped:
+        if len(body) > max_bytes:
+            raise BatchTooLarge(f"Body larger than {max_bytes} bytes")
+        return body
+    try:
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = decoder.decompress(body, max_bytes + 1)
+    except zlib.error as e:
+        raise ValueError(f"Invalid gzip body: {e}")
+    if len(data) > max_bytes:
+        raise BatchTooLarge(f"Decompressed body larger than {max_bytes} bytes")
+    return data
+
+
+def split_items(data: bytes, content_type: Optional[str] = None) -> List[Tuple[Any, Optional[str]]]:
+    """
+    Raw items of a batch as (item, decode error) pairs.
+
+    A body starting with "[" (and not declared as NDJSON) is a JSON array;
+    otherwise each non-empty line is one JSON document.
+    """
+    text = data.decode("utf-8-sig")
+    ndjson = "ndjson" in (content_type or "").lower() or "jsonl" in (content_type or "").lower()
+    if not ndjson and text.lstrip().startswith("["):
+        try:
+            items = json.loads(text)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON array: {e}")
+        return [(item, None) for item in items]
+
+    items: List[Tuple[Any, Optional[str]]] = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append((json.loads(line), None))
+        except ValueError as e:
+            items.append((None, f"Invalid JSON: {e}"))
+    return items
+
+
+def validate_items(model: Type[BaseModel], items: List[Any]) -> Tuple[Dict[int, BaseModel], Dict[int, str]]:
+    """
+    Validate every item against `model` in one pass over the list.
+
+    Returns:
+        ({index: instance}, {index: error message})
+    """
+    adapter = TypeAdapter(List[model])
+    try:
+        return dict(enumerate(adapter.validate_python(items))), {}
+    except ValidationError as e:
+        errors: Dict[int, List[str]] = {}
+        for error in e.errors():
+            index, *loc = error["loc"]
+            errors.setdefault(index, []).append(f"{'.'.join(str(p) for p in loc) or 'item'}: {error['msg']}")
+
+    # Second pass over the valid items only, keeping their original indices
+    valid_indices = [i for i in range(len(items)) if i not in errors]
+    valid = adapter.validate_python([items[i] for i in valid_indices])
+    return dict(zip(valid_indices, valid)), {i: "; ".join(msgs) for i, msgs in errors.items()}
+
+
+def parse_batch(model: Type[BaseModel], body: bytes, content_type: Optional[str] = None,
+                content_encoding: Optional[str] = None,
+                max_items: int = MAX_ITEMS) -> Tuple[int, Dict[int, BaseModel], Dict[int, str]]:
+    """
+    Decode and validate a batch body.
+
+    Returns:
+        (item count, {index: valid instance}, {index: error message})
+
+    Raises:
+        BatchTooLarge: too many items or body too large
+        ValueError: the body cannot be decoded at all
+    """
+    raw = split_items(decompress(body, content_encoding), content_type)
+    if len(raw) > max_items:
+        raise BatchTooLarge(f"Batch of {len(raw)} items exceeds the limit of {max_items}")
+
+    errors = {i: error for i, (_, error) in enumerate(raw) if error}
+    decoded = [i for i in range(len(raw)) if i not in errors]
+    valid, invalid = validate_items(model, [raw[i][0] for i in decoded])
+    errors.update({decoded[i]: error for i, error in invalid.items()})
+    return len(raw), {decoded[i]: item for i, item in valid.items()}, errors
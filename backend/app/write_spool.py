@@ -0,0 +1,364 @@
+"""
+Append-only write-ahead spool for InfluxDB writes that could not be delivered.
+
+Records (line-protocol batches) are appended to segment files
+`<dir>/<seq>.seg`, each framed as
+
+    [uint32 payload length][uint32 crc32(payload)][payload]
+
+and read back strictly in append order. The read position is kept in
+`<dir>/cursor` and fully replayed segments are deleted. A record replayed
+twice (crash between the write and the cursor update) only rewrites the same
+points, which InfluxDB treats as an overwrite.
+
+A torn record (crash mid-append) or a CRC mismatch ends its segment: the
+reader moves on to the next one. Writes never append to a segment left by a
+previous process.
+
+Each writing process takes the first unlocked slot directory
+`<INFLUX_SPOOL_DIR>/<n>` so the API and ingest workers sharing a volume never
+write the same files. A slot left with records by a process that is gone
+(fewer processes after a restart, different start order) is unlocked:
+adopt_orphans() locks such slots so their records are replayed too.
+"""
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms: no slot locking
+    fcntl = None
+
+_HEADER = struct.Struct("<II")
+_SEGMENT_SUFFIX = ".seg"
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+class SpoolFull(Exception):
+    """The spool reached its size cap"""
+
+
+class WriteSpool:
+    """
+    Segmented, CRC-framed FIFO of byte records on local disk.
+
+    fsync policy (INFLUX_SPOOL_FSYNC):
+    - always: every append is fsynced before it returns
+    - interval: fsync at most every INFLUX_SPOOL_FSYNC_INTERVAL seconds (sync_if_due)
+    - never: left to the OS page cache
+    When the spool exceeds INFLUX_SPOOL_MAX_BYTES the oldest segments are dropped.
+    """
+
+    def __init__(self, directory: Optional[str] = None, segment_bytes: Optional[int] = None,
+                 max_bytes: Optional[int] = None, fsync: Optional[str] = None,
+                 fsync_interval: Optional[float] = None, slots: Optional[int] = None):
+        self.root = directory or os.getenv("INFLUX_SPOOL_DIR", "spool")
+        self.segment_bytes = segment_bytes or int(os.getenv("INFLUX_SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+        self.max_bytes = max_bytes or int(os.getenv("INFLUX_SPOOL_MAX_BYTES", str(1024 * 1024 * 1024)))
+        self.fsync = (fsync or os.getenv("INFLUX_SPOOL_FSYNC", "interval")).lower()
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError(f"INFLUX_SPOOL_FSYNC must be one of {', '.join(FSYNC_POLICIES)}")
+        self.fsync_interval = fsync_interval or float(os.getenv("INFLUX_SPOOL_FSYNC_INTERVAL", "1.0"))
+        self.slots = slots or int(os.getenv("INFLUX_SPOOL_SLOTS", "16"))
+
+        self.directory: Optional[str] = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+
+        # seq -> [bytes on disk, records not yet read]
+        self._segments: Dict[int, List[int]] = {}
+        self._write_seq: Optional[int] = None
+        self._write_file = None
+        self._read_seq: Optional[int] = None
+        self._read_offset = 0
+        self._read_file = None
+        self._read_file_seq: Optional[int] = None
+        self._peeked: Optional[int] = None
+        self._unsynced = False
+        self._last_sync = time.monotonic()
+
+        self.stats = {"appended": 0, "replayed": 0, "dropped": 0, "rejected": 0, "corrupt": 0}
+
+    # Lifecycle
+    def open(self) -> "WriteSpool":
+        """Lock a slot directory and index what previous processes left in it"""
+        os.makedirs(self.root, exist_ok=True)
+        for slot in range(self.slots):
+            directory = os.path.join(self.root, str(slot))
+            os.makedirs(directory, exist_ok=True)
+            if self._attach(directory):
+                break
+        else:
+            raise RuntimeError(f"No free spool slot in {self.root} ({self.slots} slots)")
+
+        depth = self.depth()
+        if depth["records"]:
+            print(f"Spool {self.directory}: {depth['records']} records ({depth['bytes']} bytes) to replay")
+        return self
+
+    def adopt_orphans(self) -> List["WriteSpool"]:
+        """
+        Lock the other slots that still hold records but no live process, and
+        return them as read-only spools to drain (close() each one once empty).
+        """
+        if fcntl is None or self.directory is None:
+            # Without locks a live process' slot cannot be told from an orphan
+            return []
+        orphans = []
+        for name in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, name)
+            if directory == self.directory or not os.path.isdir(directory):
+                continue
+            if not any(entry.endswith(_SEGMENT_SUFFIX) for entry in os.listdir(directory)):
+                continue
+            orphan = WriteSpool(self.root, self.segment_bytes, self.max_bytes, self.fsync,
+                                self.fsync_interval, self.slots)
+            if not orphan._attach(directory):
+                continue
+            depth = orphan.depth()
+            if not depth["segments"]:
+                orphan.close()
+                continue
+            # Segments holding only a torn tail are cleaned up by the drain
+            print(f"Spool {directory}: adopted {depth['records']} records ({depth['bytes']} bytes) to replay")
+            orphans.append(orphan)
+        return orphans
+
+    def _attach(self, directory: str) -> bool:
+        """Lock a slot directory and index it; False if another process holds it"""
+        lock_file = open(os.path.join(directory, "LOCK"), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self.directory = directory
+        self._lock_file = lock_file
+        with self._lock:
+            self._index()
+        return True
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            for handle in (self._write_file, self._read_file):
+                if handle:
+                    handle.close()
+            self._write_file = self._read_file = None
+            self._write_seq = None
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+    # Producer side
+    def append(self, payload: bytes):
+        """Append one record (raises SpoolFull if it cannot fit under the size cap)"""
+        size = _HEADER.size + len(payload)
+        with self._lock:
+            if size > self.max_bytes:
+                self.stats["rejected"] += 1
+                raise SpoolFull(f"Record of {size} bytes exceeds the spool cap")
+            self._enforce_cap(size)
+            if self._write_file is None or self._segments[self._write_seq][0] + size > self.segment_bytes:
+                self._roll()
+            self._write_file.write(_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._write_file.flush()
+            segment = self._segments[self._write_seq]
+            segment[0] += size
+            segment[1] += 1
+            self.stats["appended"] += 1
+            if self.fsync == "always":
+                os.fsync(self._write_file.fileno())
+            else:
+                self._unsynced = True
+
+    def sync_if_due(self):
+        """fsync pending appends under the "interval" policy"""
+        if self.fsync != "interval" or not self._unsynced:
+            return
+        with self._lock:
+            if time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    # Consumer side
+    def peek(self) -> Optional[bytes]:
+        """Oldest unread record, or None when the spool is empty"""
+        with self._lock:
+            while self._read_seq is not None:
+                payload = self._read_record()
+                if payload is not None:
+                    self._peeked = _HEADER.size + len(payload)
+                    return payload
+                if self._read_seq == self._write_seq:
+                    return None
+                self._finish_segment()
+            return None
+
+    def commit(self):
+        """Mark the record returned by peek() as delivered"""
+        with self._lock:
+            if self._peeked is None:
+                return
+            self._read_offset += self._peeked
+            self._peeked = None
+            self._segments[self._read_seq][1] -= 1
+            self.stats["replayed"] += 1
+            self._save_cursor()
+
+    # Metrics
+    def depth(self) -> Dict[str, int]:
+        """Records and bytes still to replay"""
+        with self._lock:
+            records = sum(segment[1] for segment in self._segments.values())
+            size = sum(segment[0] for segment in self._segments.values())
+            if self._read_seq in self._segments:
+                size -= self._read_offset
+            return {"records": records, "bytes": max(size, 0), "segments": len(self._segments)}
+
+    def get_metrics(self) -> Dict[str, Any]:
+        depth = self.depth()
+        with self._lock:
+            return {
+                **self.stats,
+                "depth_records": depth["records"],
+                "depth_bytes": depth["bytes"],
+                "segments": depth["segments"],
+                "max_bytes": self.max_bytes,
+                "fsync": self.fsync,
+                "directory": self.directory,
+            }
+
+    # Internals (called with the lock held)
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:012d}{_SEGMENT_SUFFIX}")
+
+    def _index(self):
+        seqs = sorted(int(name[:-len(_SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.endswith(_SEGMENT_SUFFIX) and name[:-len(_SEGMENT_SUFFIX)].isdigit())
+        cursor_seq, cursor_offset = self._load_cursor()
+        for seq in seqs:
+            if cursor_seq is not None and seq < cursor_seq:
+                os.remove(self._path(seq))
+                continue
+            start = cursor_offset if seq == cursor_seq else 0
+            self._segments[seq] = [os.path.getsize(self._path(seq)), self._count_records(seq, start)]
+        if self._segments:
+            self._read_seq = min(self._segments)
+            self._read_offset = cursor_offset if self._read_seq == cursor_seq else 0
+
+    def _count_records(self, seq: int, offset: int) -> int:
+        """Complete records from offset (headers only; a torn tail is not counted)"""
+        count = 0
+        size = os.path.getsize(self._path(seq))
+        with open(self._path(seq), "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return count
+                length, _ = _HEADER.unpack(header)
+                if f.tell() + length > size:
+                    return count
+                f.seek(length, os.SEEK_CUR)
+                count += 1
+
+    def _roll(self):
+        """Start a new segment for appends"""
+        if self._write_file:
+            self._sync()
+            self._write_file.close()
+        seq = max(self._segments) + 1 if self._segments else 0
+        self._write_seq = seq
+        self._write_file = open(self._path(seq), "ab")
+        self._segments[seq] = [0, 0]
+        if self._read_seq is None:
+            self._read_seq = seq
+            self._read_offset = 0
+
+    def _read_record(self) -> Optional[bytes]:
+        if self._read_file is None or self._read_file_seq != self._read_seq:
+            if self._read_file:
+                self._read_file.close()
+            self._read_file = open(self._path(self._read_seq), "rb")
+            self._read_file_seq = self._read_seq
+        self._read_file.seek(self._read_offset)
+        header = self._read_file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return None
+        length, crc = _HEADER.unpack(header)
+        payload = self._read_file.read(length)
+        if len(payload) < length:
+            return None
+        if zlib.crc32(payload) != crc:
+            print(f"Spool: CRC mismatch in {self._path(self._read_seq)} at {self._read_offset}, skipping segment")
+            self.stats["corrupt"] += 1
+            if self._read_seq == self._write_seq:
+                # Never happens for whole appends; do not stall on the active segment
+                self._roll()
+            return None
+        return payload
+
+    def _finish_segment(self):
+        """Delete the fully read (or unreadable) read segment"""
+        self.stats["corrupt"] += self._remove_segment(self._read_seq)
+
+    def _remove_segment(self, seq: int) -> int:
+        """Delete a segment; returns how many unread records it still held"""
+        if seq == self._write_seq:
+            self._write_file.close()
+            self._write_file = None
+            self._write_seq = None
+        if seq == self._read_seq and self._read_file:
+            self._read_file.close()
+            self._read_file = None
+        records = self._segments.pop(seq, [0, 0])[1]
+        try:
+            os.remove(self._path(seq))
+        except FileNotFoundError:
+            pass
+        if seq == self._read_seq:
+            later = [s for s in self._segments if s > seq]
+            self._read_seq = min(later) if later else None
+            self._read_offset = 0
+            self._peeked = None
+            self._save_cursor()
+        return records
+
+    def _enforce_cap(self, incoming: int):
+        """Drop the oldest segments until the incoming record fits"""
+        total = sum(segment[0] for segment in self._segments.values())
+        while self._segments and total + incoming > self.max_bytes:
+            oldest = min(self._segments)
+            total -= self._segments[oldest][0]
+            records = self._remove_segment(oldest)
+            self.stats["dropped"] += records
+            print(f"Spool over {self.max_bytes} bytes: dropped {records} records")
+
+    def _sync(self):
+        if self._write_file and self._unsynced:
+            os.fsync(self._write_file.fileno())
+        self._unsynced = False
+        self._last_sync = time.monotonic()
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, "cursor")) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (FileNotFoundError, ValueError):
+            return None, 0
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, "cursor")
+        if self._read_seq is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self._read_seq} {self._read_offset}")
+        os.replace(path + ".tmp", path)
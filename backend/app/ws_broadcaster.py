@@ -0,0 +1,333 @@
+"""
+WebSocket fan-out for live dashboard updates.
+Each message is serialized once, then pushed into a bounded per-client queue
+(the oldest message is dropped when a client falls behind). Every client is
+drained by its own sender task, so a slow browser never delays the others.
+Clients may restrict what they receive by device_id and message type, and
+may ask for telemetry coalesced to a fixed rate (latest value per device,
+optionally with min/max/mean over the window). Alerts are never coalesced.
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+# Message types eligible for coalescing; everything else is delivered as is
+COALESCED_TYPES = frozenset({"telemetry"})
+# Nested sections of a telemetry message whose numeric values are aggregated
+AGGREGATED_SECTIONS = ("sensors", "net")
+
+CoalesceKey = Tuple[float, bool]
+
+
+def _as_filter(values: Optional[Iterable[Any]]) -> Optional[Set[str]]:
+    """None / empty means "everything"; a comma-separated string is accepted"""
+    if values is None:
+        return None
+    if isinstance(values, str):
+        values = values.split(",")
+    selected = {str(v).strip() for v in values if str(v).strip()}
+    return selected or None
+
+
+def _as_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+class TelemetryCoalescer:
+    """
+    Latest telemetry message per device over a window, with optional
+    count/min/max/mean of the numeric sensor and network values.
+    """
+
+    def __init__(self, aggregate: bool = False):
+        self.aggregate = aggregate
+        self.latest: Dict[Any, Dict[str, Any]] = {}
+        self.samples: Dict[Any, int] = {}
+        # device -> section -> field -> [min, max, sum, count]
+        self.stats: Dict[Any, Dict[str, Dict[str, List[float]]]] = {}
+
+    def add(self, message: Dict[str, Any]):
+        device_id = message.get("device_id")
+        self.latest[device_id] = message
+        self.samples[device_id] = self.samples.get(device_id, 0) + 1
+        if not self.aggregate:
+            return
+        device_stats = self.stats.setdefault(device_id, {})
+        for section in AGGREGATED_SECTIONS:
+            values = message.get(section)
+            if not isinstance(values, dict):
+                continue
+            section_stats = device_stats.setdefault(section, {})
+            for name, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                acc = section_stats.get(name)
+                if acc is None:
+                    section_stats[name] = [value, value, value, 1]
+                else:
+                    acc[0] = min(acc[0], value)
+                    acc[1] = max(acc[1], value)
+                    acc[2] += value
+                    acc[3] += 1
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """Messages for the elapsed window (one per device) and reset"""
+        out = []
+        for device_id, message in self.latest.items():
+            message = {**message, "samples": self.samples[device_id]}
+            if self.aggregate:
+                message["window"] = {
+                    section: {name: {"min": acc[0], "max": acc[1], "mean": acc[2] / acc[3], "count": acc[3]}
+                              for name, acc in fields.items()}
+                    for section, fields in self.stats.get(device_id, {}).items()
+                }
+            out.append(message)
+        self.latest, self.samples, self.stats = {}, {}, {}
+        return out
+
+
+class WebSocketClient:
+    """One connected socket: subscription filters, bounded queue and sender task"""
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.device_ids: Optional[Set[str]] = None
+        self.types: Optional[Set[str]] = None
+        # Telemetry rate in Hz (0: every sample) and window aggregation
+        self.rate_hz = 0.0
+        self.aggregate = False
+        self.queue: Deque[str] = deque(maxlen=queue_size)
+        self.dropped = 0
+        self.sent = 0
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def subscribe(self, device_ids: Optional[Iterable[Any]] = None, types: Optional[Iterable[Any]] = None,
+                  rate_hz: float = 0.0, aggregate: bool = False):
+        self.device_ids = _as_filter(device_ids)
+        self.types = _as_filter(types)
+        self.rate_hz = rate_hz
+        self.aggregate = aggregate and rate_hz > 0
+
+    @property
+    def coalesce_key(self) -> Optional[CoalesceKey]:
+        return (self.rate_hz, self.aggregate) if self.rate_hz > 0 else None
+
+    def subscription(self) -> Dict[str, Any]:
+        return {
+            "device_ids": sorted(self.device_ids) if self.device_ids else None,
+            "types": sorted(self.types) if self.types else None,
+            "rate": self.rate_hz or None,
+            "aggregate": self.aggregate,
+        }
+
+    def wants(self, message_type: Optional[str], device_id: Optional[str]) -> bool:
+        if self.types is not None and message_type not in self.types:
+            return False
+        # Messages not tied to a device (system, ping...) pass the device filter
+        if self.device_ids is not None and device_id is not None and device_id not in self.device_ids:
+            return False
+        return True
+
+    def put(self, text: str):
+        """Enqueue a serialized message, dropping the oldest one when full (never blocks)"""
+        if self.closed:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(text)
+        self._ready.set()
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._sender())
+
+    async def _sender(self):
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+                while self.queue:
+                    await self.websocket.send_text(self.queue.popleft())
+                    self.sent += 1
+        except Exception:
+            # Socket gone: the endpoint's receive loop ends and unregisters the client
+            self.closed = True
+
+    async def close(self):
+        self.closed = True
+        self.queue.clear()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+class WebSocketBroadcaster:
+    """
+    Registry of connected clients and non-blocking fan-out.
+
+    `publish` may be called from any thread; the fan-out itself runs on the
+    event loop the clients are attached to and only appends to client queues.
+    Clients subscribed at the same (rate, aggregate) share one coalescer whose
+    ticker task emits each window's messages, serialized once for the group.
+    """
+
+    def __init__(self, queue_size: Optional[int] = None, default_rate_hz: Optional[float] = None,
+                 max_rate_hz: Optional[float] = None):
+        self.queue_size = queue_size or int(os.getenv("WS_CLIENT_QUEUE_SIZE", "256"))
+        self.default_rate_hz = default_rate_hz if default_rate_hz is not None else float(os.getenv("WS_TELEMETRY_RATE_HZ", "0"))
+        self.max_rate_hz = max_rate_hz or float(os.getenv("WS_MAX_TELEMETRY_RATE_HZ", "20"))
+        self.clients: Set[WebSocketClient] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.coalescers: Dict[CoalesceKey, TelemetryCoalescer] = {}
+        self._tickers: Dict[CoalesceKey, asyncio.Task] = {}
+        self._metrics_lock = threading.Lock()
+        self._metrics = {"published": 0, "delivered": 0, "filtered": 0, "coalesced": 0,
+                         "coalesced_delivered": 0, "serialization_errors": 0}
+
+    def parse_rate(self, value: Any) -> float:
+        """Requested telemetry rate in Hz: default when absent/invalid, 0 for raw, capped at max_rate_hz"""
+        if value is None or value == "":
+            return self.default_rate_hz
+        try:
+            rate = float(value)
+        except (TypeError, ValueError):
+            return self.default_rate_hz
+        if rate != rate or rate <= 0:
+            return 0.0
+        return round(min(rate, self.max_rate_hz), 2)
+
+    async def connect(self, websocket: WebSocket, device_ids: Optional[Iterable[Any]] = None,
+                      types: Optional[Iterable[Any]] = None, rate: Any = None,
+                      aggregate: Any = False) -> WebSocketClient:
+        """Accept the socket, register it and start its sender task"""
+        await websocket.accept()
+        self.loop = asyncio.get_running_loop()
+        client = WebSocketClient(websocket, self.queue_size)
+        self.subscribe(client, device_ids, types, rate, aggregate)
+        client.start()
+        self.clients.add(client)
+        return client
+
+    def subscribe(self, client: WebSocketClient, device_ids: Optional[Iterable[Any]] = None,
+                  types: Optional[Iterable[Any]] = None, rate: Any = None, aggregate: Any = False):
+        """Replace the client's filters and telemetry rate"""
+        client.subscribe(device_ids, types, self.parse_rate(rate), _as_bool(aggregate))
+
+    async def disconnect(self, client: WebSocketClient):
+        self.clients.discard(client)
+        await client.close()
+
+    def send(self, client: WebSocketClient, message: Dict[str, Any]):
+        """Queue a message for one client (replies to pings, subscription acks)"""
+        client.put(json.dumps(message, default=str))
+
+    def publish(self, message: Dict[str, Any]):
+        """Fan a message out to matching clients; safe to call from any thread"""
+        if not self.clients or self.loop is None or self.loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._fan_out(message)
+        else:
+            self.loop.call_soon_threadsafe(self._fan_out, message)
+
+    def _fan_out(self, message: Dict[str, Any]):
+        message_type = message.get("type")
+        device_id = message.get("device_id")
+        coalesce = message_type in COALESCED_TYPES
+        text = None
+        delivered = filtered = 0
+        groups: Set[CoalesceKey] = set()
+        for client in list(self.clients):
+            if not client.wants(message_type, device_id):
+                filtered += 1
+                continue
+            if coalesce and client.coalesce_key is not None:
+                groups.add(client.coalesce_key)
+                continue
+            if text is None:
+                # Serialized once, and only if at least one client wants it
+                try:
+                    text = json.dumps(message, default=str)
+                except (TypeError, ValueError):
+                    self._incr("serialization_errors")
+                    return
+            client.put(text)
+            delivered += 1
+        for key in groups:
+            self._coalescer(key).add(message)
+        self._incr("published")
+        self._incr("delivered", delivered)
+        self._incr("filtered", filtered)
+        self._incr("coalesced", len(groups))
+
+    def _coalescer(self, key: CoalesceKey) -> TelemetryCoalescer:
+        """Coalescer of a (rate, aggregate) group, starting its ticker on first use (loop thread)"""
+        coalescer = self.coalescers.get(key)
+        if coalescer is None:
+            coalescer = self.coalescers[key] = TelemetryCoalescer(aggregate=key[1])
+            self._tickers[key] = self.loop.create_task(self._tick(key, coalescer))
+        return coalescer
+
+    async def _tick(self, key: CoalesceKey, coalescer: TelemetryCoalescer):
+        interval = 1.0 / key[0]
+        while True:
+            await asyncio.sleep(interval)
+            members = [c for c in self.clients if c.coalesce_key == key]
+            if not members:
+                # Nobody left at this rate: pending samples are discarded
+                self.coalescers.pop(key, None)
+                self._tickers.pop(key, None)
+                return
+            delivered = 0
+            for message in coalescer.drain():
+                message_type, device_id = message.get("type"), message.get("device_id")
+                text = None
+                for client in members:
+                    if not client.wants(message_type, device_id):
+                        continue
+                    if text is None:
+                        text = json.dumps(message, default=str)
+                    client.put(text)
+                    delivered += 1
+            self._incr("coalesced_delivered", delivered)
+
+    async def close(self):
+        """Stop the coalescing tickers and disconnect every client"""
+        for task in list(self._tickers.values()):
+            task.cancel()
+        self._tickers.clear()
+        self.coalescers.clear()
+        for client in list(self.clients):
+            await self.disconnect(client)
+
+    def _incr(self, key: str, amount: int = 1):
+        with self._metrics_lock:
+            self._metrics[key] += amount
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        clients = list(self.clients)
+        metrics.update({
+            "clients": len(clients),
+            "queue_capacity": self.queue_size,
+            "queued": sum(len(c.queue) for c in clients),
+            "dropped": sum(c.dropped for c in clients),
+            "coalescing_groups": sorted(f"{rate}Hz{'+agg' if aggregate else ''}" for rate, aggregate in self.coalescers),
+        })
+        return metrics
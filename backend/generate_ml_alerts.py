@@ -118,6 +118,7 @@ def generate_ml_alerts(count=20):
             score=score,
             reason=scenario["reason"],
             acknowledged=random.random() > 0.7,  # 30% acknowledged
+            source="ml",
             metadata=metadata
         )
         
@@ -127,6 +128,8 @@ def generate_ml_alerts(count=20):
         else:
             print(f"✗ Failed to save alert {i+1}")
     
+    # Alerts are written by the batching pipeline; wait for it to drain
+    influx_data_service.flush(timeout=30)
     print(f"\n✅ Generated {count} diverse ML alerts successfully!")
 
 if __name__ == "__main__":
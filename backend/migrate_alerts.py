@@ -0,0 +1,145 @@
+"""
+Migrate the "alerts" measurement to the v2 (low-cardinality) schema.
+
+v1 alerts carry alert_id as a tag (one series per alert); they are read window
+by window, rewritten with alert_id as a field and device_id/severity/source as
+tags, and the v1 series of the window are deleted once the rewrite is written.
+An alert whose v2 point would overwrite another one (same series and timestamp)
+is reported and left in v1.
+
+    python migrate_alerts.py --start 365d --window 1d --batch-size 5000
+    python migrate_alerts.py --dry-run
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+
+import argparse
+import json
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+from app.influxdb_data_service import influx_data_service, AlertData, alert_point, alert_source, alert_time_ns
+from app.flux_query import parse_duration
+from app.flux_records import stream_records
+
+# v1 rows are the ones still tagged with alert_id
+V1_ALERTS_QUERY = '''
+from(bucket: params.bucket)
+|> range(start: params.start, stop: params.stop)
+|> filter(fn: (r) => r._measurement == "alerts" and exists r.alert_id)
+|> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+'''
+
+
+def to_alert(record) -> AlertData:
+    """AlertData from a pivoted v1 record"""
+    try:
+        metadata = json.loads(record.get("metadata") or "{}")
+    except ValueError:
+        metadata = {}
+    return AlertData(
+        alert_id=record["alert_id"],
+        device_id=record.get("device_id") or "unknown",
+        ts=record["ts"],
+        severity=record.get("severity") or "unknown",
+        score=float(record.get("score") or 0.0),
+        reason=record.get("reason") or None,
+        acknowledged=bool(record.get("acknowledged")),
+        metadata=metadata if isinstance(metadata, dict) else {},
+    )
+
+
+def migrate_window(service, write_api, start: datetime, stop: datetime, batch_size: int,
+                   dry_run: bool, keep_old: bool) -> Tuple[int, List[str]]:
+    """
+    Rewrite the v1 alerts of [start, stop).
+
+    Returns how many were migrated and the alert_ids skipped because their v2
+    point collides with an alert already rewritten in the window.
+    """
+    params = {"bucket": service.bucket, "start": start, "stop": stop}
+    rows = stream_records(service.query_api.query_stream(V1_ALERTS_QUERY, params=params))
+
+    migrated_ids = []
+    collisions = []
+    points_seen = set()
+    batch = []
+    for record in rows:
+        if not record.get("alert_id") or record.get("ts") is None:
+            continue
+        alert = to_alert(record)
+        point_key = (alert.device_id, alert.severity, alert_source(alert), alert_time_ns(alert))
+        if point_key in points_seen:
+            collisions.append(alert.alert_id)
+            continue
+        points_seen.add(point_key)
+        batch.append(alert_point(alert))
+        migrated_ids.append(alert.alert_id)
+        if len(batch) >= batch_size:
+            if not dry_run:
+                write_api.write(bucket=service.bucket, org=service.org, record=batch)
+            batch = []
+    if batch and not dry_run:
+        write_api.write(bucket=service.bucket, org=service.org, record=batch)
+
+    if migrated_ids and not dry_run and not keep_old:
+        # The delete predicate has no OR / IN: one call per v1 series
+        for alert_id in migrated_ids:
+            service.delete_api.delete(
+                start=start,
+                stop=stop,
+                predicate=f'_measurement="alerts" AND alert_id="{alert_id}"',
+                bucket=service.bucket,
+                org=service.org
+            )
+    return len(migrated_ids), collisions
+
+
+def migrate_alerts(start: str = "365d", window: str = "1d", batch_size: int = 5000,
+                   dry_run: bool = False, keep_old: bool = False):
+    service = influx_data_service
+    if not service.is_connected():
+        print("❌ InfluxDB not connected")
+        return 1
+
+    # Direct synchronous writes: each window is written before its v1 series are deleted
+    write_api = service.client.write_api(write_options=SYNCHRONOUS)
+    stop = datetime.utcnow() + timedelta(minutes=1)
+    cursor = stop - parse_duration(start)
+    step = parse_duration(window)
+
+    total = 0
+    collisions = []
+    print(f"Migrating alerts from {cursor.isoformat()} to {stop.isoformat()} by {window}"
+          + (" (dry run)" if dry_run else ""))
+    while cursor < stop:
+        window_stop = min(cursor + step, stop)
+        count, skipped = migrate_window(service, write_api, cursor, window_stop, batch_size, dry_run, keep_old)
+        if count:
+            print(f"✓ {cursor.isoformat()} → {window_stop.isoformat()}: {count} alerts")
+        for alert_id in skipped:
+            print(f"⚠️  {alert_id}: same v2 point as another alert, kept in v1")
+        total += count
+        collisions.extend(skipped)
+        cursor = window_stop
+
+    print(f"\n✅ {total} alerts {'to migrate' if dry_run else 'migrated'} to schema v2")
+    if collisions:
+        print(f"⚠️  {len(collisions)} colliding alerts left in v1")
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Migrate alerts to the low-cardinality schema (v2)')
+    parser.add_argument('--start', default='365d', help='How far back to migrate (e.g. 30d, 52w)')
+    parser.add_argument('--window', default='1d', help='Time window processed per step')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Points per write')
+    parser.add_argument('--dry-run', action='store_true', help='Count v1 alerts without writing')
+    parser.add_argument('--keep-old', action='store_true', help='Do not delete the v1 series after rewriting')
+    args = parser.parse_args()
+
+    sys.exit(migrate_alerts(args.start, args.window, args.batch_size, args.dry_run, args.keep_old))
@@ -0,0 +1,48 @@
+"""
+Parité de la forêt compilée (parcours vectorisé) avec scikit-learn.
+"""
+import numpy as np
+import pytest
+from sklearn.ensemble import IsolationForest
+
+from app.forest_artifact import ArtifactError, ForestArtifact, verify_parity
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(2000, 7)).astype(np.float32)
+    model = IsolationForest(n_estimators=50, random_state=42).fit(X)
+    # Points hors distribution : chemins courts, feuilles peu profondes
+    X_test = np.vstack([rng.normal(size=(500, 7)), rng.normal(scale=6.0, size=(100, 7))]).astype(np.float32)
+    return model, X_test
+
+
+def test_parity_in_memory(fitted):
+    model, X = fitted
+    assert verify_parity(model, ForestArtifact.from_model(model), X) <= 1e-9
+
+
+def test_parity_memory_mapped(fitted, tmp_path):
+    model, X = fitted
+    path = str(tmp_path / "model.ifm")
+    ForestArtifact.from_model(model).save(path)
+    forest = ForestArtifact.load(path, mmap=True)
+    assert isinstance(forest.children, np.memmap)
+    assert verify_parity(model, forest, X) <= 1e-9
+    np.testing.assert_array_equal(forest.decision_function(X) < 0, model.predict(X) == -1)
+
+
+def test_parity_max_features(tmp_path):
+    # Sous-ensemble de features par arbre : indices remappés à la compilation
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(1000, 7)).astype(np.float32)
+    model = IsolationForest(n_estimators=30, max_features=4, random_state=0).fit(X)
+    assert verify_parity(model, ForestArtifact.from_model(model), X) <= 1e-9
+
+
+def test_parity_failure_raises(fitted):
+    model, X = fitted
+    other = IsolationForest(n_estimators=50, random_state=7).fit(X)
+    with pytest.raises(ArtifactError):
+        verify_parity(model, ForestArtifact.from_model(other), X)
@@ -0,0 +1,95 @@
+"""
+Spool d'écriture InfluxDB : rejeu après crash, reprise au curseur, plafond de taille.
+"""
+import os
+
+import pytest
+
+from app.write_spool import WriteSpool, fcntl
+
+
+def make_spool(root, **kwargs):
+    kwargs.setdefault("fsync", "never")
+    return WriteSpool(str(root), **kwargs).open()
+
+
+def drain(spool):
+    records = []
+    while (payload := spool.peek()) is not None:
+        records.append(payload)
+        spool.commit()
+    return records
+
+
+def segments(spool):
+    return sorted(name for name in os.listdir(spool.directory) if name.endswith(".seg"))
+
+
+def test_replay_after_torn_tail(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append(b"cpu a=1")
+    spool.append(b"cpu a=2")
+    spool.close()
+
+    # Crash au milieu du dernier append : l'enregistrement tronqué est ignoré
+    path = os.path.join(spool.directory, segments(spool)[-1])
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+
+    spool = make_spool(tmp_path)
+    assert spool.depth()["records"] == 1
+    # Les nouveaux enregistrements ne prolongent pas le segment endommagé
+    spool.append(b"cpu a=3")
+    assert drain(spool) == [b"cpu a=1", b"cpu a=3"]
+    assert spool.depth()["records"] == 0
+    spool.close()
+
+
+def test_resume_from_cursor(tmp_path):
+    spool = make_spool(tmp_path)
+    for i in range(3):
+        spool.append(f"cpu a={i}".encode())
+    assert spool.peek() == b"cpu a=0"
+    spool.commit()
+    # Lu mais pas acquitté : rejoué au redémarrage
+    assert spool.peek() == b"cpu a=1"
+    spool.close()
+
+    spool = make_spool(tmp_path)
+    assert spool.depth()["records"] == 2
+    assert drain(spool) == [b"cpu a=1", b"cpu a=2"]
+    spool.close()
+
+    spool = make_spool(tmp_path)
+    assert spool.peek() is None
+    spool.close()
+
+
+def test_size_cap_drops_oldest_segments(tmp_path):
+    record_size = 8 + len(b"cpu a=0")
+    # Un enregistrement par segment, trois au plus sur disque
+    spool = make_spool(tmp_path, segment_bytes=record_size, max_bytes=3 * record_size)
+    for i in range(5):
+        spool.append(f"cpu a={i}".encode())
+
+    assert spool.stats["dropped"] == 2
+    assert len(segments(spool)) == 3
+    assert drain(spool) == [b"cpu a=2", b"cpu a=3", b"cpu a=4"]
+    spool.close()
+
+
+@pytest.mark.skipif(fcntl is None, reason="slot locking requires fcntl")
+def test_adopt_orphan_slot(tmp_path):
+    live = make_spool(tmp_path, slots=4)
+    gone = make_spool(tmp_path, slots=4)
+    assert gone.directory != live.directory
+    gone.append(b"cpu a=1")
+    gone.close()
+
+    orphans = live.adopt_orphans()
+    assert [orphan.directory for orphan in orphans] == [gone.directory]
+    assert drain(orphans[0]) == [b"cpu a=1"]
+    orphans[0].close()
+    # Le slot encore verrouillé par un processus vivant n'est jamais adopté
+    assert live.adopt_orphans() == []
+    live.close()
@@ -30,7 +30,7 @@ export default function Dashboard() {
   const seenAlertsRef = useRef(new Set())
 
   // WebSocket for real-time updates
-  const wsUrl = `ws://localhost:18000/ws` // Backend WebSocket endpoint
+  const wsUrl = `ws://localhost:18000/ws?rate=1` // Backend WebSocket endpoint (telemetry coalesced to 1 Hz per device)
   const { isConnected: wsConnected } = useWebSocket(wsUrl, (data) => {
     if (data.type === 'telemetry') {
       // Update device data in real-time